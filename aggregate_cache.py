@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+# On-disk cache of derived aggregates (hourly statistics, lucrative pair lines, ...).
+# Each artifact is an .npz file named after a hash of everything it was computed from, so a changed input
+# (e.g. new snapshots in the store, or a different constant) just means a different key, and old artifacts are
+# evicted (least recently used first) once the cache grows past MAX_CACHE_BYTES.
+
+CACHE_DIR = "data/cache"
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# change this whenever the way any cached artifact is computed changes
+CACHE_VERSION = 3
+
+
+def store_fingerprint(store):
+    """Summary of the snapshot store contents that changes whenever snapshots or stations are added."""
+    return {
+        "num_snapshots": len(store),
+        "first_timestamp": int(store.timestamps[0]) if len(store) > 0 else None,
+        "last_timestamp": int(store.timestamps[-1]) if len(store) > 0 else None,
+        "station_ids": hashlib.sha256(json.dumps(store.station_ids).encode()).hexdigest(),
+        # hours and weekdays are in local time
+        "time_zone": time.tzname
+    }
+
+
+def rows_fingerprint(store, rows):
+    """Summary of some of the snapshots in the store (e.g. only the weekend ones) that changes whenever they do."""
+    timestamps = np.ascontiguousarray(store.timestamps[rows], dtype=np.int64)
+    return {
+        "num_snapshots": len(timestamps),
+        "timestamps": hashlib.sha256(timestamps.tobytes()).hexdigest(),
+        "station_ids": hashlib.sha256(json.dumps(store.station_ids).encode()).hexdigest(),
+        "time_zone": time.tzname
+    }
+
+
+def cache_key(name, **inputs):
+    """
+    :param name: name of the kind of artifact (e.g. "hourly_statistics")
+    :param inputs: everything the artifact depends on (must be JSON serializable)
+    """
+    contents = json.dumps([CACHE_VERSION, name, inputs], sort_keys=True)
+    return f"{name}-{hashlib.sha256(contents.encode()).hexdigest()}"
+
+
+def load(key, cache_dir=CACHE_DIR):
+    """Returns the cached arrays (as a dict) for the key, or None if they aren't cached."""
+    path = f"{cache_dir}/{key}.npz"
+    try:
+        with np.load(path) as cached:
+            arrays = {name: cached[name] for name in cached.files}
+    except FileNotFoundError:
+        return None
+    # the modification time is used as the last access time for eviction
+    os.utime(path)
+    return arrays
+
+
+def save(key, arrays, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = f"{cache_dir}/{key}.npz"
+    np.savez(f"{path}.tmp.npz", **arrays)
+    os.replace(f"{path}.tmp.npz", path)
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """Deletes the least recently used artifacts until the cache is no larger than max_bytes."""
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(".npz") and not filename.endswith(".tmp.npz"):
+            file_stat = os.stat(f"{cache_dir}/{filename}")
+            entries.append((file_stat.st_mtime, file_stat.st_size, filename))
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, filename in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        os.remove(f"{cache_dir}/{filename}")
+        total_bytes -= size
+
+
+def cached(key, compute, cache_dir=CACHE_DIR):
+    """Returns the cached arrays for the key, or computes them with compute() (which returns a dict) and caches them."""
+    arrays = load(key, cache_dir)
+    if arrays is None:
+        arrays = compute()
+        save(key, arrays, cache_dir)
+    return arrays
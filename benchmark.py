@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+import map_station_trends
+import process_data
+import snapshot_store
+
+# Times the main stages of the pipeline on a synthetic archive (so the results don't depend on the data on hand),
+# and compares them against a saved baseline to catch regressions:
+#
+#   ./benchmark.py -o baseline.json                  # save the results
+#   ./benchmark.py --baseline baseline.json          # exits with status 1 if any stage got slower
+
+DEFAULT_STATIONS = 400
+DEFAULT_DAYS = 7
+DEFAULT_REPEATS = 3
+# a stage counts as a regression if its median time grew by more than this fraction of the baseline
+DEFAULT_TOLERANCE = 0.2
+SNAPSHOT_SECONDS = 5 * 60
+# Monday 2020-11-02 00:00 UTC
+START_TIMESTAMP = 1604275200
+
+
+def synthetic_feed(num_stations, days, seed=0, start=START_TIMESTAMP, interval=SNAPSHOT_SECONDS):
+    """
+    Generates raw feed snapshots (in the format process_file_contents reads) for stations scattered over the map,
+    whose bikes and points change by random walks.
+
+    :return: list of (timestamp, contents) pairs
+    """
+    rng = np.random.default_rng(seed)
+    left, right, bottom, top = map_station_trends.BBOX
+    latitudes = rng.uniform(bottom, top, num_stations).round(6).tolist()
+    longitudes = rng.uniform(left, right, num_stations).round(6).tolist()
+    capacities = rng.integers(11, 31, num_stations)
+    bikes = rng.integers(0, capacities + 1)
+    points = rng.integers(-2, 3, num_stations)
+    snapshots = []
+    for step in range(int(days * 24 * 60 * 60 / interval)):
+        bikes = np.clip(bikes + rng.integers(-1, 2, num_stations), 0, capacities)
+        points = np.clip(points + rng.integers(-1, 2, num_stations) * (rng.random(num_stations) < 0.1), -3, 3)
+        features = [{"geometry": {"coordinates": [longitudes[i], latitudes[i]]},
+                     "properties": {"station": {"id": str(i + 1), "name": f"Station {i + 1}",
+                                                "installed": True, "renting": True, "returning": True,
+                                                "bikes_available": bikes_available,
+                                                "docks_available": capacity - bikes_available,
+                                                "capacity": capacity},
+                                    "bike_angels": {"score": score}}}
+                    for i, (bikes_available, capacity, score)
+                    in enumerate(zip(bikes.tolist(), capacities.tolist(), points.tolist()))]
+        snapshots.append((start + step * interval, {"features": features}))
+    return snapshots
+
+
+def time_stage(function, repeats, setup=None):
+    """
+    Calls function() repeats times (after setup(), if given, which isn't timed).
+
+    :return: dict of the min and median times (in seconds), and the result of the last call
+    """
+    times = []
+    result = None
+    for _ in range(repeats):
+        arguments = setup() if setup is not None else ()
+        start = time.perf_counter()
+        result = function(*arguments)
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "repeats": repeats}, result
+
+
+def run_benchmarks(num_stations, days, repeats, seed=0):
+    """Runs every stage in a temporary directory (which stands in for the repository's data/ directory)."""
+    results = {}
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            os.makedirs("data/processed_output")
+
+            def ingest(snapshots):
+                process_data.overall_stations = {}
+                # (without the log of every station added)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return [(timestamp, process_data.process_file_contents(timestamp, contents))
+                            for timestamp, contents in snapshots]
+
+            # process_file_contents modifies the snapshots, so each repeat gets new ones
+            results["process_file_contents"], records = time_stage(
+                ingest, repeats, setup=lambda: (synthetic_feed(num_stations, days, seed),))
+            results["write_store"], _ = time_stage(
+                lambda: snapshot_store.write_store(*snapshot_store.records_to_arrays(records)), repeats)
+
+            results["read_first_station_status_every_hour"], all_stations = time_stage(
+                map_station_trends.read_first_station_status_every_hour, repeats)
+            results["get_aggregate_station_statistics_by_hour"], all_station_statistics = time_stage(
+                lambda: map_station_trends.get_aggregate_station_statistics_by_hour(all_stations, False), repeats)
+
+            station_ids_list = list(all_stations)
+            coords = [process_data.overall_stations[station_id]["coords"][-1][1] for station_id in station_ids_list]
+            latitudes_list = [latitude for latitude, _ in coords]
+            longitudes_list = [longitude for _, longitude in coords]
+            results["calculate_nearby_stations"], _ = time_stage(
+                lambda: map_station_trends.calculate_nearby_stations(station_ids_list, latitudes_list,
+                                                                     longitudes_list), repeats)
+
+            averages_list = [[all_station_statistics[hour][station_id][0] for station_id in station_ids_list]
+                             for hour in range(24)]
+            stdevs_list = [[all_station_statistics[hour][station_id][1] for station_id in station_ids_list]
+                           for hour in range(24)]
+            # the nearby pairs are cached by the first call (as in the real pipeline)
+            map_station_trends.load_nearby_stations(station_ids_list, latitudes_list, longitudes_list)
+            results["calculate_lucrative_station_pairs"], lines = time_stage(
+                lambda: map_station_trends.calculate_lucrative_station_pairs(station_ids_list, latitudes_list,
+                                                                             longitudes_list, averages_list), repeats)
+
+            colors_list = [map_station_trends.average_to_color(avg) for avg in averages_list[8]]
+            sizes_list = [map_station_trends.stdev_to_size(avg, stdev)
+                          for avg, stdev in zip(averages_list[8], stdevs_list[8])]
+            background = np.zeros((100, 100, 3))
+            plt.switch_backend("Agg")
+            fig, ax = plt.subplots()
+            ax.set_xlim(map_station_trends.BBOX[0], map_station_trends.BBOX[1])
+            ax.set_ylim(map_station_trends.BBOX[2], map_station_trends.BBOX[3])
+
+            def draw_frame():
+                map_station_trends.draw(ax, background, 8, False, longitudes_list, latitudes_list, colors_list,
+                                        sizes_list, station_ids_list, lines[8], averages_list[8], stdevs_list[8],
+                                        False)
+                fig.canvas.draw()
+
+            results["draw"], _ = time_stage(draw_frame, repeats)
+            plt.close(fig)
+        finally:
+            os.chdir(working_dir)
+    return results
+
+
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    :return: list of (stage, baseline median, median, ratio, is regression) tuples for the stages in both
+    """
+    comparison = []
+    for stage, result in results.items():
+        if stage in baseline:
+            ratio = result["median"] / baseline[stage]["median"]
+            comparison.append((stage, baseline[stage]["median"], result["median"], ratio, ratio > 1 + tolerance))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time the pipeline stages on a synthetic archive")
+    parser.add_argument("-s", "--stations", type=int, default=DEFAULT_STATIONS,
+                        help=f"number of stations (default: {DEFAULT_STATIONS})")
+    parser.add_argument("-d", "--days", type=float, default=DEFAULT_DAYS,
+                        help=f"days of 5-minute snapshots (default: {DEFAULT_DAYS})")
+    parser.add_argument("-r", "--repeats", type=int, default=DEFAULT_REPEATS,
+                        help=f"times to run each stage (default: {DEFAULT_REPEATS})")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("-b", "--baseline", help="compare the results to the ones saved in this JSON file")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"slowdown (as a fraction) that counts as a regression (default: {DEFAULT_TOLERANCE})")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.stations, args.days, args.repeats)
+    output = {"config": {"stations": args.stations, "days": args.days, "repeats": args.repeats,
+                         "python": platform.python_version(), "numpy": np.__version__,
+                         "machine": platform.machine()},
+              "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as file_stream:
+            json.dump(output, file_stream, indent=2)
+
+    print(f"{'stage':<42} {'min (s)':>10} {'median (s)':>11}")
+    for stage, result in results.items():
+        print(f"{stage:<42} {result['min']:>10.4f} {result['median']:>11.4f}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as file_stream:
+            baseline = json.load(file_stream)
+        if baseline["config"]["stations"] != args.stations or baseline["config"]["days"] != args.days:
+            print("warning: the baseline was run with a different number of stations/days")
+        comparison = compare_results(results, baseline["results"], args.tolerance)
+        print(f"\n{'stage':<42} {'baseline (s)':>12} {'median (s)':>11} {'ratio':>7}")
+        for stage, baseline_median, median, ratio, is_regression in comparison:
+            print(f"{stage:<42} {baseline_median:>12.4f} {median:>11.4f} {ratio:>7.2f}"
+                  f"{'  REGRESSION' if is_regression else ''}")
+        if any(is_regression for *_, is_regression in comparison):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
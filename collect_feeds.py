@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import time
+from urllib.parse import urlsplit
+
+# Polls the station status feeds of one or more bike share systems on a fixed schedule, and writes each snapshot to
+# <output dir>/<timestamp>.json (the raw_output/ format that process_data.py reads). Snapshots are named after the
+# scheduled time of the poll, so the cadence doesn't drift, and written atomically (to a .tmp file that is then
+# renamed), so the ingest never sees a torn file. Failed polls are retried with exponential backoff, and empty or
+# "message" responses are never written.
+
+DEFAULT_INTERVAL_SECONDS = 5 * 60
+DEFAULT_TIMEOUT_SECONDS = 30
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_RETRIES = 3
+# seconds to wait before the first retry (doubled for each retry after it)
+DEFAULT_BACKOFF_SECONDS = 2
+
+
+class FetchError(Exception):
+    pass
+
+
+class Feed:
+    def __init__(self, name, url, output_dir, interval=DEFAULT_INTERVAL_SECONDS, timeout=DEFAULT_TIMEOUT_SECONDS):
+        """
+        :param name: name of the feed (e.g. the city), for the log
+        :param url: URL of the station status feed
+        :param output_dir: directory to write the snapshots to
+        :param interval: seconds between polls
+        """
+        self.name = name
+        self.url = url
+        self.output_dir = output_dir
+        self.interval = interval
+        self.timeout = timeout
+        # kept open between polls, and reopened after an error
+        self.connection = None
+
+    def fetch(self):
+        """Fetches the feed once (blocking), reusing the feed's connection. Returns the response body."""
+        url = urlsplit(self.url)
+        if self.connection is None:
+            connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+            self.connection = connection_class(url.netloc, timeout=self.timeout)
+        try:
+            self.connection.request("GET", url.path + (f"?{url.query}" if url.query else ""))
+            response = self.connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        if response.status != 200:
+            raise FetchError(f"HTTP status {response.status}")
+        return body
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def parse_snapshot_body(body):
+    """
+    Checks a fetched snapshot before it is written.
+
+    :return: the parsed snapshot
+    """
+    if not body.strip():
+        raise FetchError("empty response")
+    try:
+        contents = json.loads(body)
+    except ValueError as exception:
+        raise FetchError(f"invalid JSON ({exception})")
+    if not isinstance(contents, dict):
+        raise FetchError("response is not a JSON object")
+    if "message" in contents:
+        raise FetchError(f"message \"{contents['message']}\"")
+    return contents
+
+
+def write_snapshot(output_dir, timestamp, body):
+    """Writes the snapshot atomically, so that a reader either sees the whole file or none of it."""
+    path = f"{output_dir}/{timestamp}.json"
+    with open(f"{path}.tmp", "wb") as file_stream:
+        file_stream.write(body)
+        file_stream.flush()
+        os.fsync(file_stream.fileno())
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def next_tick(now, interval):
+    """The first multiple of interval (since the epoch) after now, so every poll is on the same schedule."""
+    return (math.floor(now / interval) + 1) * interval
+
+
+async def collect_once(feed, tick, semaphore, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF_SECONDS):
+    """
+    Polls the feed for the snapshot scheduled at tick, retrying (with exponential backoff) on errors.
+
+    :param semaphore: limits the number of feeds fetched at the same time
+    :return: the path of the written snapshot, or None if every attempt failed
+    """
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            async with semaphore:
+                body = await asyncio.to_thread(feed.fetch)
+            parse_snapshot_body(body)
+        except (OSError, http.client.HTTPException, FetchError) as exception:
+            print(f"{feed.name}: could not fetch the snapshot for {int(tick)} (attempt {attempt + 1}): {exception}")
+            continue
+        return write_snapshot(feed.output_dir, int(tick), body)
+    return None
+
+
+async def run_feed(feed, semaphore, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF_SECONDS, num_polls=None):
+    """
+    Polls the feed at every multiple of its interval, forever (or num_polls times).
+    Polls that are missed entirely (e.g. after the machine was suspended) are skipped rather than made up.
+    """
+    os.makedirs(feed.output_dir, exist_ok=True)
+    tick = next_tick(time.time(), feed.interval)
+    polls = 0
+    try:
+        while num_polls is None or polls < num_polls:
+            await asyncio.sleep(max(0.0, tick - time.time()))
+            await collect_once(feed, tick, semaphore, retries, backoff)
+            polls += 1
+            tick = next_tick(max(tick, time.time()), feed.interval)
+    finally:
+        feed.close()
+
+
+async def collect(feeds, max_concurrency=DEFAULT_MAX_CONCURRENCY, retries=DEFAULT_RETRIES,
+                  backoff=DEFAULT_BACKOFF_SECONDS, num_polls=None):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    await asyncio.gather(*(run_feed(feed, semaphore, retries, backoff, num_polls) for feed in feeds))
+
+
+def load_feeds(config_path):
+    """
+    Reads the feeds from a JSON config file of the form
+    {"feeds": [{"name": ..., "url": ..., "output_dir": ..., "interval": ... (optional)}, ...]}
+    """
+    with open(config_path) as file_stream:
+        config = json.load(file_stream)
+    return [Feed(feed["name"], feed["url"], feed["output_dir"], feed.get("interval", DEFAULT_INTERVAL_SECONDS),
+                 feed.get("timeout", DEFAULT_TIMEOUT_SECONDS))
+            for feed in config["feeds"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="poll bike share station status feeds on a fixed schedule")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--url", help="URL of the station status feed to poll")
+    source.add_argument("-c", "--config", help="JSON file listing several feeds to poll (see load_feeds)")
+    parser.add_argument("-o", "--output-dir", default="raw_output",
+                        help="directory to write the snapshots from --url to (default: raw_output)")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL_SECONDS,
+                        help=f"seconds between polls of --url (default: {DEFAULT_INTERVAL_SECONDS})")
+    parser.add_argument("-j", "--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help=f"maximum number of feeds fetched at the same time (default: {DEFAULT_MAX_CONCURRENCY})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"retries of a failed poll (default: {DEFAULT_RETRIES})")
+    args = parser.parse_args()
+
+    if args.config is not None:
+        feeds = load_feeds(args.config)
+    else:
+        feeds = [Feed(args.url, args.url, args.output_dir, args.interval)]
+    try:
+        asyncio.run(collect(feeds, args.max_concurrency, args.retries))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
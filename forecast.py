@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import statistics
+import time
+
+import numpy as np
+
+import aggregate_cache
+import online_statistics
+import snapshot_store
+import time_buckets
+
+# Short-term forecasts of the bikes, docks and points of every station.
+#
+# Each station has a seasonal profile of each field (its average in each quarter hour of the day, separately for
+# weekdays and weekends). The forecast for horizon h starts from the current value x(t) and adds
+#
+#   a_h * (profile(t + h) - profile(t))      the change the profile expects over the horizon
+#   b_h * (x(t) - profile(t))                the current anomaly (stations tend to drift back to their profile)
+#   c_h * (x(t) - x(t - LOOKBACK_SECONDS))   the recent trend
+#
+# where a_h, b_h and c_h are fitted by least squares on the archive (for every field and horizon, over all the
+# stations). With all three at 0 this is the current value, so on the training data it's never worse than assuming
+# nothing changes. A prediction only looks up and combines (horizon x station) arrays, so every station and horizon
+# is forecast in one vectorized call.
+
+FORECAST_FIELDS = [snapshot_store.BIKES, snapshot_store.DOCKS, snapshot_store.POINTS]
+DEFAULT_HORIZONS_MINUTES = [15, 30, 45, 60]
+SLOT_SECONDS = 15 * 60
+SLOTS_PER_DAY = time_buckets.SECONDS_PER_DAY // SLOT_SECONDS
+LOOKBACK_SECONDS = 30 * 60
+# how far (in seconds) a snapshot can be from the time it's used for (snapshots are taken about every 5 minutes)
+MATCH_TOLERANCE_SECONDS = 150
+# fraction of the snapshots (the most recent ones) that the coefficients are fitted on
+COEFFICIENT_FRACTION = 0.25
+# (snapshot, station) pairs used to fit the coefficients of each horizon
+MAX_TRAINING_PAIRS = 2_000_000
+# the forecaster is refitted once per REFIT_SECONDS (UTC days), on the snapshots of the last TRAINING_DAYS before
+# the start of the current one, so forecasting from every new snapshot doesn't refit it, and a fit takes the same
+# time and memory no matter how large the archive grows
+REFIT_SECONDS = time_buckets.SECONDS_PER_DAY
+TRAINING_DAYS = 28
+DEFAULT_TRAIN_FRACTION = 0.8
+# ticks of the test period that are forecast by the backtest
+DEFAULT_BACKTEST_TICKS = 500
+
+
+def profile_groups(timestamps, time_zone=None):
+    """
+    :return: array of the profile group (weekday class * SLOTS_PER_DAY + quarter hour of the local day) of each
+             timestamp
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    local_timestamps = timestamps + time_buckets.utc_offsets(timestamps, time_zone)
+    days = local_timestamps // time_buckets.SECONDS_PER_DAY
+    slots = (local_timestamps % time_buckets.SECONDS_PER_DAY) // SLOT_SECONDS
+    is_weekend = np.isin((days + time_buckets.EPOCH_WEEKDAY) % 7, online_statistics.WEEKEND_DAYS)
+    return np.where(is_weekend, online_statistics.WEEKEND, online_statistics.WEEKDAY) * SLOTS_PER_DAY + slots
+
+
+def matching_rows(timestamps, targets, tolerance=MATCH_TOLERANCE_SECONDS):
+    """
+    :param timestamps: array of the snapshot timestamps (sorted ascending)
+    :return: array of the row of the snapshot closest to each target time, or -1 if none is within the tolerance
+    """
+    after = np.minimum(np.searchsorted(timestamps, targets), len(timestamps) - 1)
+    before = np.maximum(after - 1, 0)
+    rows = np.where(np.abs(timestamps[after] - targets) < np.abs(targets - timestamps[before]), after, before)
+    return np.where(np.abs(timestamps[rows] - targets) <= tolerance, rows, -1)
+
+
+def forecast_values(values, field):
+    """(snapshot x station) float array of one field, with NaN where a station is absent."""
+    # stations that don't report points (e.g. when the Bike Angels program is off) have 0 points
+    missing_field_value = 0 if field == snapshot_store.POINTS else np.nan
+    return time_buckets.field_values(values, field, missing_field_value)
+
+
+class Forecaster:
+    def __init__(self, station_ids, horizons, profiles, coefficients, value_ranges, lookback=LOOKBACK_SECONDS):
+        """
+        :param station_ids: IDs of the stations (the first len(station_ids) columns of the snapshot store)
+        :param horizons: array of the forecast horizons, in seconds
+        :param profiles: (field x profile group x station) array of the seasonal profiles
+        :param coefficients: (field x horizon x 3) array of the weights of the profile change, anomaly and trend
+        :param value_ranges: (field x 2) array of the lowest and highest value of each field seen in the archive
+        """
+        self.station_ids = station_ids
+        self.horizons = np.asarray(horizons, dtype=np.int64)
+        self.profiles = profiles
+        self.coefficients = coefficients
+        self.value_ranges = value_ranges
+        self.lookback = lookback
+
+    def to_arrays(self):
+        return {"station_ids": np.array(self.station_ids), "horizons": self.horizons, "profiles": self.profiles,
+                "coefficients": self.coefficients, "value_ranges": self.value_ranges,
+                "lookback": np.array(self.lookback)}
+
+    @staticmethod
+    def from_arrays(arrays):
+        return Forecaster(arrays["station_ids"].tolist(), arrays["horizons"], arrays["profiles"],
+                          arrays["coefficients"], arrays["value_ranges"], int(arrays["lookback"]))
+
+    def predict(self, timestamp, current, previous=None):
+        """
+        Forecasts every field of every station at every horizon.
+
+        :param current: (station x store field) row of the snapshot store taken at the timestamp
+        :param previous: row of the snapshot store taken about lookback seconds before it (without it, the recent
+                         trend is left out)
+        :return: (horizon x station x field) array of the forecast bikes, docks and points (in FORECAST_FIELDS
+                 order), with NaN for the stations that are absent from the current snapshot
+        """
+        num_stations = len(self.station_ids)
+        current = np.asarray(current)[np.newaxis, :num_stations]
+        groups = profile_groups(np.concatenate([[timestamp], timestamp + self.horizons]))
+        capacities = forecast_values(current, snapshot_store.CAPACITY)[0]
+        forecast = np.empty((len(self.horizons), num_stations, len(FORECAST_FIELDS)))
+        for i, field in enumerate(FORECAST_FIELDS):
+            current_values = forecast_values(current, field)[0]
+            if previous is not None:
+                trend = np.nan_to_num(current_values -
+                                      forecast_values(np.asarray(previous)[np.newaxis, :num_stations], field)[0])
+            else:
+                trend = np.zeros(num_stations)
+            features = [self.profiles[i, groups[1:]] - self.profiles[i, groups[0]],
+                        current_values - self.profiles[i, groups[0]], trend]
+            forecast[:, :, i] = current_values + sum(self.coefficients[i, :, k, np.newaxis] * feature
+                                                     for k, feature in enumerate(features))
+            low, high = self.value_ranges[i]
+            forecast[:, :, i] = np.clip(forecast[:, :, i], low, high)
+            if field != snapshot_store.POINTS:
+                # (fmin ignores the stations whose capacity is unknown)
+                forecast[:, :, i] = np.fmin(forecast[:, :, i], capacities)
+        return forecast
+
+    def predict_from_store(self, store, row=None):
+        """Forecasts from the snapshot in the given row of the store (the last one by default)."""
+        if row is None:
+            row = len(store) - 1
+        timestamp = int(store.timestamps[row])
+        previous_row = int(matching_rows(store.timestamps, np.array([timestamp - self.lookback]))[0])
+        previous = store.values[previous_row] if previous_row >= 0 else None
+        return timestamp, self.predict(timestamp, store.values[row], previous)
+
+
+def seasonal_profiles(field_values, groups):
+    """
+    :param field_values: (snapshot x station) array of one field, with NaN where a station is absent
+    :param groups: array of the profile group of each snapshot
+    :return: (profile group x station) array of the average of each station in each group (or over all the
+             groups, for the groups in which a station was never seen)
+    """
+    order = np.argsort(groups, kind="stable")
+    group_numbers, group_starts = np.unique(groups[order], return_index=True)
+    present = ~np.isnan(field_values)
+    sorted_present = present[order]
+    profiles = np.full((2 * SLOTS_PER_DAY, field_values.shape[1]), np.nan)
+    with np.errstate(invalid="ignore"):
+        profiles[group_numbers] = (np.add.reduceat(np.where(sorted_present, field_values[order], 0), group_starts) /
+                                   np.add.reduceat(sorted_present.astype(np.int64), group_starts))
+        station_means = np.where(present, field_values, 0).sum(axis=0) / present.sum(axis=0)
+    return np.nan_to_num(np.where(np.isnan(profiles), station_means, profiles))
+
+
+def fit(timestamps, values, station_ids, horizons_minutes=DEFAULT_HORIZONS_MINUTES, lookback=LOOKBACK_SECONDS,
+        max_training_pairs=MAX_TRAINING_PAIRS):
+    """
+    Fits the seasonal profiles and the coefficients. The coefficients are fitted on the last
+    COEFFICIENT_FRACTION of the snapshots, using profiles of only the snapshots before them (a profile that
+    includes the value being forecast would make it look more predictive than it is); the profiles of the
+    forecaster are then rebuilt from all the snapshots.
+
+    :param timestamps: array of the snapshot timestamps (sorted ascending)
+    :param values: (snapshot x station x store field) array of the snapshot store values
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    horizons = np.array(horizons_minutes, dtype=np.int64) * 60
+    groups = profile_groups(timestamps)
+    split = int(len(timestamps) * (1 - COEFFICIENT_FRACTION))
+
+    # rows to fit the coefficients on: every few snapshots that have a snapshot lookback seconds before them
+    rows = np.arange(split, len(timestamps))
+    rows = rows[::max(1, len(rows) * len(station_ids) // max_training_pairs)]
+    previous_rows = matching_rows(timestamps, timestamps[rows] - lookback)
+    rows, previous_rows = rows[previous_rows >= 0], previous_rows[previous_rows >= 0]
+
+    profiles = np.zeros((len(FORECAST_FIELDS), 2 * SLOTS_PER_DAY, len(station_ids)))
+    coefficients = np.zeros((len(FORECAST_FIELDS), len(horizons), 3))
+    value_ranges = np.zeros((len(FORECAST_FIELDS), 2))
+    for i, field in enumerate(FORECAST_FIELDS):
+        field_values = forecast_values(values, field)
+        profiles[i] = seasonal_profiles(field_values, groups)
+        if not (~np.isnan(field_values)).any():
+            continue
+        value_ranges[i] = [np.nanmin(field_values), np.nanmax(field_values)]
+
+        fitting_profiles = seasonal_profiles(field_values[:split], groups[:split]) if split > 0 else profiles[i]
+        current_values = field_values[rows]
+        anomalies = current_values - fitting_profiles[groups[rows]]
+        trends = np.nan_to_num(current_values - field_values[previous_rows])
+        for j, horizon in enumerate(horizons):
+            target_rows = matching_rows(timestamps, timestamps[rows] + horizon)
+            has_target = target_rows >= 0
+            targets = (field_values[target_rows[has_target]] - current_values[has_target]).ravel()
+            features = np.stack([(fitting_profiles[groups[target_rows[has_target]]] -
+                                  fitting_profiles[groups[rows[has_target]]]).ravel(),
+                                 anomalies[has_target].ravel(), trends[has_target].ravel()], axis=1)
+            is_valid = ~np.isnan(features).any(axis=1) & ~np.isnan(targets)
+            if is_valid.any():
+                coefficients[i, j] = np.linalg.lstsq(features[is_valid], targets[is_valid], rcond=None)[0]
+    return Forecaster(list(station_ids), horizons, profiles, coefficients, value_ranges, lookback)
+
+
+def training_rows(store, refit=False):
+    """
+    :param refit: train on the snapshots up to the last one, instead of up to the start of the current refit period
+    :return: the first row and the row after the last one of the snapshots to fit the forecaster on (the last
+             TRAINING_DAYS of them; all of them if there are none before the start of the refit period)
+    """
+    end = None
+    if not refit:
+        end = int(store.timestamps[-1]) // REFIT_SECONDS * REFIT_SECONDS
+        if store.row_range(None, end)[1] == 0:
+            end = None
+    last_timestamp = int(store.timestamps[-1]) + 1 if end is None else end
+    return store.row_range(last_timestamp - TRAINING_DAYS * time_buckets.SECONDS_PER_DAY, end)
+
+
+def load_forecaster(store, horizons_minutes=DEFAULT_HORIZONS_MINUTES, refit=False):
+    """
+    Fits a forecaster to the training window of the store (see training_rows), or loads the one fitted to it from
+    the cache. Forecasts only need the latest snapshots, so new snapshots don't change the forecaster until the
+    next refit period starts.
+    """
+    first_row, last_row = training_rows(store, refit)
+
+    def compute():
+        return fit(store.timestamps[first_row:last_row], store.values[first_row:last_row], store.station_ids,
+                   horizons_minutes).to_arrays()
+
+    # the store's fingerprint, but of only the training window
+    window = dict(aggregate_cache.store_fingerprint(store), num_snapshots=last_row - first_row,
+                  first_timestamp=int(store.timestamps[first_row]), last_timestamp=int(store.timestamps[last_row - 1]))
+    key = aggregate_cache.cache_key("forecaster", window=window, horizons=list(horizons_minutes),
+                                    slot_seconds=SLOT_SECONDS, lookback=LOOKBACK_SECONDS,
+                                    max_training_pairs=MAX_TRAINING_PAIRS)
+    return Forecaster.from_arrays(aggregate_cache.cached(key, compute))
+
+
+def backtest(store, horizons_minutes=DEFAULT_HORIZONS_MINUTES, train_fraction=DEFAULT_TRAIN_FRACTION,
+             num_ticks=DEFAULT_BACKTEST_TICKS):
+    """
+    Fits a forecaster to the first train_fraction of the store, and forecasts from num_ticks snapshots spread over
+    the rest of it.
+
+    :return: dict of the number of training snapshots and test ticks, the fit time, the latency of a forecast
+             (in milliseconds), and the mean absolute and root mean square error of each field and horizon, for the
+             forecaster and for two baselines: the current value ("persistence") and the profile alone ("seasonal")
+    """
+    split = int(len(store) * train_fraction)
+    if split == 0 or split == len(store):
+        raise ValueError("the training and test periods must both contain snapshots")
+    start = time.perf_counter()
+    forecaster = fit(store.timestamps[:split], store.values[:split], store.station_ids, horizons_minutes)
+    fit_seconds = time.perf_counter() - start
+
+    num_stations = len(forecaster.station_ids)
+    test_rows = np.unique(np.linspace(split, len(store) - 1, num_ticks).astype(np.int64))
+    methods = ["forecast", "persistence", "seasonal"]
+    # (method x field x horizon) sums of the absolute and squared errors, and the number of errors
+    absolute_errors = np.zeros((len(methods), len(FORECAST_FIELDS), len(forecaster.horizons)))
+    squared_errors = np.zeros_like(absolute_errors)
+    counts = np.zeros((len(FORECAST_FIELDS), len(forecaster.horizons)))
+    latencies = []
+    for row in test_rows:
+        start = time.perf_counter()
+        timestamp, forecast = forecaster.predict_from_store(store, int(row))
+        latencies.append(time.perf_counter() - start)
+
+        target_rows = matching_rows(store.timestamps, timestamp + forecaster.horizons)
+        current = store.values[row][np.newaxis, :num_stations]
+        groups = profile_groups(timestamp + forecaster.horizons)
+        for i, field in enumerate(FORECAST_FIELDS):
+            for j, target_row in enumerate(target_rows.tolist()):
+                if target_row < 0:
+                    continue
+                actual = forecast_values(store.values[target_row][np.newaxis, :num_stations], field)[0]
+                predictions = [forecast[j, :, i], forecast_values(current, field)[0],
+                               forecaster.profiles[i, groups[j]]]
+                is_valid = ~np.isnan(actual) & ~np.isnan(predictions[1])
+                for k, prediction in enumerate(predictions):
+                    errors = prediction[is_valid] - actual[is_valid]
+                    absolute_errors[k, i, j] += np.abs(errors).sum()
+                    squared_errors[k, i, j] += (errors ** 2).sum()
+                counts[i, j] += is_valid.sum()
+
+    with np.errstate(invalid="ignore"):
+        mean_absolute_errors = absolute_errors / counts
+        root_mean_square_errors = np.sqrt(squared_errors / counts)
+    return {
+        "training_snapshots": split,
+        "test_ticks": len(test_rows),
+        "fit_seconds": fit_seconds,
+        "latency_ms": {"median": statistics.median(latencies) * 1000, "max": max(latencies) * 1000},
+        "errors": {snapshot_store.FIELDS[field]: {
+            f"{horizon // 60} min": {method: {"mae": mean_absolute_errors[k, i, j],
+                                              "rmse": root_mean_square_errors[k, i, j]}
+                                     for k, method in enumerate(methods)}
+            for j, horizon in enumerate(forecaster.horizons.tolist())}
+            for i, field in enumerate(FORECAST_FIELDS)}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="forecast the bikes, docks and points of every station")
+    parser.add_argument("station_ids", nargs="*", help="stations to show (default: all)", metavar="station_id")
+    parser.add_argument("-H", "--horizons", type=int, nargs="+", default=DEFAULT_HORIZONS_MINUTES, metavar="MINUTES",
+                        help=f"forecast horizons in minutes (default: {DEFAULT_HORIZONS_MINUTES})")
+    parser.add_argument("--refit", action="store_true",
+                        help=f"fit on the last {TRAINING_DAYS} days up to the last snapshot, instead of reusing the "
+                             "forecaster fitted at the start of the day")
+    parser.add_argument("--backtest", action="store_true",
+                        help="fit on the start of the archive and report the error and latency on the rest")
+    parser.add_argument("--train-fraction", type=float, default=DEFAULT_TRAIN_FRACTION,
+                        help="with --backtest, fraction of the snapshots to fit on "
+                             f"(default: {DEFAULT_TRAIN_FRACTION})")
+    args = parser.parse_args()
+
+    store = snapshot_store.load_store()
+    if len(store) == 0:
+        raise Exception("no snapshots found in the snapshot store")
+    if args.backtest:
+        print(json.dumps(backtest(store, args.horizons, args.train_fraction), indent=2))
+        return
+
+    forecaster = load_forecaster(store, args.horizons, args.refit)
+    timestamp, forecast = forecaster.predict_from_store(store)
+    station_ids = args.station_ids or forecaster.station_ids
+    station_index = {station_id: i for i, station_id in enumerate(forecaster.station_ids)}
+    for station_id in station_ids:
+        if station_id not in station_index:
+            raise Exception(f"{station_id} is not present in the snapshot store")
+    # station ID -> horizon (minutes) -> [bikes, docks, points], for the stations in the last snapshot
+    forecast = forecast.round(1).tolist()
+    print(json.dumps({"timestamp": timestamp, "forecasts": {
+        station_id: {horizon // 60: forecast[j][station_index[station_id]]
+                     for j, horizon in enumerate(forecaster.horizons.tolist())}
+        for station_id in station_ids if not math.isnan(forecast[0][station_index[station_id]][0])}}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import numpy as np
+
+import time_buckets
+
+WEEKEND_DAYS = [5, 6]
+
+
+def hourly_statistics(timestamps, values, is_weekend, rate_of_change):
+    """
+    Computes the per-hour mean and standard deviation for all stations at once.
+
+    :param timestamps: array of the sample timestamps (sorted ascending), usually one per hour
+    :param values: (sample x station) array of values, with NaN where a station has no value
+    :param is_weekend: use the samples taken on weekends (otherwise the ones taken on weekdays)
+    :param rate_of_change: use the change in value from each sample to the next one, if the next one was taken
+                           in the following hour (otherwise the values themselves)
+    :return: (hour x station) arrays of the averages, standard deviations and sample counts
+             (averages/standard deviations are NaN if there are too few samples)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    days, hours, weekdays = time_buckets.local_time_fields(timestamps)
+    matches_weekdays = np.isin(weekdays, WEEKEND_DAYS) == is_weekend
+
+    if rate_of_change:
+        hour_numbers = days * 24 + hours
+        is_one_hour_after = hour_numbers[1:] - hour_numbers[:-1] == 1
+        samples = values[1:] - values[:-1]
+        keep = is_one_hour_after & matches_weekdays[:-1]
+        sample_hours = hours[:-1]
+    else:
+        samples = values
+        keep = matches_weekdays
+        sample_hours = hours
+
+    # (hour x sample) selection matrix, so that the per-hour sums for every station are a single matrix product
+    selection = ((sample_hours[np.newaxis, :] == np.arange(24)[:, np.newaxis]) & keep).astype(np.float64)
+    present = ~np.isnan(samples)
+    filled = np.where(present, samples, 0)
+    counts = selection @ present
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = (selection @ filled) / counts
+        deviations = np.where(present & keep[:, np.newaxis], samples - averages[sample_hours], 0)
+        stdevs = np.sqrt((selection @ deviations ** 2) / (counts - 1))
+    stdevs[counts < 2] = np.nan
+    return averages, stdevs, counts.astype(np.int64)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import lucrative_pairs
+import online_statistics
+import process_data
+import snapshot_store
+import spatial_index
+import station_trends
+import time_buckets
+
+# Long-running ingest service: reads new feed snapshots as they arrive (from a watched directory, or by polling
+# the feed over HTTP), keeps the last few days of them in memory, keeps the hourly statistics up to date, and
+# serves the current best angel moves over HTTP.
+
+SNAPSHOT_SECONDS = 5 * 60
+DEFAULT_DAYS = 7
+DEFAULT_PORT = 8080
+FETCH_TIMEOUT_SECONDS = 30
+# the minimum difference in the hourly averages of a lucrative pair, by data type
+MIN_DIFFS = station_trends.MIN_DIFFS
+
+
+class RingBuffer:
+    """Fixed-size buffer of the most recent snapshots, in the snapshot store format."""
+
+    def __init__(self, capacity, num_stations=0):
+        self.timestamps = np.zeros(capacity, dtype=snapshot_store.TIMESTAMPS_DTYPE)
+        self.values = np.full((capacity, num_stations, len(snapshot_store.FIELDS)), snapshot_store.MISSING,
+                              dtype=snapshot_store.VALUES_DTYPE)
+        self.size = 0
+        # the row the next snapshot is written to (overwriting the oldest one once the buffer is full)
+        self.next_row = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.timestamps)
+
+    def add_stations(self, num_stations):
+        padding = ((0, 0), (0, num_stations - self.values.shape[1]), (0, 0))
+        self.values = np.pad(self.values, padding, constant_values=snapshot_store.MISSING)
+
+    def append(self, timestamp, row):
+        """
+        :param row: (station x field) array of the snapshot's values
+        """
+        self.timestamps[self.next_row] = timestamp
+        self.values[self.next_row] = row
+        self.next_row = (self.next_row + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def latest(self):
+        """Returns the timestamp and (station x field) values of the newest snapshot."""
+        row = (self.next_row - 1) % self.capacity
+        return int(self.timestamps[row]), self.values[row]
+
+    def ordered(self):
+        """Returns the timestamps and (snapshot x station x field) values of the buffered snapshots, oldest first."""
+        rows = (np.arange(self.size) + self.next_row - self.size) % self.capacity
+        return self.timestamps[rows], self.values[rows]
+
+
+class LiveFeed:
+    def __init__(self, capacity, radius_miles=station_trends.RADIUS_MILES):
+        """
+        :param capacity: number of snapshots to keep in memory
+        """
+        # the feed is read in one thread and served from others
+        self.lock = threading.Lock()
+        self.radius_miles = radius_miles
+        self.station_ids = []
+        self.station_index = {}
+        # station ID -> [name, [latitude, longitude]]
+        self.station_details = {}
+        self.buffer = RingBuffer(capacity)
+        self.streams = {data_type: online_statistics.HourlyStatisticsStream([], rate_of_change)
+                        for data_type, (_, _, rate_of_change) in online_statistics.SAVED_STREAMS.items()}
+        self.last_bucket_number = None
+        self.nearby_i = np.empty(0, dtype=np.int64)
+        self.nearby_j = np.empty(0, dtype=np.int64)
+        # data type -> (bucket number, routes) of the lucrative pairs last calculated
+        self.lucrative = {}
+
+    def warm_start(self, store_dir=snapshot_store.STORE_DIR, overall_stations_path="data/overall_stations.json"):
+        """
+        Starts from the output of the batch pipeline, if there is any: the stations, the hourly statistics saved
+        at ingest time, and the last snapshots in the snapshot store that fit in the buffer.
+        """
+        try:
+            with open(overall_stations_path) as file_stream:
+                contents = json.load(file_stream)
+            store = snapshot_store.load_store(store_dir)
+        except FileNotFoundError:
+            # (including snapshot_store.StoreNotFoundError, e.g. in a fresh clone, where only overall_stations.json
+            # is checked in)
+            print("No snapshot store found, starting from an empty buffer")
+            return
+        with self.lock:
+            self.station_details = {station_id: [entry["name"][-1][1], entry["coords"][-1][1]]
+                                    for station_id, entry in contents.items()}
+            if len(store) > 0:
+                index = time_buckets.load_bucket_index(store, time_buckets.SECONDS_PER_HOUR, store_dir)
+                for data_type in self.streams:
+                    self.streams[data_type] = online_statistics.load_stream(store, index, data_type,
+                                                                            store_dir=store_dir)
+                self.last_bucket_number = int(index.bucket_numbers[-1])
+                self._add_stations(store.station_ids)
+                first_row = max(0, len(store) - self.buffer.capacity)
+                for row in range(first_row, len(store)):
+                    self.buffer.append(store.timestamps[row], store.values[row])
+            self._update_nearby_pairs()
+
+    def add_snapshot(self, timestamp, contents):
+        """
+        Adds one raw feed snapshot (as read from the feed). Messages and snapshots that aren't newer than the
+        last one are skipped.
+
+        :return: whether the snapshot was added
+        """
+        if "message" in contents:
+            print(f"Message: \"{contents['message']}\" at time {timestamp}")
+            return False
+        processed, station_details = process_data.parse_snapshot(timestamp, contents)
+        with self.lock:
+            if len(self.buffer) > 0 and timestamp <= self.buffer.latest()[0]:
+                return False
+            new_station_ids = [station_id for station_id in processed if station_id not in self.station_index]
+            moved = any(self.station_details.get(station_id, [None, None])[1] != coords
+                        for station_id, (_, coords) in station_details.items())
+            self.station_details.update(station_details)
+            if new_station_ids:
+                self._add_stations(self.station_ids + new_station_ids)
+            if new_station_ids or moved:
+                self._update_nearby_pairs()
+
+            row = snapshot_store.snapshot_row(processed, self.station_index)
+            self.buffer.append(timestamp, row)
+            # the hourly statistics use the first snapshot in every hour
+            bucket_number = int(time_buckets.build_bucket_index([timestamp]).bucket_numbers[0])
+            if self.last_bucket_number is None or bucket_number > self.last_bucket_number:
+                for data_type, (field, missing_field_value, _) in online_statistics.SAVED_STREAMS.items():
+                    samples = time_buckets.field_values(row[np.newaxis], field, missing_field_value)
+                    self.streams[data_type].update([timestamp], samples)
+                    self.streams[data_type].last_bucket_number = bucket_number
+                self.last_bucket_number = bucket_number
+        return True
+
+    def _add_stations(self, station_ids):
+        for station_id in station_ids[len(self.station_ids):]:
+            self.station_index[station_id] = len(self.station_ids)
+            self.station_ids.append(station_id)
+        self.buffer.add_stations(len(self.station_ids))
+        for stream in self.streams.values():
+            stream.add_stations(self.station_ids)
+        self.lucrative = {}
+
+    def _update_nearby_pairs(self):
+        # only the stations whose coordinates are known
+        located = [i for i, station_id in enumerate(self.station_ids) if station_id in self.station_details]
+        coords = np.array([self.station_details[self.station_ids[i]][1] for i in located], dtype=np.float64)
+        i, j = spatial_index.nearby_pairs(coords[:, 0], coords[:, 1], self.radius_miles) if located else ([], [])
+        self.nearby_i = np.array(located, dtype=np.int64)[i]
+        self.nearby_j = np.array(located, dtype=np.int64)[j]
+        self.lucrative = {}
+
+    def _route_list(self, starts, ends, gains):
+        return [{"gain": round(gain, ndigits=2),
+                 "start": self.station_ids[start], "start_name": self.station_details[self.station_ids[start]][0],
+                 "end": self.station_ids[end], "end_name": self.station_details[self.station_ids[end]][0]}
+                for start, end, gain in zip(starts.tolist(), ends.tolist(), gains.tolist())]
+
+    def best_moves(self, k=10):
+        """The k nearby pairs whose current angel points differ the most (ride from the start to the end)."""
+        with self.lock:
+            if len(self.buffer) == 0:
+                return {"timestamp": None, "moves": []}
+            timestamp, row = self.buffer.latest()
+            points = time_buckets.field_values(row[np.newaxis], snapshot_store.POINTS)[0]
+            starts, ends, gains = lucrative_pairs.rank_routes(points, self.nearby_i, self.nearby_j, True, k)
+            return {"timestamp": timestamp, "moves": self._route_list(starts, ends, gains)}
+
+    def lucrative_pairs(self, data_type="points"):
+        """
+        The nearby pairs whose hourly averages (in the hour and weekday class of the newest snapshot) differ by
+        more than the minimum difference, best first; only recalculated when a new hour starts.
+        """
+        if data_type not in self.streams:
+            raise ValueError(f"unknown data type {data_type}")
+        with self.lock:
+            if len(self.buffer) == 0:
+                return {"timestamp": None, "pairs": []}
+            timestamp, _ = self.buffer.latest()
+            if self.lucrative.get(data_type, (None,))[0] != self.last_bucket_number:
+                _, hours, weekdays = time_buckets.local_time_fields([timestamp])
+                averages, _, _ = self.streams[data_type].statistics(weekdays[0] in online_statistics.WEEKEND_DAYS)
+                starts, ends, gains = lucrative_pairs.rank_routes(averages[hours[0]], self.nearby_i, self.nearby_j,
+                                                                  data_type == "points", len(self.nearby_i))
+                is_lucrative = gains > MIN_DIFFS[data_type]
+                routes = self._route_list(starts[is_lucrative], ends[is_lucrative], gains[is_lucrative])
+                self.lucrative[data_type] = (self.last_bucket_number, routes)
+            return {"timestamp": timestamp, "pairs": self.lucrative[data_type][1]}
+
+    def status(self):
+        with self.lock:
+            timestamps, _ = self.buffer.ordered()
+            return {"snapshots": len(self.buffer), "capacity": self.buffer.capacity,
+                    "first_timestamp": int(timestamps[0]) if len(timestamps) > 0 else None,
+                    "last_timestamp": int(timestamps[-1]) if len(timestamps) > 0 else None,
+                    "stations": len(self.station_ids), "nearby_pairs": len(self.nearby_i)}
+
+
+def watch_directory(feed, directory, interval):
+    """Adds the raw snapshot files (named <timestamp>.json) that appear in the directory to the feed."""
+    high_water_mark = feed.buffer.latest()[0] if len(feed.buffer) > 0 else None
+    while True:
+        for timestamp, filename in process_data.list_raw_snapshots(after=high_water_mark, raw_output_dir=directory):
+            high_water_mark = timestamp
+            if os.stat(f"{directory}/{filename}").st_size == 0:
+                continue
+            try:
+                with open(f"{directory}/{filename}") as file_stream:
+                    contents = json.load(file_stream)
+            except ValueError as exception:
+                print(f"Could not read {filename}: {exception}")
+                continue
+            feed.add_snapshot(timestamp, contents)
+        time.sleep(interval)
+
+
+def poll_url(feed, url, interval):
+    """Fetches the feed every interval seconds (on a fixed schedule) and adds each snapshot to the feed."""
+    next_poll = time.time()
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=FETCH_TIMEOUT_SECONDS) as response:
+                contents = json.load(response)
+            feed.add_snapshot(int(time.time()), contents)
+        except (OSError, ValueError) as exception:
+            print(f"Could not fetch {url}: {exception}")
+        next_poll += interval
+        time.sleep(max(0.0, next_poll - time.time()))
+
+
+def make_request_handler(feed):
+    class LiveFeedRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            try:
+                if url.path == "/moves":
+                    body = feed.best_moves(int(query.get("k", ["10"])[0]))
+                elif url.path == "/lucrative":
+                    body = feed.lucrative_pairs(query.get("data_type", ["points"])[0])
+                elif url.path == "/status":
+                    body = feed.status()
+                else:
+                    self.send_error(404)
+                    return
+            except ValueError as exception:
+                self.send_error(400, str(exception))
+                return
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return LiveFeedRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve the current best angel moves from a live feed")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--watch", metavar="DIR", help="read the raw snapshot files written to this directory")
+    source.add_argument("--url", help="poll the station feed at this URL")
+    parser.add_argument("--interval", type=float, default=SNAPSHOT_SECONDS,
+                        help=f"seconds between polls of the URL or directory (default: {SNAPSHOT_SECONDS})")
+    parser.add_argument("-d", "--days", type=float, default=DEFAULT_DAYS,
+                        help=f"days of snapshots to keep in memory (default: {DEFAULT_DAYS})")
+    parser.add_argument("--host", default="127.0.0.1", help="address to serve on (default: 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT,
+                        help=f"port to serve on (default: {DEFAULT_PORT})")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="don't start from the snapshot store and saved hourly statistics")
+    args = parser.parse_args()
+
+    feed = LiveFeed(max(1, int(args.days * time_buckets.SECONDS_PER_DAY / SNAPSHOT_SECONDS)))
+    if not args.cold_start:
+        feed.warm_start()
+    if args.watch is not None:
+        reader = threading.Thread(target=watch_directory, args=(feed, args.watch, args.interval), daemon=True)
+    else:
+        reader = threading.Thread(target=poll_url, args=(feed, args.url, args.interval), daemon=True)
+    reader.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_request_handler(feed))
+    print(f"Serving /moves, /lucrative and /status on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
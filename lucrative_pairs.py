@@ -0,0 +1,58 @@
+import numpy as np
+
+
+def nearby_pair_arrays(nearby_stations):
+    """
+    :param nearby_stations: list (where each element corresponds to a station) of lists of the nearby
+                            stations with a higher index, as returned by calculate_nearby_stations
+    :return: arrays i, j of the station indices of every nearby pair
+    """
+    lengths = [len(stations_list) for stations_list in nearby_stations]
+    i = np.repeat(np.arange(len(nearby_stations)), lengths)
+    j = np.array([j for stations_list in nearby_stations for j in stations_list], dtype=np.int64)
+    return i, j
+
+
+def lucrative_pair_mask(averages, nearby_i, nearby_j, min_diff):
+    """
+    :param averages: (hour x station) array of the hourly averages
+    :return: (hour x pair) boolean array of whether the averages of each nearby pair differ by more than min_diff
+    """
+    averages = np.asarray(averages, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        return np.abs(averages[:, nearby_i] - averages[:, nearby_j]) > min_diff
+
+
+def pair_segments(latitudes, longitudes, nearby_i, nearby_j):
+    """
+    :return: (pair x 2 x 2) array of the line segment ([[lon1, lat1], [lon2, lat2]]) between the stations of
+             each pair, in the format that matplotlib's LineCollection takes
+    """
+    coords = np.column_stack([longitudes, latitudes]).astype(np.float64)
+    return np.stack([coords[nearby_i], coords[nearby_j]], axis=1)
+
+
+def rank_routes(hourly_averages, nearby_i, nearby_j, use_points, k=10):
+    """
+    Ranks the nearby pairs by the expected gain per hour of riding a bike from one station to the other:
+    from the station with fewer points to the one with more (for points), or from the station that gains bikes
+    faster to the one that loses them faster (for the rate of change of bikes).
+
+    :param hourly_averages: array of the averages of every station in one hour
+    :param k: number of routes to return
+    :return: arrays of the start station indices, end station indices and expected gains of the
+             top k routes, best first
+    """
+    values = np.asarray(hourly_averages, dtype=np.float64)
+    if not use_points:
+        values = -values
+    differences = values[nearby_j] - values[nearby_i]
+    gains = np.nan_to_num(np.abs(differences), nan=-np.inf)
+    starts = np.where(differences > 0, nearby_i, nearby_j)
+    ends = np.where(differences > 0, nearby_j, nearby_i)
+
+    k = min(k, len(gains))
+    top = np.argpartition(-gains, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+    top = top[np.argsort(-gains[top], kind="stable")]
+    top = top[np.isfinite(gains[top])]
+    return starts[top], ends[top], gains[top]
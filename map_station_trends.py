@@ -3,30 +3,41 @@
 import math
 import os
 import json
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as ani
+from matplotlib.collections import LineCollection
 from datetime import datetime
 from datetime import timedelta
-from geopy.distance import distance
 from typing import List
-import statistics
 import argparse
 
+import hourly_statistics
+import lucrative_pairs
+import profiling
+import snapshot_store
+import station_registry
+import station_trends
+import time_buckets
+
 UPPER_LEFT_CORNER = (42.4379, -71.3538)
 LOWER_RIGHT_CORNER = (42.2059, -70.8148)
 
 BBOX = (UPPER_LEFT_CORNER[1], LOWER_RIGHT_CORNER[1],
         LOWER_RIGHT_CORNER[0], UPPER_LEFT_CORNER[0])
 
-RADIUS_MILES = 0.5
-MIN_DIFF_HOUR_BIKES_DELTA = 2.5
-MIN_DIFF_HOUR_POINTS = 1
+RADIUS_MILES = station_trends.RADIUS_MILES
+MIN_DIFF_HOUR_BIKES_DELTA = station_trends.MIN_DIFF_HOUR_BIKES_DELTA
+MIN_DIFF_HOUR_POINTS = station_trends.MIN_DIFF_HOUR_POINTS
 
 # must be either True/False or False/True for now
 USE_POINTS = False
 SHOW_RATE_OF_CHANGE = not USE_POINTS
 
 USE_CACHED_NEARBY_PAIRS = True
+NEARBY_PAIRS_CACHE_PATH = station_trends.NEARBY_PAIRS_CACHE_PATH
+# cache the hourly statistics and lines in aggregate_cache.CACHE_DIR
+USE_AGGREGATE_CACHE = True
 
 
 def is_one_hour_after(dt2, dt1):
@@ -47,6 +58,8 @@ def in_time_interval(dt, desired_hour, is_weekend):
 
 
 def average_to_color(avg):
+    if math.isnan(avg):  # the station has no samples in this hour
+        return 0.5, 0.5, 0.5
     green = 1 / (1 + math.e ** -avg)
     red = 1 - (1 / (1 + math.e ** -avg))
     return red, green, 0
@@ -55,6 +68,8 @@ def average_to_color(avg):
 def stdev_to_size(avg, stdev):
     # TODO: right now the threshold is hardcoded, should be moved to a constant,
     #       especially if more graph types are added
+    if math.isnan(stdev):  # too few samples to tell
+        return 20
     if USE_POINTS:
         if abs(avg) > 0.5:  # this is points
             return 200 * (2 ** (-1 * stdev))
@@ -64,6 +79,20 @@ def stdev_to_size(avg, stdev):
     return 20
 
 
+def chart_title(desired_hour, is_weekend):
+    if SHOW_RATE_OF_CHANGE:
+        return (f"Change in number of {'points' if USE_POINTS else 'bikes'} from {desired_hour}:00 to "
+                f"{(desired_hour + 1) % 24}:00 on {'weekends' if is_weekend else 'weekdays'}")
+    return (f"Number of {'points' if USE_POINTS else 'bikes'} from {desired_hour}:00 to "
+            f"{(desired_hour + 1) % 24}:00 on {'weekends' if is_weekend else 'weekdays'}")
+
+
+def statistics_text(averages_list, stdevs_list):
+    return "\n".join((
+        r"$\mu(\mu)=%.3f$" % np.nanmean(averages_list),
+        r"$\mu(\sigma)=%.3f$" % np.nanmean(stdevs_list)))
+
+
 def draw(ax, background_img, desired_hour, is_weekend, longitudes_list, latitudes_list, colors_list, sizes_list,
          station_ids_list, lines, averages_list, stdevs_list, show_annotations):
     left, right = plt.xlim()
@@ -77,23 +106,49 @@ def draw(ax, background_img, desired_hour, is_weekend, longitudes_list, latitude
     if show_annotations:
         for i, station_id in enumerate(station_ids_list):
             ax.annotate(station_id, (longitudes_list[i], latitudes_list[i]), fontsize="xx-small", zorder=3)
-    for line in lines:
-        plt.plot(line[0], line[1], c="b", zorder=1)
-    if SHOW_RATE_OF_CHANGE:
-        ax.set_title(
-            f"Change in number of {'points' if USE_POINTS else 'bikes'} from {desired_hour}:00 to "
-            f"{(desired_hour + 1) % 24}:00 on {'weekends' if is_weekend else 'weekdays'}")
-    else:
-        ax.set_title(
-            f"Number of {'points' if USE_POINTS else 'bikes'} from {desired_hour}:00 to "
-            f"{(desired_hour + 1) % 24}:00 on {'weekends' if is_weekend else 'weekdays'}")
-    textstr = "\n".join((
-        r"$\mu(\mu)=%.3f$" % (sum(averages_list) / len(averages_list)),
-        r"$\mu(\sigma)=%.3f$" % (sum(stdevs_list) / len(stdevs_list))))
-    ax.text(0.05, 0.95, textstr, transform=ax.transAxes, fontsize=14,
+    ax.add_collection(LineCollection(lines, colors="b", zorder=1))
+    ax.set_title(chart_title(desired_hour, is_weekend))
+    ax.text(0.05, 0.95, statistics_text(averages_list, stdevs_list), transform=ax.transAxes, fontsize=14,
             verticalalignment="top", bbox=dict(boxstyle="round", facecolor="wheat", alpha=0.5))
 
 
+class StationMap:
+    """
+    Faster alternative to calling draw() on every animation frame: the background, station scatter plot, lines
+    and text are created once, and each frame only updates their data, so FuncAnimation can blit them.
+    """
+
+    def __init__(self, ax, background_img, is_weekend, longitudes_list, latitudes_list, station_ids_list,
+                 show_annotations):
+        self.ax = ax
+        self.is_weekend = is_weekend
+        ax.imshow(background_img, zorder=0, extent=BBOX, aspect="auto")
+        ax.set_xlim(BBOX[0], BBOX[1])
+        ax.set_ylim(BBOX[2], BBOX[3])
+        if show_annotations:
+            for i, station_id in enumerate(station_ids_list):
+                ax.annotate(station_id, (longitudes_list[i], latitudes_list[i]), fontsize="xx-small", zorder=3)
+        self.scatter = ax.scatter(longitudes_list, latitudes_list, zorder=2, alpha=1.0, animated=True)
+        self.lines = LineCollection([], colors="b", zorder=1, animated=True)
+        ax.add_collection(self.lines)
+        # the title is drawn inside the axes, since blitting only redraws the area inside them
+        self.title = ax.text(0.5, 0.99, "", transform=ax.transAxes, ha="center", va="top", zorder=4,
+                             animated=True, bbox=dict(boxstyle="round", facecolor="white", alpha=0.8))
+        self.statistics = ax.text(0.05, 0.9, "", transform=ax.transAxes, fontsize=14, verticalalignment="top",
+                                  zorder=4, animated=True, bbox=dict(boxstyle="round", facecolor="wheat", alpha=0.5))
+
+    def artists(self):
+        return self.scatter, self.lines, self.title, self.statistics
+
+    def update(self, desired_hour, colors_list, sizes_list, lines, averages_list, stdevs_list):
+        self.scatter.set_facecolor(colors_list)
+        self.scatter.set_sizes(sizes_list)
+        self.lines.set_segments(lines)
+        self.title.set_text(chart_title(desired_hour, self.is_weekend))
+        self.statistics.set_text(statistics_text(averages_list, stdevs_list))
+        return self.artists()
+
+
 def matches_desired_weekdays(dt, is_weekend):
     if is_weekend:
         desired_days = [5, 6]
@@ -107,26 +162,48 @@ def calculate_nearby_stations(station_ids_list, latitudes_list, longitudes_list)
     Returns a list (where each element corresponds to a station) of lists of stations with a
     strictly higher ID number that are within RADIUS_MILES of the station.
     """
-    nearby_stations = [[] for _ in station_ids_list]
-    for i, sid1 in enumerate(station_ids_list):
-        for j in range(i + 1, len(station_ids_list)):
-            coords1 = (latitudes_list[i], longitudes_list[i])
-            coords2 = (latitudes_list[j], longitudes_list[j])
-            if distance(coords1, coords2).miles < RADIUS_MILES:
-                nearby_stations[i].append(j)
-                # lines.append(([coords1[1], coords2[1]], [coords1[0], coords2[0]]))
-    return nearby_stations
+    return station_trends.calculate_nearby_stations(station_ids_list, latitudes_list, longitudes_list, RADIUS_MILES)
 
 
-def read_first_station_status_every_hour():
-    # read all the files in the processed_output directory to obtain timeseries data
-    filenames = os.listdir("data/processed_output/")
-    if not filenames:
-        raise Exception("no files found in data/processed_output/")
+def load_nearby_stations(station_ids_list, latitudes_list, longitudes_list):
+    """
+    Same as calculate_nearby_stations, but uses the result cached in NEARBY_PAIRS_CACHE_PATH if the stations,
+    their coordinates and RADIUS_MILES haven't changed since it was saved.
+    """
+    return station_trends.load_nearby_stations(station_ids_list, latitudes_list, longitudes_list,
+                                               USE_CACHED_NEARBY_PAIRS, NEARBY_PAIRS_CACHE_PATH)
 
-    previous_date = None
-    previous_hour = None
 
+def read_station_samples_every_hour(policy="first", store=None):
+    """
+    Downsamples the snapshot store to one sample per hour, using the hour index saved at ingest time.
+
+    :param policy: how to downsample each hour (one of time_buckets.DOWNSAMPLING_POLICIES); by default,
+                   the first snapshot in every hour is used
+    :param store: the snapshot store to read (opened if not given)
+    :return: the sample timestamps, the IDs of the stations that appear in any sample (sorted), and a
+             (sample x station) array of the number of points/bikes, with NaN where a station is missing
+    """
+    # open the snapshot store to obtain timeseries data
+    if store is None:
+        store = snapshot_store.load_store()
+    if len(store) == 0:
+        raise Exception("no snapshots found in the snapshot store")
+
+    index = time_buckets.load_bucket_index(store, time_buckets.SECONDS_PER_HOUR)
+    if USE_POINTS:
+        samples = time_buckets.downsample(store, index, snapshot_store.POINTS, policy, missing_field_value=0)
+    else:  # bikes
+        samples = time_buckets.downsample(store, index, snapshot_store.BIKES, policy)
+
+    present = ~np.isnan(samples)
+    station_order = sorted((station_id, i) for i, station_id in enumerate(store.station_ids) if present[:, i].any())
+    station_ids_list = [station_id for station_id, _ in station_order]
+    columns = [i for _, i in station_order]
+    return store.timestamps[index.row_starts], station_ids_list, samples[:, columns]
+
+
+def read_first_station_status_every_hour():
     # all_timestamps = {
     #     "10": { station id
     #         "3": [30, 15], timestamp: [values]
@@ -139,102 +216,83 @@ def read_first_station_status_every_hour():
     # }
     all_stations = {}
 
-    for filename in filenames:
-        timestamp = int(filename.split(".")[0])
-        dt = datetime.fromtimestamp(timestamp)
-        # read the first file in every unique hour
-        if previous_hour is None or previous_date != dt.date() or previous_hour != dt.hour:
-            with open(f"data/processed_output/{filename}") as file_stream:
-                contents = json.load(file_stream)
-                for station, values in contents.items():
-                    if station not in all_stations:
-                        all_stations[station] = {}
-                    if USE_POINTS:
-                        all_stations[station][timestamp] = contents[station][4] if len(contents[station]) == 5 else 0
-                    else:  # bikes
-                        all_stations[station][timestamp] = contents[station][1]
-            previous_date = dt.date()
-            previous_hour = dt.hour
+    timestamps, station_ids_list, samples = read_station_samples_every_hour()
+    timestamps = timestamps.tolist()
+    for i, station in enumerate(station_ids_list):
+        all_stations[station] = {timestamp: int(value) for timestamp, value
+                                 in zip(timestamps, samples[:, i].tolist()) if not math.isnan(value)}
     return all_stations
 
 
 def get_aggregate_station_statistics_by_hour(all_stations, is_weekend):
+    # convert the dicts into a (sample x station) array for the statistics engine
+    station_ids_list = list(all_stations)
+    timestamps = sorted({timestamp for station in all_stations.values() for timestamp in station})
+    timestamp_index = {timestamp: i for i, timestamp in enumerate(timestamps)}
+    samples = np.full((len(timestamps), len(station_ids_list)), np.nan)
+    for i, station in enumerate(station_ids_list):
+        rows = [timestamp_index[timestamp] for timestamp in all_stations[station]]
+        samples[rows, i] = list(all_stations[station].values())
+
+    averages, stdevs, counts = hourly_statistics.hourly_statistics(timestamps, samples, is_weekend,
+                                                                   SHOW_RATE_OF_CHANGE)
+
+    averages_list = averages.tolist()
+    stdevs_list = stdevs.tolist()
     all_station_statistics = [{} for _ in range(24)]
-    for station in all_stations:
-        timestamp_items = list(all_stations[station].items())
-        values = [[] for _ in range(24)]
-        if SHOW_RATE_OF_CHANGE:  # can show values themselves, or rate of change from value to value
-            for i in range(len(timestamp_items) - 1):
-                first = timestamp_items[i]  # e.g. (123456789, 12)
-                second = timestamp_items[i + 1]
-                first_dt = datetime.fromtimestamp(first[0])
-                second_dt = datetime.fromtimestamp(second[0])
-                if is_one_hour_after(second_dt, first_dt):
-                    if matches_desired_weekdays(first_dt, is_weekend):
-                        values[first_dt.hour].append(second[1] - first[1])
-                    else:
-                        pass
-                        # print(f"Weekday is {first_dt.weekday()} and time is {first_dt.hour}, skipping")
-                else:
-                    pass
-                    # print(f"Timestamp delta is {second_dt - first_dt}, skipping")
-        else:
-            for ts_item in timestamp_items:
-                dt = datetime.fromtimestamp(ts_item[0])
-                if matches_desired_weekdays(dt, is_weekend):
-                    values[dt.hour].append(ts_item[1])
-        if any(len(hourly_values) < 2 for hourly_values in values):
-            raise ValueError(f"len(values) is < 2 for id {station}")
-
-        for hour, hourly_values in enumerate(values):
-            avg = sum(hourly_values) / len(hourly_values)
-            stdev = statistics.stdev(hourly_values)
-            all_station_statistics[hour][station] = [avg, stdev]
-
+    for hour in range(24):
+        for i, station in enumerate(station_ids_list):
+            all_station_statistics[hour][station] = [averages_list[hour][i], stdevs_list[hour][i]]
     return all_station_statistics
 
 
-def get_station_coords_lists(station_ids_list):
-    latitudes_list = []
-    longitudes_list = []
-    with open("data/overall_stations.json") as file_stream:
-        contents = json.load(file_stream)
-    for station_id in station_ids_list:
-        latitudes_list.append(contents[station_id]["coords"][-1][1][0])
-        longitudes_list.append(contents[station_id]["coords"][-1][1][1])
-    return latitudes_list, longitudes_list
+def get_station_coords_lists(station_ids_list, time=None):
+    """
+    :param time: Unix timestamp to place the stations where they were at (None for their latest coordinates);
+                 stations added after it are placed where they were first seen
+    :return: lists of the latitudes and longitudes of the stations
+    """
+    return station_trends.station_coords_lists(station_ids_list, time)
+
+
+def get_data_type():
+    return "points" if USE_POINTS else "bikes"
+
+
+def get_min_diff():
+    if USE_POINTS and not SHOW_RATE_OF_CHANGE:
+        return MIN_DIFF_HOUR_POINTS
+    return MIN_DIFF_HOUR_BIKES_DELTA
 
 
 def calculate_lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages_list):
-    if USE_CACHED_NEARBY_PAIRS:
-        try:
-            with open("data/nearby_station_pairs.json") as file_stream:
-                nearby_stations = json.load(file_stream)
-        except FileNotFoundError:
-            nearby_stations = calculate_nearby_stations(station_ids_list, latitudes_list, longitudes_list)
-            with open("data/nearby_station_pairs.json", "w") as file_stream:
-                json.dump(nearby_stations, file_stream)
-    else:
-        nearby_stations = calculate_nearby_stations(station_ids_list, latitudes_list, longitudes_list)
-    lines = [[] for _ in range(24)]
-    for hour in range(24):
-        for i, stations_list in enumerate(nearby_stations):
-            for j in stations_list:
-                coords1 = (latitudes_list[i], longitudes_list[i])
-                coords2 = (latitudes_list[j], longitudes_list[j])
-                avg1 = averages_list[hour][i]
-                avg2 = averages_list[hour][j]
-                if USE_POINTS and not SHOW_RATE_OF_CHANGE:
-                    surpasses_min_diff = abs(avg1 - avg2) > MIN_DIFF_HOUR_POINTS
-                else:
-                    surpasses_min_diff = abs(avg1 - avg2) > MIN_DIFF_HOUR_BIKES_DELTA
-                if surpasses_min_diff:
-                    lines[hour].append(([coords1[1], coords2[1]], [coords1[0], coords2[0]]))
-    return lines
+    """
+    :return: for every hour, a (pair x 2 x 2) array of the line segments between the nearby stations whose
+             averages differ by more than the minimum difference (which can be passed to LineCollection)
+    """
+    return station_trends.calculate_lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list,
+                                                            averages_list, get_min_diff(), USE_CACHED_NEARBY_PAIRS)
+
+
+def get_hourly_statistics(is_weekend, policy="first"):
+    """
+    Returns the IDs of the stations, and (hour x station) arrays of the averages, standard deviations and sample
+    counts (see station_trends.hourly_statistics).
+    """
+    return station_trends.hourly_statistics(snapshot_store.load_store(), get_data_type(), is_weekend, policy,
+                                            USE_AGGREGATE_CACHE)
+
+
+def get_lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages):
+    """Same as calculate_lucrative_station_pairs, but cached in the aggregate cache."""
+    if not USE_AGGREGATE_CACHE:
+        return calculate_lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages)
+    return station_trends.lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages,
+                                                  get_data_type())
 
 
 def main():
-    global USE_POINTS, SHOW_RATE_OF_CHANGE
+    global USE_POINTS, SHOW_RATE_OF_CHANGE, USE_AGGREGATE_CACHE
 
     parser = argparse.ArgumentParser()
     parser.add_argument("data_type", help='type of data to plot ("points" or "bikes")')
@@ -242,11 +300,28 @@ def main():
     parser.add_argument("-a", "--show-annotations", help="show annotations", action="store_true")
     parser.add_argument("-s", "--single-hour", help="show only one hour", type=int)
     parser.add_argument("-i", "--interval", help="animation tick interval (ms)", type=int)
+    parser.add_argument("-k", "--top-routes", help="with --single-hour, also show the K most lucrative routes",
+                        type=int, metavar="K")
+    parser.add_argument("--redraw", help="redraw the whole map on every frame instead of blitting",
+                        action="store_true")
+    parser.add_argument("--save", help="save the animation (or the single hour) to a file instead of showing it")
+    parser.add_argument("--frames-dir", help="render all 24 frames to PNG files in this directory instead of "
+                                             "showing them")
+    parser.add_argument("--no-cache", help="recompute the hourly statistics and lines instead of using the "
+                                           "aggregate cache", action="store_true")
+    parser.add_argument("-r", "--resample", help="how to downsample each hour (default: first)",
+                        choices=time_buckets.DOWNSAMPLING_POLICIES, default="first")
+    parser.add_argument("--as-of", help="place the stations where they were at this date/time, e.g. 2020-11-02T08:00 "
+                                        "(default: at the last snapshot in the snapshot store)",
+                        type=datetime.fromisoformat)
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.configure(args)
     if args.data_type not in ["points", "bikes"]:
         print('error: data_type must be one of "points", "bikes"')
         exit(2)
     USE_POINTS = args.data_type == "points"
+    USE_AGGREGATE_CACHE = not args.no_cache
     SHOW_RATE_OF_CHANGE = not USE_POINTS
     is_weekend = args.weekend
     single_hour = args.single_hour
@@ -256,50 +331,95 @@ def main():
         interval = 500
     show_annotations = args.show_annotations
 
-    # read all the files in the processed_output directory to obtain timeseries data
-    all_stations = read_first_station_status_every_hour()
-    all_station_statistics = get_aggregate_station_statistics_by_hour(all_stations, is_weekend)
-
-    # create a unified order for the stations, then convert dicts into lists to prepare to input into Pyplot
-    station_ids_list = sorted(all_station_statistics[0].keys())
-    station_statistics_list = [[hourly_stats_dict[sid] for sid in station_ids_list]
-                               for hourly_stats_dict in all_station_statistics]
-    averages_list: List[List[float]] = [[station_tuple[0] for station_tuple in hourly_list]
-                                        for hourly_list in station_statistics_list]
-    stdevs_list: List[List[float]] = [[station_tuple[1] for station_tuple in hourly_list]
-                                      for hourly_list in station_statistics_list]
-    colors_list = [[average_to_color(station_tuple[0]) for station_tuple in hourly_list]
-                   for hourly_list in station_statistics_list]
-    sizes_list = [[stdev_to_size(station_tuple[0], station_tuple[1]) for station_tuple in hourly_list]
-                  for hourly_list in station_statistics_list]
-
-    # get the station coords
-    latitudes_list, longitudes_list = get_station_coords_lists(station_ids_list)
+    # downsample the snapshot store to one sample per hour to obtain timeseries data, and aggregate it by hour
+    with profiling.stage("hourly statistics"):
+        station_ids_list, averages, stdevs, counts = get_hourly_statistics(is_weekend, args.resample)
+
+    with profiling.stage("colors and sizes"):
+        # convert the (hour x station) arrays into lists to prepare to input into Pyplot
+        averages_list: List[List[float]] = averages.tolist()
+        stdevs_list: List[List[float]] = stdevs.tolist()
+        station_statistics_list = [list(zip(hourly_averages, hourly_stdevs))
+                                   for hourly_averages, hourly_stdevs in zip(averages_list, stdevs_list)]
+        colors_list = [[average_to_color(station_tuple[0]) for station_tuple in hourly_list]
+                       for hourly_list in station_statistics_list]
+        sizes_list = [[stdev_to_size(station_tuple[0], station_tuple[1]) for station_tuple in hourly_list]
+                      for hourly_list in station_statistics_list]
+
+    # get the station coords (stations that have moved are placed where they were at that time)
+    with profiling.stage("station coords") as coords_stage:
+        coords_stage.count_files([station_registry.OVERALL_STATIONS_PATH])
+        as_of = args.as_of.timestamp() if args.as_of is not None else int(snapshot_store.load_store().timestamps[-1])
+        latitudes_list, longitudes_list = get_station_coords_lists(station_ids_list, as_of)
     # find station pairs
-    lines = calculate_lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages_list)
-
-    boston = plt.imread("images/map.png")
-    fig, ax = plt.subplots()
-
-    ax.set_xlim(BBOX[0], BBOX[1])
-    ax.set_ylim(BBOX[2], BBOX[3])
+    with profiling.stage("lucrative station pairs"):
+        lines = get_lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages)
+
+    if args.frames_dir is not None or args.save is not None:
+        # render without a display
+        plt.switch_backend("Agg")
+    with profiling.stage("load map image") as image_stage:
+        image_stage.count_files(["images/map.png"])
+        boston = plt.imread("images/map.png")
+        fig, ax = plt.subplots()
+
+    if args.redraw:
+        ax.set_xlim(BBOX[0], BBOX[1])
+        ax.set_ylim(BBOX[2], BBOX[3])
+
+        def build_chart(hr):
+            hr = hr % 24
+            draw(ax, boston, hr, is_weekend, longitudes_list, latitudes_list,
+                 colors_list[hr], sizes_list[hr], station_ids_list,
+                 lines[hr], averages_list[hr], stdevs_list[hr], show_annotations)
+    else:
+        station_map = StationMap(ax, boston, is_weekend, longitudes_list, latitudes_list, station_ids_list,
+                                 show_annotations)
 
-    def build_chart(hr):
-        hr = hr % 24
-        draw(ax, boston, hr, is_weekend, longitudes_list, latitudes_list,
-             colors_list[hr], sizes_list[hr], station_ids_list,
-             lines[hr], averages_list[hr], stdevs_list[hr], show_annotations)
+        def build_chart(hr):
+            hr = hr % 24
+            return station_map.update(hr, colors_list[hr], sizes_list[hr], lines[hr],
+                                      averages_list[hr], stdevs_list[hr])
 
     if single_hour is not None:
+        # stations without enough samples in the hour are left out
         print(json.dumps(sorted(
-            zip([round(avg, ndigits=2) for avg in averages_list[single_hour]],
-                [round(stdev, ndigits=2) for stdev in stdevs_list[single_hour]],
-                station_ids_list))))
-        build_chart(single_hour)
+            (round(avg, ndigits=2), round(stdev, ndigits=2), station_id) for avg, stdev, station_id
+            in zip(averages_list[single_hour], stdevs_list[single_hour], station_ids_list)
+            if not math.isnan(avg) and not math.isnan(stdev))))
+        if args.top_routes is not None:
+            nearby_i, nearby_j = lucrative_pairs.nearby_pair_arrays(
+                load_nearby_stations(station_ids_list, latitudes_list, longitudes_list))
+            starts, ends, gains = lucrative_pairs.rank_routes(averages[single_hour], nearby_i, nearby_j,
+                                                              USE_POINTS, args.top_routes)
+            print(json.dumps([[round(gain, ndigits=2), station_ids_list[start], station_ids_list[end]]
+                              for start, end, gain in zip(starts.tolist(), ends.tolist(), gains.tolist())]))
+        with profiling.stage("render"):
+            build_chart(single_hour)
+            if not args.redraw:
+                # the artists are animated (only drawn when blitting), so draw them normally for a still image
+                for artist in station_map.artists():
+                    artist.set_animated(False)
+            if args.save is not None:
+                fig.savefig(args.save)
+    elif args.frames_dir is not None:
+        os.makedirs(args.frames_dir, exist_ok=True)
+        if not args.redraw:
+            for artist in station_map.artists():
+                artist.set_animated(False)
+        with profiling.stage("render frames"):
+            for hr in range(24):
+                build_chart(hr)
+                fig.savefig(f"{args.frames_dir}/{hr:02}.png")
     else:
-        animator = ani.FuncAnimation(fig, build_chart, interval=interval, frames=24, repeat=True)
-        # animator.save("my_animation.gif", fps=10)
-    plt.show()
+        animator = ani.FuncAnimation(fig, build_chart, interval=interval, frames=24, repeat=True,
+                                     blit=not args.redraw)
+        if args.save is not None:
+            # the file type is taken from the extension (e.g. .gif, or .mp4 if ffmpeg is installed)
+            with profiling.stage("render animation"):
+                animator.save(args.save, fps=1000 / interval)
+    if args.frames_dir is None and args.save is None:
+        plt.show()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,283 @@
+import os
+
+import numpy as np
+
+import snapshot_store
+import time_buckets
+
+# weekday classes of the accumulators
+WEEKDAY, WEEKEND = range(2)
+WEEKEND_DAYS = [5, 6]
+# hourly statistics (of the first snapshot in every hour) kept up to date at ingest time, by data type:
+# (field, value to use when a station didn't report the field, whether to use the change to the next hour)
+SAVED_STREAMS = {
+    "points": (snapshot_store.POINTS, 0, False),
+    "bikes": (snapshot_store.BIKES, np.nan, True)
+}
+
+
+class HourlyAccumulator:
+    """
+    Mergeable running count/mean/M2 (sum of squared deviations from the mean) accumulators for every
+    (weekday class, hour, station), using Welford's/Chan's algorithm. Memory use only depends on the number
+    of stations, no matter how many samples are added.
+    """
+
+    def __init__(self, num_stations, counts=None, means=None, m2s=None):
+        shape = (2, 24, num_stations)
+        self.counts = np.zeros(shape, dtype=np.int64) if counts is None else counts
+        self.means = np.zeros(shape) if means is None else means
+        self.m2s = np.zeros(shape) if m2s is None else m2s
+
+    @property
+    def num_stations(self):
+        return self.counts.shape[2]
+
+    def add_stations(self, num_stations):
+        """Adds empty accumulators for new stations (at the end)."""
+        padding = ((0, 0), (0, 0), (0, num_stations - self.num_stations))
+        self.counts = np.pad(self.counts, padding)
+        self.means = np.pad(self.means, padding)
+        self.m2s = np.pad(self.m2s, padding)
+
+    def merge(self, other):
+        """Combines the other accumulator's samples into this one (the result is the same as adding them directly)."""
+        if other.num_stations > self.num_stations:
+            self.add_stations(other.num_stations)
+        stations = slice(0, other.num_stations)
+        counts_a, means_a, m2s_a = self.counts[:, :, stations], self.means[:, :, stations], self.m2s[:, :, stations]
+        counts = counts_a + other.counts
+        with np.errstate(invalid="ignore", divide="ignore"):
+            deltas = other.means - means_a
+            weights = np.where(counts > 0, other.counts / counts, 0)
+            self.means[:, :, stations] = means_a + deltas * weights
+            self.m2s[:, :, stations] = m2s_a + other.m2s + deltas ** 2 * counts_a * weights
+        self.counts[:, :, stations] = counts
+
+    def add(self, weekday_classes, hours, samples):
+        """
+        :param weekday_classes: array of the weekday class (WEEKDAY/WEEKEND) of each sample row
+        :param hours: array of the hour of each sample row
+        :param samples: (row x station) array of samples, with NaN for missing samples
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            return
+        groups = np.asarray(weekday_classes) * 24 + np.asarray(hours)
+        selection = (groups[np.newaxis, :] == np.arange(48)[:, np.newaxis]).astype(np.float64)
+        present = ~np.isnan(samples)
+        counts = selection @ present
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = (selection @ np.where(present, samples, 0)) / counts
+        means[counts == 0] = 0
+        deviations = np.where(present, samples - means[groups], 0)
+        m2s = selection @ deviations ** 2
+        shape = (2, 24, samples.shape[1])
+        self.merge(HourlyAccumulator(samples.shape[1], counts.astype(np.int64).reshape(shape),
+                                     means.reshape(shape), m2s.reshape(shape)))
+
+    def statistics(self, weekday_class):
+        """
+        :return: (hour x station) arrays of the averages, standard deviations and sample counts for the weekday
+                 class (the average is NaN without samples, and the standard deviation with fewer than 2)
+        """
+        counts = self.counts[weekday_class]
+        averages = np.where(counts > 0, self.means[weekday_class], np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stdevs = np.where(counts > 1, np.sqrt(self.m2s[weekday_class] / (counts - 1)), np.nan)
+        return averages, stdevs, counts
+
+
+class HourlyStatisticsStream:
+    """
+    Keeps the hourly accumulators for one kind of sample (values, or the change from each hour to the next)
+    up to date as hourly samples arrive, and saves/loads them (with the state needed to continue) to/from disk.
+    """
+
+    def __init__(self, station_ids, rate_of_change, accumulator=None, station_sample_counts=None,
+                 last_hour_number=None, last_samples=None, last_bucket_number=None, first_timestamp=None,
+                 num_snapshots=None, last_timestamp=None):
+        """
+        :param station_sample_counts: array of the number of samples of each station (including ones that had
+                                      no next sample to calculate the change to)
+        :param last_hour_number: local hour number (hours since 1970-01-01 00:00 local time) of the last sample row
+        :param last_samples: the last sample row (needed to calculate the change to the next one)
+        :param last_bucket_number: bucket number of the last hour added from the snapshot store
+        :param first_timestamp: first timestamp of the snapshot store the samples came from
+        :param num_snapshots: number of snapshots in the snapshot store when the samples were last added from it
+        :param last_timestamp: timestamp of the last of those snapshots
+        """
+        self.station_ids = list(station_ids)
+        self.rate_of_change = rate_of_change
+        self.accumulator = HourlyAccumulator(len(station_ids)) if accumulator is None else accumulator
+        self.station_sample_counts = (np.zeros(len(station_ids), dtype=np.int64) if station_sample_counts is None
+                                      else station_sample_counts)
+        self.last_hour_number = last_hour_number
+        self.last_samples = np.full(len(station_ids), np.nan) if last_samples is None else last_samples
+        self.last_bucket_number = last_bucket_number
+        self.first_timestamp = first_timestamp
+        self.num_snapshots = num_snapshots
+        self.last_timestamp = last_timestamp
+
+    def add_stations(self, station_ids):
+        new_station_ids = station_ids[len(self.station_ids):]
+        self.station_ids.extend(new_station_ids)
+        self.accumulator.add_stations(len(self.station_ids))
+        self.station_sample_counts = np.append(self.station_sample_counts, np.zeros(len(new_station_ids), np.int64))
+        self.last_samples = np.append(self.last_samples, np.full(len(new_station_ids), np.nan))
+
+    def update(self, timestamps, samples):
+        """
+        :param timestamps: array of the timestamps of the hourly samples (sorted ascending, all newer than the
+                           previous update)
+        :param samples: (sample x station) array of samples, with NaN where a station is missing
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            return
+        self.station_sample_counts += (~np.isnan(samples)).sum(axis=0)
+        days, hours, weekdays = time_buckets.local_time_fields(timestamps)
+        weekday_classes = np.where(np.isin(weekdays, WEEKEND_DAYS), WEEKEND, WEEKDAY)
+        hour_numbers = days * 24 + hours
+        if self.rate_of_change:
+            # the change from each sample to the next, counted in the hour (and weekday class) of the first one,
+            # if the next one was taken in the following hour
+            previous_hour_numbers = np.insert(hour_numbers[:-1], 0,
+                                              -2 if self.last_hour_number is None else self.last_hour_number)
+            previous_samples = np.vstack([self.last_samples[np.newaxis, :], samples[:-1]])
+            previous_hours = (previous_hour_numbers % 24)
+            previous_classes = np.insert(weekday_classes[:-1], 0, self._hour_number_class(previous_hour_numbers[0]))
+            deltas = samples - previous_samples
+            deltas[hour_numbers - previous_hour_numbers != 1] = np.nan
+            self.accumulator.add(previous_classes, previous_hours, deltas)
+        else:
+            self.accumulator.add(weekday_classes, hours, samples)
+        self.last_hour_number = int(hour_numbers[-1])
+        self.last_samples = samples[-1].copy()
+
+    @staticmethod
+    def _hour_number_class(hour_number):
+        weekday = (hour_number // 24 + time_buckets.EPOCH_WEEKDAY) % 7
+        return WEEKEND if weekday in WEEKEND_DAYS else WEEKDAY
+
+    def statistics(self, is_weekend):
+        return self.accumulator.statistics(WEEKEND if is_weekend else WEEKDAY)
+
+    def save(self, path):
+        np.savez(f"{path}.tmp.npz", station_ids=np.array(self.station_ids), rate_of_change=self.rate_of_change,
+                 counts=self.accumulator.counts, means=self.accumulator.means, m2s=self.accumulator.m2s,
+                 station_sample_counts=self.station_sample_counts,
+                 last_hour_number=-1 if self.last_hour_number is None else self.last_hour_number,
+                 last_samples=self.last_samples,
+                 last_bucket_number=-1 if self.last_bucket_number is None else self.last_bucket_number,
+                 first_timestamp=-1 if self.first_timestamp is None else self.first_timestamp,
+                 num_snapshots=-1 if self.num_snapshots is None else self.num_snapshots,
+                 last_timestamp=-1 if self.last_timestamp is None else self.last_timestamp)
+        os.replace(f"{path}.tmp.npz", path)
+
+    @staticmethod
+    def load(path):
+        """Returns the saved stream, or None if there isn't one."""
+        try:
+            with np.load(path) as saved:
+                accumulator = HourlyAccumulator(len(saved["station_ids"]), saved["counts"], saved["means"],
+                                                saved["m2s"])
+                # (streams saved before num_snapshots and last_timestamp were added are rebuilt by prepare_stream)
+                optional = {name: (None if name not in saved.files or int(saved[name]) == -1 else int(saved[name]))
+                            for name in ["last_hour_number", "last_bucket_number", "first_timestamp",
+                                         "num_snapshots", "last_timestamp"]}
+                return HourlyStatisticsStream(saved["station_ids"].tolist(), bool(saved["rate_of_change"]),
+                                              accumulator, saved["station_sample_counts"],
+                                              last_samples=saved["last_samples"], **optional)
+        except FileNotFoundError:
+            return None
+
+
+def sample_rows(index, is_weekend, rate_of_change, policy="first"):
+    """
+    :param index: the store's hour index (from time_buckets.load_bucket_index)
+    :return: array of the snapshot store rows the statistics of the weekday class are calculated from: the rows
+             sampled in its hours (and, for the change to the next hour, in the hours right after them)
+    """
+    weekdays = (index.bucket_numbers // 24 + time_buckets.EPOCH_WEEKDAY) % 7
+    selected = np.isin(weekdays, WEEKEND_DAYS) == is_weekend
+    if rate_of_change:
+        selected[1:] |= selected[:-1] & (np.diff(index.bucket_numbers) == 1)
+    if policy == "first":
+        return index.row_starts[selected]
+    if policy == "last":
+        return index.row_ends[selected] - 1
+    first_row = int(index.row_starts[0]) if len(index) > 0 else 0
+    return np.arange(first_row, index.num_snapshots)[np.repeat(selected, index.row_ends - index.row_starts)]
+
+
+def stream_path(store_dir, data_type):
+    return f"{store_dir}/hourly_statistics_{data_type}.npz"
+
+
+def prepare_stream(stream, store, index):
+    """
+    Readies the stream to be fed the hours of the snapshot store that it hasn't seen yet.
+
+    :param index: the store's hour index (from time_buckets.load_bucket_index)
+    :return: the stream (or a new one if the store has been rebuilt since the stream was last fed), and the
+             position in the index of the first hour it hasn't seen
+    """
+    first_timestamp = int(store.timestamps[0]) if len(store) > 0 else None
+    # like the bucket index, the stream is only continued if the snapshots it has seen are still the first ones in
+    # the store (a rebuilt store may have had snapshots added anywhere, e.g. backfilled in the middle)
+    seen = stream.num_snapshots
+    rebuilt = stream.last_bucket_number is not None and (
+        seen is None or seen > len(store) or (seen > 0 and int(store.timestamps[seen - 1]) != stream.last_timestamp))
+    if (rebuilt or (stream.first_timestamp is not None and stream.first_timestamp != first_timestamp) or
+            store.station_ids[:len(stream.station_ids)] != stream.station_ids):
+        stream = HourlyStatisticsStream(store.station_ids, stream.rate_of_change)
+    stream.first_timestamp = first_timestamp
+    if len(store.station_ids) > len(stream.station_ids):
+        stream.add_stations(store.station_ids)
+
+    start = 0 if stream.last_bucket_number is None else int(np.searchsorted(index.bucket_numbers,
+                                                                              stream.last_bucket_number, "right"))
+    return stream, start
+
+
+def feed_store(stream, store, index, field, policy="first", missing_field_value=np.nan, chunk_size=2048):
+    """
+    Adds the hourly samples of one field of the snapshot store that the stream hasn't seen yet to it, a chunk of
+    hours at a time (so memory use doesn't grow with the archive). Only streams of the first snapshot in every hour
+    can be continued after more snapshots are added to the store, since the other policies depend on all the
+    snapshots in the last hour.
+
+    :param index: the store's hour index (from time_buckets.load_bucket_index)
+    :return: the stream, or a new one if the store has been rebuilt since the stream was last fed
+    """
+    stream, start = prepare_stream(stream, store, index)
+    for chunk_start in range(start, len(index), chunk_size):
+        chunk = index.subset(chunk_start, min(chunk_start + chunk_size, len(index)))
+        samples = time_buckets.downsample(store, chunk, field, policy, missing_field_value)
+        stream.update(store.timestamps[chunk.row_starts], samples)
+        stream.last_bucket_number = int(chunk.bucket_numbers[-1])
+    stream.num_snapshots = len(store)
+    stream.last_timestamp = int(store.timestamps[-1]) if len(store) > 0 else None
+    return stream
+
+
+def update_saved_streams(store, index, store_dir=snapshot_store.STORE_DIR):
+    """Brings the saved hourly statistics up to date with the store (called at ingest time)."""
+    for data_type, (field, missing_field_value, rate_of_change) in SAVED_STREAMS.items():
+        path = stream_path(store_dir, data_type)
+        stream = HourlyStatisticsStream.load(path) or HourlyStatisticsStream(store.station_ids, rate_of_change)
+        stream = feed_store(stream, store, index, field, "first", missing_field_value)
+        stream.save(path)
+
+
+def load_stream(store, index, data_type, policy="first", store_dir=snapshot_store.STORE_DIR):
+    """
+    :return: the hourly statistics stream of the data type ("points" or "bikes") covering the whole store: the
+             saved one (brought up to date in memory) for the first policy, or a new one for the other policies
+    """
+    field, missing_field_value, rate_of_change = SAVED_STREAMS[data_type]
+    stream = HourlyStatisticsStream.load(stream_path(store_dir, data_type)) if policy == "first" else None
+    if stream is None:
+        stream = HourlyStatisticsStream(store.station_ids, rate_of_change)
+    return feed_store(stream, store, index, field, policy, missing_field_value)
@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
 
+import argparse
+import math
+import multiprocessing
 import os
-import json
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 from datetime import datetime
 from datetime import timedelta
+from zoneinfo import ZoneInfo
 import numpy as np
-import sys
 
-station_id = None
+import profiling
+import snapshot_store
+import station_registry
+import time_buckets
+
 OVERLAY_SINGLE_DAY = True
 INCLUDE_LEGEND = False
 
@@ -18,13 +25,6 @@ WEEK_START_LINE_COLOR = (0.2, 0.2, 0.2)
 NORMAL_DAY_LINE_COLOR = (0.5, 0.5, 0.5)
 
 
-def process_file_contents(timestamp, contents):
-    if station_id in contents:
-        return contents[station_id]
-    else:
-        raise Exception(f"{station_id} is not present at timestamp {timestamp}")
-
-
 def initialize_current_date_data(arrays):
     # initialize current_date_data to the same number of empty arrays as there are variables
     current_date_data = []
@@ -69,6 +69,39 @@ def split_dates_and_modulo_time(timestamps, arrays,
     return dates_data
 
 
+def split_days(timestamps, arrays, time_zone=None):
+    """
+    Vectorized version of split_dates_and_modulo_time for Unix timestamps, which splits the data into days
+    (in the time zone) using integer arithmetic instead of datetime objects.
+
+    :param timestamps: array of Unix timestamps (sorted ascending)
+    :param arrays: list of arrays of values for each of the other variables
+    :param time_zone: tzinfo to use, or None for the local time zone
+    :return: the array of the day numbers (days since 1970-01-01) of the days with data, a (day x snapshot)
+             array of the time of day (in hours, to the minute) of each snapshot, and a (day x snapshot) array
+             for each variable, where each row holds one day's snapshots and is padded with NaN at the end
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    local_timestamps = timestamps + time_buckets.utc_offsets(timestamps, time_zone)
+    day_numbers = local_timestamps // time_buckets.SECONDS_PER_DAY
+    days, day_starts, day_lengths = np.unique(day_numbers, return_index=True, return_counts=True)
+    # position of each snapshot in its day's row
+    rows = np.repeat(np.arange(len(days)), day_lengths)
+    columns = np.arange(len(timestamps)) - day_starts[rows]
+
+    shape = (len(days), day_lengths.max() if len(days) > 0 else 0)
+    times = np.full(shape, np.nan)
+    seconds_of_day = local_timestamps % time_buckets.SECONDS_PER_DAY
+    times[rows, columns] = (seconds_of_day // time_buckets.SECONDS_PER_HOUR +
+                            seconds_of_day % time_buckets.SECONDS_PER_HOUR // 60 / 60)
+    matrices = []
+    for array in arrays:
+        matrix = np.full(shape, np.nan)
+        matrix[rows, columns] = array
+        matrices.append(matrix)
+    return days, times, matrices
+
+
 def add_weekday_lines(start_date, end_date):
     """
     Add lines to the plot to distinguish different days of the week.
@@ -85,84 +118,180 @@ def add_weekday_lines(start_date, end_date):
         start_date += timedelta(days=1)
 
 
-def main():
-    global station_id
-    station_id = sys.argv[1]
-
-    timestamps = []
-    active = []
-    bikes = []
-    bikes_and_docks = []
-    capacities = []
-    points = []
-
-    start_date = None
-    end_time = None
-
-    # read all the files in the processed_output directory to obtain timeseries data
-    filenames = os.listdir("data/processed_output/")
-    if not filenames:
-        raise Exception("no files found in data/processed_output/")
-
-    for filename in filenames:
-        with open(f"data/processed_output/{filename}") as file_stream:
-            contents = json.load(file_stream)
-            timestamp = datetime.fromtimestamp(int(filename.split(".")[0]))
-        if start_date is None:
-            # gets the start date as a date object (with 00:00 as the time of day)
-            start_date = datetime.combine(timestamp.date(), datetime.min.time())  # todo: could probably just use a date object instead
-        end_time = timestamp  # todo: Is there a more efficient way to do this than reassigning this each loop?
-        id_contents = process_file_contents(timestamp, contents)
-        timestamps.append(timestamp)
-
-        # The following lines depend on the serialization format from
-        # process_data.py - should this be standardized/documented?
-        active.append(id_contents[0])  # TODO: incorporate this into the plot?
-        bikes.append(id_contents[1])
-        bikes_and_docks.append(id_contents[1] + id_contents[2])
-        capacities.append(id_contents[3])
-        if len(id_contents) == 5:
-            points.append(id_contents[4])
-        else:
-            points.append(None)
-    end_date = datetime.combine(end_time.date(), datetime.min.time())
+def plot_station(station_id, name, timestamps, station_values, time_zone=None):
+    """
+    Plots the data for one station on the current figure.
 
-    # read the name of the station whose ID was specified as a command-line argument
-    with open("data/overall_stations.json") as file_stream:
-        contents = json.load(file_stream)
-    name = contents[station_id]["name"][-1][1]
+    :param timestamps: array of the Unix timestamps of the snapshots
+    :param station_values: (snapshot x field) array of the station's values (as returned for one station by
+                           snapshot_store.load_snapshots), where the columns are the fields listed in
+                           snapshot_store.FIELDS, with NaN where the station is absent (which leaves a gap in the plot)
+    :param time_zone: tzinfo to show the times in, or None for the local time zone
+    """
+    if np.isnan(station_values[:, snapshot_store.BIKES]).all():
+        raise Exception(f"{station_id} is not present in any of the snapshots")
+    active = station_values[:, snapshot_store.IS_ACTIVE] == 1  # TODO: incorporate this into the plot?
+    bikes = station_values[:, snapshot_store.BIKES]
+    bikes_and_docks = bikes + station_values[:, snapshot_store.DOCKS]
+    capacities = station_values[:, snapshot_store.CAPACITY]
+    points = station_values[:, snapshot_store.POINTS]
 
     # TODO: deal with inactive stations
 
     # create the plot
     if OVERLAY_SINGLE_DAY:
         variables_to_graph = [points]  # change this to add more variables to the plot (doesn't work well currently)
-        for i, date_array in enumerate(split_dates_and_modulo_time(timestamps, variables_to_graph)):
-            if i % 7 in [0, 1, 2, 3, 6]:
-                for variable_array in date_array[1:]:
-                    # [x % 2 if x is not None else None for x in variable_array]
-                    plt.plot(date_array[0], variable_array, label=i)
+        _, times, matrices = split_days(timestamps, variables_to_graph, time_zone)
+        days_to_graph = np.isin(np.arange(len(times)) % 7, [0, 1, 2, 3, 6])
+        # draw all the days as one collection of lines (the NaN padding at the end of each day isn't drawn),
+        # colored like separate plt.plot calls would be
+        colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+        ax = plt.gca()
+        for matrix in matrices:
+            segments = np.stack([times[days_to_graph], matrix[days_to_graph]], axis=-1)
+            ax.add_collection(LineCollection(segments, colors=[colors[i % len(colors)] for i in range(len(segments))]))
+        ax.autoscale_view()
         plt.axis(ymin=-3, ymax=3)
         # replace "on weekdays" appropriately
         plt.title(f"Angel point values on weekdays at {name} (station ID {station_id})")
     else:
         plt.axis(ymin=-3)
         plt.title(f"Bike capacity at {name} (station ID {station_id})")
-        plt.plot(timestamps, bikes, label="# Bikes")
-        plt.plot(timestamps, bikes_and_docks, label="# Bikes + Docks")
-        plt.plot(timestamps, capacities, label="Capacity")
-        plt.plot(timestamps, points, label="Angel Points")
+        datetimes = [datetime.fromtimestamp(timestamp, time_zone) for timestamp in timestamps.tolist()]
+        # gets the start date as a date object (with 00:00 as the time of day)
+        start_date = datetime.combine(datetimes[0].date(), datetime.min.time(), datetimes[0].tzinfo)
+        end_date = datetime.combine(datetimes[-1].date(), datetime.min.time(), datetimes[-1].tzinfo)
+        plt.plot(datetimes, bikes, label="# Bikes")
+        plt.plot(datetimes, bikes_and_docks, label="# Bikes + Docks")
+        plt.plot(datetimes, capacities, label="Capacity")
+        plt.plot(datetimes, points, label="Angel Points")
         add_weekday_lines(start_date, end_date)
 
     if INCLUDE_LEGEND:
         plt.legend()
 
-    # add labels/ticks to the plot, and then show it
+    # add labels/ticks to the plot
     plt.xlabel("Date/Time")
     xmin, xmax, ymin, ymax = plt.axis()
     plt.yticks(np.arange(ymin, ymax + 1, step=1))
 
-    plt.show()
+
+# state shared by the batch export worker processes (set up once per worker by init_batch_worker)
+batch_store = None
+batch_station_names = None
+batch_output_dir = None
+batch_file_format = None
+batch_time_zone = None
+batch_time_range = None
+
+
+def init_batch_worker(station_names, output_dir, file_format, time_zone, time_range):
+    global batch_store, batch_station_names, batch_output_dir, batch_file_format, batch_time_zone, batch_time_range
+    plt.switch_backend("Agg")
+    batch_store = snapshot_store.load_store()
+    batch_station_names = station_names
+    batch_output_dir = output_dir
+    batch_file_format = file_format
+    batch_time_zone = time_zone
+    batch_time_range = time_range
+
+
+def export_station_plots(station_ids):
+    """
+    Renders the plots for a chunk of stations to files (runs in a batch export worker process).
+    Returns a list of (station ID, error message or None) pairs.
+    """
+    # read the chunk's columns of the store in one pass
+    timestamps, chunk_values = snapshot_store.load_snapshots(station_ids, *batch_time_range, store=batch_store)
+    results = []
+    for i, station_id in enumerate(station_ids):
+        try:
+            figure = plt.figure()
+            plot_station(station_id, batch_station_names[station_id], timestamps, chunk_values[:, i, :],
+                         batch_time_zone)
+            figure.savefig(f"{batch_output_dir}/{station_id}.{batch_file_format}")
+            plt.close(figure)
+            results.append((station_id, None))
+        except Exception as exception:
+            plt.close("all")
+            results.append((station_id, str(exception)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("station_ids", nargs="*", help="ID(s) of the station(s) to plot", metavar="station_id")
+    parser.add_argument("--all", help="plot all the stations in the snapshot store", action="store_true")
+    parser.add_argument("-o", "--output-dir", help="save the plots to this directory instead of showing them")
+    parser.add_argument("-f", "--format", help="file format of the saved plots (default: png)",
+                        choices=["png", "svg", "pdf"], default="png")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes used to save the plots (default: number of CPUs)")
+    parser.add_argument("-z", "--time-zone", type=ZoneInfo,
+                        help="IANA time zone to show the times in, e.g. America/New_York (default: local time zone)")
+    parser.add_argument("--start", type=datetime.fromisoformat,
+                        help="only plot the snapshots from this date/time on, e.g. 2020-11-02 or 2020-11-02T08:00")
+    parser.add_argument("--end", type=datetime.fromisoformat,
+                        help="only plot the snapshots before this date/time")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+    # the dates/times are in the time zone the plots are shown in
+    time_range = [None if time is None else time.replace(tzinfo=time.tzinfo or args.time_zone)
+                  for time in [args.start, args.end]]
+
+    # open the snapshot store to read the timeseries data
+    with profiling.stage("open snapshot store"):
+        store = snapshot_store.load_store()
+        first_row, last_row = store.row_range(*time_range)
+    if first_row == last_row:
+        raise Exception("no snapshots found in the snapshot store" +
+                        (" in the time range" if args.start is not None or args.end is not None else ""))
+    station_ids = store.station_ids if args.all else args.station_ids
+    if not station_ids:
+        parser.error("no station IDs given (use --all to plot all the stations)")
+    unknown_station_ids = [station_id for station_id in station_ids if station_id not in store.station_index]
+    if unknown_station_ids and args.output_dir is None:
+        raise Exception(f"{unknown_station_ids[0]} is not present in the snapshot store")
+    # when saving the plots, the unknown stations are reported and the others are still plotted
+    for station_id in unknown_station_ids:
+        print(f"Could not plot station {station_id}: it is not present in the snapshot store")
+    station_ids = [station_id for station_id in station_ids if station_id in store.station_index]
+    if not station_ids:
+        raise Exception("none of the stations are present in the snapshot store")
+
+    # read the names of the stations (as of the last plotted snapshot, in case any have been renamed since)
+    with profiling.stage("station names") as names_stage:
+        names_stage.count_files([station_registry.OVERALL_STATIONS_PATH])
+        station_names = station_registry.load_registry().names_as_of(station_ids, int(store.timestamps[last_row - 1]))
+
+    if args.output_dir is None:
+        if len(station_ids) > 1:
+            parser.error("only one station can be shown at a time (use --output-dir to save the plots)")
+        station_id = station_ids[0]
+        with profiling.stage("load snapshots"):
+            timestamps, values = snapshot_store.load_snapshots([station_id], *time_range, store=store)
+        with profiling.stage("plot"):
+            plot_station(station_id, station_names[station_id], timestamps, values[:, 0, :], args.time_zone)
+        plt.show()
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    # split the stations into a few chunks per worker, so that each worker reads the store a few times in total
+    chunk_size = max(1, math.ceil(len(station_ids) / (args.jobs * 4)))
+    chunks = [station_ids[i:i + chunk_size] for i in range(0, len(station_ids), chunk_size)]
+    num_saved = 0
+    initargs = (station_names, args.output_dir, args.format, args.time_zone, time_range)
+    # the plots are rendered by the workers, whose CPU time is counted once the pool has exited
+    with profiling.stage("export plots"):
+        with multiprocessing.Pool(args.jobs, initializer=init_batch_worker, initargs=initargs) as pool:
+            for results in pool.imap_unordered(export_station_plots, chunks):
+                for station_id, error in results:
+                    if error is None:
+                        num_saved += 1
+                    else:
+                        print(f"Could not plot station {station_id}: {error}")
+    print(f"Saved plots of {num_saved} stations to {args.output_dir}/")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import aggregate_cache
+import online_statistics
+import profiling
+import snapshot_store
+import station_trends
+import time_buckets
+
+# Computes the aggregates of every scenario the viewers show (the hourly statistics and lucrative lines of each
+# data type, for weekdays and weekends, for each downsampling policy) in one run, and writes them to one versioned
+# artifact (station_trends.PRECOMPUTED_PATH), which map_station_trends.py, query.py and the other viewers use
+# whenever it matches the current snapshot store.
+#
+# The snapshot store is read once, into shared memory, and every worker process reads the snapshots from there.
+# The hours that aren't covered by the statistics saved at ingest time are split into chunks, and each worker
+# accumulates the statistics of one chunk of one (data type, policy); the accumulators of the chunks are then merged
+# (which gives the same statistics as adding the chunks one after another), so every core is used no matter how many
+# scenarios there are.
+
+# the number of hours each worker accumulates at a time (at most)
+MAX_CHUNK_HOURS = 2048
+
+# set in each worker process by init_worker
+worker_store = None
+worker_index = None
+_worker_memory = None
+
+
+def init_worker(memory_name, shape, timestamps, station_ids, index):
+    """Opens the snapshot values that were copied to shared memory (without copying them again)."""
+    global worker_store, worker_index, _worker_memory
+    _worker_memory = shared_memory.SharedMemory(name=memory_name)
+    values = np.ndarray(shape, dtype=snapshot_store.VALUES_DTYPE, buffer=_worker_memory.buf)
+    worker_store = snapshot_store.SnapshotStore(timestamps, station_ids, values)
+    worker_index = index
+
+
+def accumulate_chunk(task):
+    """
+    :param task: (data type, policy, first hour, end hour) of the chunk, as positions in the hour index
+    :return: the task, and the accumulator and per-station sample counts of the chunk
+    """
+    data_type, policy, start, end = task
+    field, missing_field_value, rate_of_change = online_statistics.SAVED_STREAMS[data_type]
+    stream = online_statistics.HourlyStatisticsStream(worker_store.station_ids, rate_of_change)
+    if rate_of_change and start > 0:
+        # the change from the hour before the chunk to its first hour belongs to this chunk
+        previous = worker_index.subset(start - 1, start)
+        days, hours, _ = time_buckets.local_time_fields(worker_store.timestamps[previous.row_starts])
+        stream.last_hour_number = int(days[0] * 24 + hours[0])
+        stream.last_samples = time_buckets.downsample(worker_store, previous, field, policy, missing_field_value)[0]
+    chunk = worker_index.subset(start, end)
+    samples = time_buckets.downsample(worker_store, chunk, field, policy, missing_field_value)
+    stream.update(worker_store.timestamps[chunk.row_starts], samples)
+    return task, stream.accumulator, stream.station_sample_counts
+
+
+def base_stream(store, index, data_type, policy):
+    """
+    :return: the stream the chunks are merged into (the one saved at ingest time for the first policy, or an empty
+             one), and the position in the index of the first hour it doesn't cover
+    """
+    _, _, rate_of_change = online_statistics.SAVED_STREAMS[data_type]
+    stream = None
+    if policy == "first":
+        stream = online_statistics.HourlyStatisticsStream.load(
+            online_statistics.stream_path(snapshot_store.STORE_DIR, data_type))
+    if stream is None:
+        stream = online_statistics.HourlyStatisticsStream(store.station_ids, rate_of_change)
+    return online_statistics.prepare_stream(stream, store, index)
+
+
+def chunk_tasks(streams, num_hours, jobs):
+    """Splits the hours each stream doesn't cover into about jobs chunks in total."""
+    num_missing_hours = sum(num_hours - start for _, start in streams.values())
+    chunk_hours = min(MAX_CHUNK_HOURS, max(1, -(-num_missing_hours // jobs)))
+    return [(data_type, policy, chunk_start, min(chunk_start + chunk_hours, num_hours))
+            for (data_type, policy), (_, start) in streams.items()
+            for chunk_start in range(start, num_hours, chunk_hours)]
+
+
+def compute_streams(store, index, policies, jobs):
+    """
+    :return: dict of (data type, policy) -> online_statistics.HourlyStatisticsStream covering the whole store
+    """
+    streams = {(data_type, policy): base_stream(store, index, data_type, policy)
+               for data_type in station_trends.DATA_TYPES for policy in policies}
+    tasks = chunk_tasks(streams, len(index), jobs)
+    if not tasks:
+        return {scenario: stream for scenario, (stream, _) in streams.items()}
+
+    with profiling.stage("copy snapshots to shared memory") as copy_stage:
+        copy_stage.count_files([f"{snapshot_store.STORE_DIR}/values.bin"])
+        memory = shared_memory.SharedMemory(create=True, size=max(1, store.values.nbytes))
+        values = np.ndarray(store.values.shape, dtype=snapshot_store.VALUES_DTYPE, buffer=memory.buf)
+        values[:] = store.values
+        del values
+    try:
+        initargs = (memory.name, store.values.shape, np.asarray(store.timestamps), store.station_ids, index)
+        # the snapshots are read by the workers, whose CPU time is counted once the pool has exited
+        with profiling.stage("accumulate hourly statistics"):
+            with multiprocessing.Pool(min(jobs, len(tasks)), initializer=init_worker, initargs=initargs) as pool:
+                for (data_type, policy, _, _), accumulator, sample_counts in pool.imap_unordered(accumulate_chunk,
+                                                                                                 tasks):
+                    stream, _ = streams[data_type, policy]
+                    stream.accumulator.merge(accumulator)
+                    stream.station_sample_counts += sample_counts
+    finally:
+        memory.close()
+        memory.unlink()
+    return {scenario: stream for scenario, (stream, _) in streams.items()}
+
+
+def scenario_name(data_type, is_weekend, policy):
+    return f"{data_type}-{'weekend' if is_weekend else 'weekday'}-{policy}"
+
+
+def precompute(policies=("first",), jobs=None, path=station_trends.PRECOMPUTED_PATH):
+    """
+    Computes the aggregates of every scenario and writes them to the artifact at path.
+
+    :param policies: the downsampling policies (time_buckets.DOWNSAMPLING_POLICIES) to compute the scenarios for
+    :param jobs: number of worker processes (default: number of CPUs)
+    :return: the names of the scenarios written
+    """
+    jobs = jobs or os.cpu_count()
+    with profiling.stage("open snapshot store"):
+        store = snapshot_store.load_store()
+        if len(store) == 0:
+            raise Exception("no snapshots found in the snapshot store")
+        index = time_buckets.load_bucket_index(store, time_buckets.SECONDS_PER_HOUR)
+    streams = compute_streams(store, index, policies, jobs)
+
+    arrays = {}
+    scenarios = []
+    with profiling.stage("lucrative station pairs"):
+        for (data_type, policy), stream in streams.items():
+            for is_weekend in [False, True]:
+                name = scenario_name(data_type, is_weekend, policy)
+                statistics = station_trends.statistics_arrays(stream, is_weekend)
+                station_ids = statistics["station_ids"].tolist()
+                # placed where they were at the last snapshot, like map_station_trends.py and query.py do
+                latitudes, longitudes = station_trends.station_coords_lists(station_ids, int(store.timestamps[-1]))
+                min_diff = station_trends.MIN_DIFFS[data_type]
+                lines = station_trends.calculate_lucrative_station_pairs(station_ids, latitudes, longitudes,
+                                                                         statistics["averages"], min_diff)
+                arrays.update({f"{name}.{field}": value for field, value in statistics.items()})
+                arrays.update({f"{name}.{field}": value
+                               for field, value in station_trends.lucrative_lines_arrays(lines).items()})
+                arrays[f"{name}.statistics_key"] = station_trends.hourly_statistics_key(store, data_type, is_weekend,
+                                                                                        policy, index)
+                arrays[f"{name}.lines_key"] = station_trends.lucrative_station_pairs_key(
+                    station_ids, latitudes, longitudes, statistics["averages"], min_diff)
+                scenarios.append(name)
+
+    with profiling.stage("write artifact"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(f"{path}.tmp.npz", version=station_trends.PRECOMPUTED_VERSION, scenarios=np.array(scenarios),
+                 store=json.dumps(aggregate_cache.store_fingerprint(store)), created=int(time.time()), **arrays)
+        os.replace(f"{path}.tmp.npz", path)
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="precompute the station trends of every scenario in parallel")
+    parser.add_argument("-r", "--resample", action="append", choices=time_buckets.DOWNSAMPLING_POLICIES,
+                        help="how to downsample each hour; can be given more than once (default: first)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-o", "--output", default=station_trends.PRECOMPUTED_PATH,
+                        help=f"path of the artifact to write (default: {station_trends.PRECOMPUTED_PATH})")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+
+    start = time.perf_counter()
+    scenarios = precompute(args.resample or ["first"], args.jobs, args.output)
+    print(f"Wrote {len(scenarios)} scenarios ({', '.join(scenarios)}) to {args.output} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
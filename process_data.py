@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 
+import argparse
 import json
+import multiprocessing
 import os
 from datetime import datetime
 
+import online_statistics
+import profiling
+import snapshot_store
+import time_buckets
+
+
+RAW_OUTPUT_DIR = "raw_output"
+INGEST_STATE_PATH = "data/ingest_state.json"
 
 overall_stations = {}
 
 
-def process_file_contents(timestamp, contents):
-    if "message" in contents:
-        print(f"Message: \"{contents['message']}\" at time {timestamp}")
-        return
+def parse_snapshot(timestamp, contents):
+    """
+    Flattens one raw feed snapshot. This doesn't touch overall_stations, so it can run in a worker process.
+
+    :return: the processed snapshot (station ID -> [is_active, bikes, docks, capacity(, points)]) and the
+             station details (station ID -> [name, coords]) to merge into overall_stations
+    """
     stations = contents["features"]
     processed = {}
+    station_details = {}
     # print(datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'))
     for station in stations:
         coords = station["geometry"]["coordinates"]
@@ -30,7 +44,17 @@ def process_file_contents(timestamp, contents):
         if "bike_angels" in station["properties"]:
             processed_entry.append(station["properties"]["bike_angels"]["score"])
         processed[station_id] = processed_entry
+        station_details[station_id] = [name, coords]
+    return processed, station_details
+
 
+def merge_station_history(timestamp, station_details):
+    """
+    Adds new stations to overall_stations, and records any name/coords changes.
+    Must be called in timestamp order. Snapshots that aren't newer than a station's last recorded change (e.g. ones
+    merged again after an interrupted run) are skipped for it, so its history stays in timestamp order.
+    """
+    for station_id, (name, coords) in station_details.items():
         station_entry = {
             "name": [[timestamp, name]],
             "coords": [[timestamp, coords]],
@@ -42,24 +66,140 @@ def process_file_contents(timestamp, contents):
             overall_stations[station_id] = station_entry
         else:
             for field_name in ["name", "coords"]:
+                if timestamp <= overall_stations[station_id][field_name][-1][0]:
+                    continue
                 if overall_stations[station_id][field_name][-1][1] != station_entry[field_name][0][1]:
                     print(f"Station {name} ({station_id}) has changed its {field_name} from "
                           f"{overall_stations[station_id][field_name][-1][1]} to {station_entry[field_name][0][1]}")
                     overall_stations[station_id][field_name].append([timestamp, station_entry[field_name][0][1]])
+
+
+def write_processed_snapshot(timestamp, processed):
     with open(f"data/processed_output/{timestamp}.json", "w") as file_stream:
         json.dump(processed, file_stream)
 
 
-def main():
-    for filename in os.listdir("raw_output/"):
-        if os.stat(f"raw_output/{filename}").st_size == 0:
+def process_file_contents(timestamp, contents):
+    if "message" in contents:
+        print(f"Message: \"{contents['message']}\" at time {timestamp}")
+        return
+    processed, station_details = parse_snapshot(timestamp, contents)
+    merge_station_history(timestamp, station_details)
+    write_processed_snapshot(timestamp, processed)
+    return processed
+
+
+def parse_raw_file(snapshot):
+    """
+    Reads, parses and writes out one raw snapshot (the part of processing that runs in the worker pool).
+
+    :param snapshot: a (timestamp, filename) pair from list_raw_snapshots
+    :return: None if the file is empty, otherwise a (timestamp, message, processed, station_details) tuple,
+             where message is set (and the rest is None) if the feed returned a message instead of stations
+    """
+    timestamp, filename = snapshot
+    if os.stat(f"{RAW_OUTPUT_DIR}/{filename}").st_size == 0:
+        return None
+    with open(f"{RAW_OUTPUT_DIR}/{filename}") as file_stream:
+        contents = json.load(file_stream)
+    if "message" in contents:
+        return timestamp, contents["message"], None, None
+    processed, station_details = parse_snapshot(timestamp, contents)
+    write_processed_snapshot(timestamp, processed)
+    return timestamp, None, processed, station_details
+
+
+def list_raw_snapshots(after=None, raw_output_dir=RAW_OUTPUT_DIR):
+    """
+    Returns (timestamp, filename) pairs for the files in raw_output_dir, sorted by timestamp,
+    so that station name and coordinate changes are detected in the order they happened.
+
+    :param after: if given, only snapshots with a timestamp strictly greater than this are returned
+    """
+    snapshots = []
+    for filename in os.listdir(f"{raw_output_dir}/"):
+        # skip anything that isn't a finished snapshot, e.g. a .tmp file the collector is still writing
+        if not (filename.endswith(".json") and filename[:-len(".json")].isdigit()):
             continue
-        with open(f"raw_output/{filename}") as file_stream:
-            timestamp = int(filename.split(".")[0])
-            contents = json.load(file_stream)
-        process_file_contents(timestamp, contents)
-    with open("data/overall_stations.json", "w") as file_stream:
-        json.dump(overall_stations, file_stream)
+        timestamp = int(filename.split(".")[0])
+        if after is None or timestamp > after:
+            snapshots.append((timestamp, filename))
+    snapshots.sort()
+    return snapshots
+
+
+def load_ingest_state():
+    """
+    Loads the state saved by the previous run: the high-water-mark timestamp (the newest raw snapshot that
+    has been processed) and the per-station history in overall_stations.json.
+    Returns None if there is no saved state.
+    """
+    global overall_stations
+    try:
+        with open(INGEST_STATE_PATH) as file_stream:
+            state = json.load(file_stream)
+        with open("data/overall_stations.json") as file_stream:
+            overall_stations = json.load(file_stream)
+    except FileNotFoundError:
+        return None
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--incremental", action="store_true",
+                        help="only process raw snapshots newer than the last run, appending them to the saved data")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes used to parse the raw snapshots (default: number of CPUs)")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+
+    state = load_ingest_state() if args.incremental else None
+    if args.incremental and state is None:
+        print(f"No ingest state found at {INGEST_STATE_PATH}, processing all raw snapshots")
+    high_water_mark = state["high_water_mark"] if state is not None else None
+
+    with profiling.stage("list raw snapshots"):
+        snapshots = list_raw_snapshots(after=high_water_mark)
+    records = []
+    with profiling.stage("parse raw snapshots") as parse_stage:
+        # the files are read by the workers, so they are counted here
+        parse_stage.count_files(f"{RAW_OUTPUT_DIR}/{filename}" for _, filename in snapshots)
+        with multiprocessing.Pool(args.jobs) as pool:
+            # imap returns the results in order, so the station history is merged in timestamp order
+            chunksize = max(1, len(snapshots) // (args.jobs * 16))
+            for result in pool.imap(parse_raw_file, snapshots, chunksize=chunksize):
+                if result is None:
+                    continue
+                timestamp, message, processed, station_details = result
+                high_water_mark = timestamp
+                if message is not None:
+                    print(f"Message: \"{message}\" at time {timestamp}")
+                    continue
+                merge_station_history(timestamp, station_details)
+                records.append((timestamp, processed))
+
+    with profiling.stage("write station history"):
+        with open("data/overall_stations.json", "w") as file_stream:
+            json.dump(overall_stations, file_stream)
+    with profiling.stage("write snapshot store"):
+        if state is not None:
+            snapshot_store.append_to_store(records)
+        else:
+            timestamps, station_ids, values = snapshot_store.records_to_arrays(records)
+            snapshot_store.write_store(timestamps, station_ids, values)
+    with profiling.stage("update indexes and statistics"):
+        store = snapshot_store.load_store()
+        for bucket_seconds in time_buckets.INDEXED_BUCKET_SECONDS:
+            index = time_buckets.update_bucket_index(store, bucket_seconds)
+            if bucket_seconds == time_buckets.SECONDS_PER_HOUR:
+                online_statistics.update_saved_streams(store, index)
+    # the state is saved last, so an interrupted run is simply redone by the next one (the snapshots already in
+    # the store are skipped by append_to_store, and the changes already in the history by merge_station_history)
+    with open(INGEST_STATE_PATH, "w") as file_stream:
+        json.dump({"high_water_mark": high_water_mark}, file_stream)
+    print(f"Processed {len(records)} snapshots (high-water mark: {high_water_mark})")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+import atexit
+import cProfile
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# Opt-in timing of the pipeline stages. Code marks its stages with
+#
+#   with profiling.stage("parse snapshots"):
+#       ...
+#
+# which does nothing unless profiling was enabled (by --profile, or by setting PROFILE_ENV_VAR), in which case every
+# stage records its wall and CPU time, the files and bytes it read, and its peak memory, and a summary table (or a
+# JSON trace that can be opened in chrome://tracing or https://ui.perfetto.dev) is written when the script exits.
+# Stages can be nested; a stage's time includes its nested stages.
+
+# "1" to print the summary table, or the path of a JSON trace to write
+PROFILE_ENV_VAR = "BIKES_PROFILE"
+# comma-separated names of the stages to also run under cProfile
+CPROFILE_ENV_VAR = "BIKES_CPROFILE"
+CPROFILE_DIR = "data/profiles"
+
+enabled = False
+trace_path = None
+cprofile_stages = set()
+# finished stages, in the order they started
+records = []
+# stages that are running, innermost last
+_open_stages = []
+
+
+class Stage:
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.files = 0
+        self.bytes = 0
+        # highest traced memory seen by the stages nested in this one (peaks are reset when a stage starts)
+        self.nested_peak = 0
+
+    def count_files(self, paths):
+        """Records that the stage read the given files."""
+        for path in paths:
+            self.files += 1
+            self.bytes += os.path.getsize(path)
+
+
+class _DisabledStage:
+    def count_files(self, paths):
+        pass
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+
+def enable(path=None, profiled_stages=()):
+    """
+    :param path: path of the JSON trace to write at exit, or None to print the summary table
+    :param profiled_stages: names of the stages to also run under cProfile ("all" for every stage)
+    """
+    global enabled, trace_path
+    if not enabled:
+        atexit.register(report)
+    enabled = True
+    trace_path = path
+    cprofile_stages.update(profiled_stages)
+    # tracemalloc slows down allocation-heavy code, so it is only started when profiling
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", nargs="?", const="", metavar="TRACE_PATH",
+                        help="time the stages of the script and print a summary at exit (or write a JSON trace "
+                             f"to TRACE_PATH); can also be enabled by setting {PROFILE_ENV_VAR}")
+    parser.add_argument("--cprofile", action="append", default=[], metavar="STAGE",
+                        help=f"with --profile, also run this stage under cProfile (saved to {CPROFILE_DIR}/), "
+                             "or \"all\"")
+
+
+def configure(args=None):
+    """Enables profiling if it was asked for on the command line (parsed args) or in the environment."""
+    setting = os.environ.get(PROFILE_ENV_VAR)
+    if args is not None and args.profile is not None:
+        setting = args.profile
+    if setting is None:
+        return
+    profiled_stages = list(args.cprofile) if args is not None else []
+    profiled_stages += [name for name in os.environ.get(CPROFILE_ENV_VAR, "").split(",") if name]
+    enable(setting if setting not in ["", "1"] else None, profiled_stages)
+
+
+def count_files(paths):
+    """Records that the innermost running stage read the given files (does nothing when profiling is disabled)."""
+    if enabled and _open_stages:
+        _open_stages[-1].count_files(paths)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Times the code in the with block as a pipeline stage."""
+    if not enabled:
+        yield _DISABLED_STAGE
+        return
+
+    current_stage = Stage(name, len(_open_stages))
+    start_memory, peak_memory = tracemalloc.get_traced_memory()
+    for open_stage in _open_stages:
+        open_stage.nested_peak = max(open_stage.nested_peak, peak_memory)
+    tracemalloc.reset_peak()
+    _open_stages.append(current_stage)
+    profiler = None
+    if name in cprofile_stages or "all" in cprofile_stages:
+        profiler = cProfile.Profile()
+    record = {"name": name, "depth": current_stage.depth}
+    # added now, so that the records stay in the order the stages started
+    records.append(record)
+    start_times = os.times()
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield current_stage
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall_seconds = time.perf_counter() - start
+        end_times = os.times()
+        _open_stages.pop()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        peak_memory = max(peak_memory, current_stage.nested_peak)
+        for open_stage in _open_stages:
+            open_stage.nested_peak = max(open_stage.nested_peak, peak_memory)
+        record.update({
+            "start": start,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": max(0.0, end_times.user + end_times.system - start_times.user - start_times.system),
+            # worker processes are only counted once they have exited
+            "child_cpu_seconds": max(0.0, end_times.children_user + end_times.children_system -
+                                     start_times.children_user - start_times.children_system),
+            "files": current_stage.files,
+            "bytes": current_stage.bytes,
+            "peak_memory_bytes": peak_memory - start_memory
+        })
+        if profiler is not None:
+            record["cprofile_path"] = save_cprofile(profiler, name)
+
+
+def save_cprofile(profiler, name):
+    os.makedirs(CPROFILE_DIR, exist_ok=True)
+    path = f"{CPROFILE_DIR}/{''.join(c if c.isalnum() else '_' for c in name)}.prof"
+    profiler.dump_stats(path)
+    return path
+
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GiB"
+
+
+def summary_table():
+    lines = [f"{'stage':<36} {'wall (s)':>9} {'cpu (s)':>8} {'workers (s)':>11} {'files':>7} {'read':>10} "
+             f"{'peak memory':>11}"]
+    for record in records:
+        if "wall_seconds" not in record:
+            continue
+        name = "  " * record["depth"] + record["name"]
+        lines.append(f"{name:<36} {record['wall_seconds']:>9.3f} {record['cpu_seconds']:>8.3f} "
+                     f"{record['child_cpu_seconds']:>11.3f} {record['files']:>7} "
+                     f"{format_bytes(record['bytes']):>10} {format_bytes(record['peak_memory_bytes']):>11}")
+    return "\n".join(lines)
+
+
+def trace_events():
+    """The finished stages as Chrome trace events (which can be opened in chrome://tracing or Perfetto)."""
+    first_start = min((record["start"] for record in records if "start" in record), default=0)
+    return {"traceEvents": [{"name": record["name"], "ph": "X", "pid": os.getpid(), "tid": 0,
+                             "ts": (record["start"] - first_start) * 1e6, "dur": record["wall_seconds"] * 1e6,
+                             "args": {key: value for key, value in record.items()
+                                      if key not in ["name", "start", "wall_seconds"]}}
+                            for record in records if "wall_seconds" in record],
+            "displayTimeUnit": "ms"}
+
+
+def report():
+    """Prints the summary table, or writes the JSON trace (called at exit when profiling is enabled)."""
+    if not enabled or not records:
+        return
+    if trace_path is not None:
+        with open(f"{trace_path}.tmp", "w") as file_stream:
+            json.dump(trace_events(), file_stream, indent=1)
+        os.replace(f"{trace_path}.tmp", trace_path)
+        print(f"Wrote the profile of {len(records)} stages to {trace_path}", file=sys.stderr)
+    else:
+        print(summary_table(), file=sys.stderr)
+    for record in records:
+        if "cprofile_path" in record:
+            print(f"cProfile statistics of {record['name']} saved to {record['cprofile_path']} "
+                  f"(view them with python -m pstats {record['cprofile_path']})", file=sys.stderr)
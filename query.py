@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import argparse
+import http.client
+import json
+import math
+import os
+import sys
+import threading
+from datetime import datetime
+from urllib.parse import parse_qs, urlencode, urlparse, urlsplit
+
+# Answers the questions map_station_trends.py answers (the ranking of the stations in an hour, the nearby station
+# pairs, and the lucrative pairs and routes) as JSON, without plotting anything. Only the standard library is
+# imported up front (and not http.server, which is slow to import): NumPy and the aggregates are imported when the
+# first query is answered, and nothing imports matplotlib. For repeated queries, run a server that keeps everything
+# loaded between them:
+#
+#   ./query.py serve &
+#   ./query.py ranking -d points -H 8 --server http://127.0.0.1:8081    # only needs the standard library
+#
+# (or set QUERY_SERVER_ENV_VAR to the server's URL instead of passing --server).
+
+DEFAULT_PORT = 8081
+QUERY_SERVER_ENV_VAR = "BIKES_QUERY_SERVER"
+QUERIES = ["ranking", "nearby", "lucrative", "routes"]
+DEFAULT_ROUTES = 10
+
+
+class QueryEngine:
+    def __init__(self, policy="first", use_cache=True):
+        """
+        :param policy: how to downsample each hour (one of time_buckets.DOWNSAMPLING_POLICIES)
+        :param use_cache: use the aggregates in the aggregate cache (and add the ones that are computed to it)
+        """
+        global np, lucrative_pairs, snapshot_store, station_registry, station_trends
+        import numpy as np
+        import lucrative_pairs
+        import snapshot_store
+        import station_registry
+        import station_trends
+
+        # the queries of a server are answered in several threads, any of which can reload the data, so each query
+        # holds the lock while it runs (answering one only takes about a millisecond once everything is loaded)
+        self.lock = threading.RLock()
+        self.policy = policy
+        self.use_cache = use_cache
+        self.store = None
+        self.version = None
+        # (data type, is weekend) -> (station IDs, averages, stdevs) of the hourly statistics
+        self.statistics = {}
+        # tuple of station IDs -> (latitudes, longitudes, nearby_i, nearby_j)
+        self.locations = {}
+        # (data type, is weekend) -> lucrative lines of every hour
+        self.lines = {}
+
+    def refresh(self):
+        """Drops everything loaded so far if the snapshot store or the station history has changed since."""
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        version = (os.stat(f"{snapshot_store.STORE_DIR}/meta.json").st_mtime_ns,
+                   os.stat(station_registry.OVERALL_STATIONS_PATH).st_mtime_ns)
+        if version != self.version:
+            self.store = snapshot_store.load_store()
+            self.version = version
+            self.statistics.clear()
+            self.locations.clear()
+            self.lines.clear()
+
+    def hourly_statistics(self, data_type, is_weekend):
+        with self.lock:
+            self._refresh()
+            if (data_type, is_weekend) not in self.statistics:
+                station_ids, averages, stdevs, _ = station_trends.hourly_statistics(
+                    self.store, data_type, is_weekend, self.policy, self.use_cache)
+                self.statistics[data_type, is_weekend] = (station_ids, averages, stdevs)
+            return self.statistics[data_type, is_weekend]
+
+    def station_locations(self, station_ids):
+        """:return: the latitudes and longitudes of the stations (at the last snapshot), and their nearby pairs"""
+        with self.lock:
+            if tuple(station_ids) not in self.locations:
+                latitudes, longitudes = station_trends.station_coords_lists(station_ids,
+                                                                            int(self.store.timestamps[-1]))
+                nearby_stations = station_trends.load_nearby_stations(station_ids, latitudes, longitudes)
+                self.locations[tuple(station_ids)] = (latitudes, longitudes,
+                                                      *lucrative_pairs.nearby_pair_arrays(nearby_stations))
+            return self.locations[tuple(station_ids)]
+
+    def ranking(self, data_type, hour, is_weekend=False):
+        """
+        :return: list of the [average, standard deviation, station ID] of the stations in the hour, lowest average
+                 first (the same as map_station_trends.py --single-hour)
+        """
+        with self.lock:
+            station_ids, averages, stdevs = self.hourly_statistics(data_type, is_weekend)
+            # stations without enough samples in the hour are left out
+            return sorted(
+                [round(avg, ndigits=2), round(stdev, ndigits=2), station_id] for avg, stdev, station_id
+                in zip(averages[hour].tolist(), stdevs[hour].tolist(), station_ids)
+                if not math.isnan(avg) and not math.isnan(stdev))
+
+    def nearby_pairs(self, data_type="points", is_weekend=False):
+        """:return: list of the [station ID, station ID] pairs within station_trends.RADIUS_MILES of each other"""
+        with self.lock:
+            station_ids, _, _ = self.hourly_statistics(data_type, is_weekend)
+            _, _, nearby_i, nearby_j = self.station_locations(station_ids)
+            return [[station_ids[i], station_ids[j]] for i, j in zip(nearby_i.tolist(), nearby_j.tolist())]
+
+    def lucrative(self, data_type, hour, is_weekend=False):
+        """
+        :return: list of the line segments ([[lon1, lat1], [lon2, lat2]]) between the nearby stations whose averages
+                 in the hour differ by more than the minimum difference (the lines map_station_trends.py draws)
+        """
+        with self.lock:
+            station_ids, averages, _ = self.hourly_statistics(data_type, is_weekend)
+            if (data_type, is_weekend) not in self.lines:
+                latitudes, longitudes, _, _ = self.station_locations(station_ids)
+                self.lines[data_type, is_weekend] = station_trends.lucrative_station_pairs(
+                    station_ids, latitudes, longitudes, averages, data_type, self.use_cache)
+            return np.round(self.lines[data_type, is_weekend][hour], 6).tolist()
+
+    def routes(self, data_type, hour, is_weekend=False, k=DEFAULT_ROUTES):
+        """
+        :return: list of the [expected gain, start station ID, end station ID] of the k most lucrative rides between
+                 nearby stations in the hour (the same as map_station_trends.py --top-routes)
+        """
+        with self.lock:
+            station_ids, averages, _ = self.hourly_statistics(data_type, is_weekend)
+            _, _, nearby_i, nearby_j = self.station_locations(station_ids)
+            starts, ends, gains = lucrative_pairs.rank_routes(averages[hour], nearby_i, nearby_j,
+                                                              data_type == "points", k)
+            return [[round(gain, ndigits=2), station_ids[start], station_ids[end]]
+                    for start, end, gain in zip(starts.tolist(), ends.tolist(), gains.tolist())]
+
+
+def query_parameters(data_type="points", hour=None, weekend=False, k=DEFAULT_ROUTES):
+    """Converts the parameters of a query (from the command line or a query string) to their types."""
+    if data_type not in ["points", "bikes"]:
+        raise ValueError('data_type must be one of "points", "bikes"')
+    hour = datetime.now().hour if hour is None else int(hour)
+    if not 0 <= hour < 24:
+        raise ValueError("hour must be from 0 to 23")
+    if isinstance(weekend, str):
+        weekend = weekend.lower() in ["1", "true", "yes"]
+    return data_type, hour, weekend, int(k)
+
+
+def run_query(engine, name, data_type="points", hour=None, weekend=False, k=DEFAULT_ROUTES):
+    data_type, hour, weekend, k = query_parameters(data_type, hour, weekend, k)
+    if name == "ranking":
+        return engine.ranking(data_type, hour, weekend)
+    if name == "nearby":
+        return engine.nearby_pairs(data_type, weekend)
+    if name == "lucrative":
+        return engine.lucrative(data_type, hour, weekend)
+    if name == "routes":
+        return engine.routes(data_type, hour, weekend, k)
+    raise ValueError(f"unknown query {name}")
+
+
+def make_request_handler(engine):
+    from http.server import BaseHTTPRequestHandler
+
+    class QueryRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            name = url.path.strip("/")
+            if name not in QUERIES:
+                self.send_error(404)
+                return
+            parameters = {key: values[0] for key, values in parse_qs(url.query).items()
+                          if key in ["data_type", "hour", "weekend", "k"]}
+            try:
+                body = run_query(engine, name, **parameters)
+            except ValueError as exception:
+                self.send_error(400, str(exception))
+                return
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryRequestHandler
+
+
+def ask_server(server_url, name, parameters):
+    """:return: the JSON answer of the query server at server_url to the query"""
+    url = urlsplit(server_url)
+    query_string = urlencode({key: value for key, value in parameters.items() if value is not None})
+    connection = http.client.HTTPConnection(url.netloc)
+    try:
+        connection.request("GET", f"{url.path.rstrip('/')}/{name}?{query_string}")
+        response = connection.getresponse()
+        body = response.read().decode()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise Exception(f"the query server answered with HTTP status {response.status} ({response.reason})")
+    return body
+
+
+def serve(engine, host, port):
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), make_request_handler(engine))
+    # load everything the first queries will need before accepting them
+    for data_type in ["points", "bikes"]:
+        engine.routes(data_type, 0)
+    print(f"Serving /{', /'.join(QUERIES)} on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="answer station trend queries as JSON, without plotting")
+    parser.add_argument("query", choices=QUERIES + ["serve"],
+                        help="ranking: the stations by their average in the hour, nearby: the nearby station pairs, "
+                             "lucrative: the lines between the lucrative pairs in the hour, routes: the most "
+                             "lucrative rides in the hour, serve: answer the queries over HTTP")
+    parser.add_argument("-d", "--data-type", choices=["points", "bikes"], default="points",
+                        help="average points (default), or average change in bikes")
+    parser.add_argument("-H", "--hour", type=int, choices=range(24), metavar="HOUR",
+                        help="hour of the day (default: now)")
+    parser.add_argument("-w", "--weekend", action="store_true", help="use the weekend statistics")
+    parser.add_argument("-k", type=int, default=DEFAULT_ROUTES,
+                        help=f"number of routes (default: {DEFAULT_ROUTES})")
+    # (time_buckets.DOWNSAMPLING_POLICIES, which isn't imported so that answering from a server stays fast)
+    parser.add_argument("-r", "--resample", choices=["first", "last", "mean", "min", "max"], default="first",
+                        help="how to downsample each hour (default: first)")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the aggregate cache")
+    parser.add_argument("--server", default=os.environ.get(QUERY_SERVER_ENV_VAR),
+                        help="URL of a running query server to ask instead of loading the data "
+                             f"(default: ${QUERY_SERVER_ENV_VAR})")
+    parser.add_argument("--host", default="127.0.0.1", help="with serve, address to serve on (default: 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT,
+                        help=f"with serve, port to serve on (default: {DEFAULT_PORT})")
+    args = parser.parse_args()
+
+    if args.query == "serve":
+        serve(QueryEngine(args.resample, not args.no_cache), args.host, args.port)
+        return
+    parameters = {"data_type": args.data_type, "hour": args.hour, "weekend": args.weekend, "k": args.k}
+    if args.server is not None:
+        sys.stdout.write(ask_server(args.server, args.query, parameters) + "\n")
+        return
+    print(json.dumps(run_query(QueryEngine(args.resample, not args.no_cache), args.query, **parameters)))
+
+
+if __name__ == "__main__":
+    main()
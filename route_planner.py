@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import argparse
+import heapq
+import json
+from datetime import datetime
+
+import numpy as np
+
+import lucrative_pairs
+import snapshot_store
+import spatial_index
+import station_trends
+
+BIKE_SPEED_MPH = 8
+WALK_SPEED_MPH = 3
+# time to check out and dock a bike on each ride
+DOCKING_MINUTES = 2
+# how far the rider is willing to walk to the first station
+MAX_WALK_MILES = 0.25
+MAX_HOPS = 4
+
+
+class RouteGraph:
+    def __init__(self, station_ids, latitudes, longitudes, nearby_i, nearby_j, hourly_averages, use_points):
+        """
+        Directed graph of the rides between nearby stations, stored as adjacency arrays (CSR): the rides from
+        station s are edges indptr[s]:indptr[s + 1] of targets, minutes and gains.
+
+        :param nearby_i: array of the first station index of every nearby pair (both directions are added)
+        :param hourly_averages: (hour x station) array of the hourly averages of the points (or of the change in
+                                bikes, for which the gain is of riding from a station gaining bikes to one losing
+                                them), as in lucrative_pairs.rank_routes
+        """
+        self.station_ids = station_ids
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        sources = np.concatenate([nearby_i, nearby_j]).astype(np.int64)
+        targets = np.concatenate([nearby_j, nearby_i]).astype(np.int64)
+        order = np.lexsort((targets, sources))
+        sources, self.targets = sources[order], targets[order]
+        self.indptr = np.searchsorted(sources, np.arange(len(station_ids) + 1))
+        miles = spatial_index.haversine_miles(self.latitudes[sources], self.longitudes[sources],
+                                              self.latitudes[self.targets], self.longitudes[self.targets])
+        self.minutes = miles / BIKE_SPEED_MPH * 60 + DOCKING_MINUTES
+        values = np.asarray(hourly_averages, dtype=np.float64)
+        if not use_points:
+            values = -values
+        # (hour x edge) expected gain of each ride, with NaN where either station has no average
+        self.gains = values[:, self.targets] - values[:, sources]
+
+
+def build_route_graph(station_ids, latitudes, longitudes, nearby_stations, hourly_averages, use_points):
+    """
+    :param nearby_stations: list (where each element corresponds to a station) of lists of the nearby stations
+                            with a higher index, as returned by station_trends.load_nearby_stations
+    """
+    nearby_i, nearby_j = lucrative_pairs.nearby_pair_arrays(nearby_stations)
+    return RouteGraph(station_ids, latitudes, longitudes, nearby_i, nearby_j, hourly_averages, use_points)
+
+
+def plan_itineraries(graph, hour, latitude, longitude, time_budget_minutes, k=5, max_hops=MAX_HOPS, min_gain=0):
+    """
+    Finds the itineraries (walking to a station within MAX_WALK_MILES, then riding from station to station,
+    without visiting a station twice) with the highest total expected gain that fit in the time budget.
+
+    The search expands partial itineraries in order of elapsed time from a priority queue, and only drops one once
+    k others that reached the same station sooner with at least as much gain, in no more rides and without visiting
+    any station it hasn't, dominate it: each of them can be extended by any rides it could be, to an itinerary that
+    is at least as good, so the k best itineraries are still found.
+
+    :param hour: hour of the day whose averages are used
+    :param min_gain: minimum expected gain of each ride
+    :return: list of (total gain, total minutes, list of station IDs) tuples, best first
+    """
+    walk_miles = spatial_index.haversine_miles(latitude, longitude, graph.latitudes, graph.longitudes)
+    hourly_gains = np.nan_to_num(graph.gains[hour], nan=-np.inf).tolist()
+    targets = graph.targets.tolist()
+    minutes = graph.minutes.tolist()
+    indptr = graph.indptr.tolist()
+
+    # queue of (minutes, -gain, station, path) of the partial itineraries
+    queue = [(float(walk_miles[station]) / WALK_SPEED_MPH * 60, 0.0, int(station), (int(station),))
+             for station in np.flatnonzero(walk_miles <= MAX_WALK_MILES)]
+    heapq.heapify(queue)
+    # station -> list of the (minutes, gain, stations) of the itineraries that reached it so far
+    labels = {}
+    itineraries = []
+    while queue:
+        elapsed, negative_gain, station, path = heapq.heappop(queue)
+        gain = -negative_gain
+        if len(path) > 1:
+            itineraries.append((gain, elapsed, path))
+        stations = frozenset(path)
+        dominating = 0
+        for other_elapsed, other_gain, other_stations in labels.get(station, []):
+            if other_elapsed <= elapsed and other_gain >= gain and other_stations <= stations:
+                dominating += 1
+                if dominating == k:
+                    break
+        if dominating == k:
+            continue
+        labels.setdefault(station, []).append((elapsed, gain, stations))
+        if len(path) > max_hops:
+            continue
+        for edge in range(indptr[station], indptr[station + 1]):
+            target = targets[edge]
+            ride_gain = hourly_gains[edge]
+            if ride_gain <= min_gain or target in path or elapsed + minutes[edge] > time_budget_minutes:
+                continue
+            heapq.heappush(queue, (elapsed + minutes[edge], -(gain + ride_gain), target, path + (target,)))
+
+    best = heapq.nlargest(k, itineraries, key=lambda itinerary: (itinerary[0], -itinerary[1]))
+    return [(gain, elapsed, [graph.station_ids[station] for station in path]) for gain, elapsed, path in best]
+
+
+def load_route_graph(data_type, is_weekend):
+    """Builds the route graph from the hourly statistics of the snapshot store and the nearby station index."""
+    store = snapshot_store.load_store()
+    station_ids, averages, _, _ = station_trends.hourly_statistics(store, data_type, is_weekend)
+    # placed where they were at the last snapshot, like map_station_trends.py and query.py do (so they share the
+    # cached nearby pairs)
+    latitudes, longitudes = station_trends.station_coords_lists(station_ids, int(store.timestamps[-1]))
+    nearby_stations = station_trends.load_nearby_stations(station_ids, latitudes, longitudes)
+    return build_route_graph(station_ids, latitudes, longitudes, nearby_stations, averages, data_type == "points")
+
+
+def main():
+    now = datetime.now()
+    parser = argparse.ArgumentParser(description="plan the most lucrative bike angel rides from a location")
+    parser.add_argument("latitude", type=float)
+    parser.add_argument("longitude", type=float)
+    parser.add_argument("-t", "--minutes", type=float, default=30, help="time budget in minutes (default: 30)")
+    parser.add_argument("-H", "--hour", type=int, choices=range(24), default=now.hour, metavar="HOUR",
+                        help="hour of the day (default: now)")
+    parser.add_argument("-w", "--weekend", action="store_true", help="use the weekend statistics")
+    parser.add_argument("-d", "--data-type", choices=["points", "bikes"], default="points",
+                        help="plan by the average points (default), or by the average change in bikes")
+    parser.add_argument("-k", type=int, default=5, help="number of itineraries to show (default: 5)")
+    args = parser.parse_args()
+
+    graph = load_route_graph(args.data_type, args.weekend)
+    itineraries = plan_itineraries(graph, args.hour, args.latitude, args.longitude, args.minutes, args.k)
+    print(json.dumps([[round(gain, ndigits=2), round(elapsed, ndigits=1), path]
+                      for gain, elapsed, path in itineraries]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import snapshot_store
+import time_buckets
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+# Compact binary archive of the snapshot store, with one block file per (local) day:
+#
+# data/compact_archive/
+#     <day number>.bin - MAGIC, the header length (uint32), a JSON header (format version, compression,
+#                        snapshot count and station IDs in column order), and the compressed payload
+#
+# The payload holds the int64 timestamp deltas, the bit-packed active flags (snapshot x station), and one
+# (station x snapshot) uint8 plane each for bikes, docks, capacity and points (as int8). Each plane is stored as
+# the change from the previous snapshot (mod 256), which is almost always 0, so it compresses very well.
+#
+# The archive is a storage and transfer format, not something the scripts read: they all read the dense snapshot
+# store, which can be memory-mapped. Instead of keeping data/processed_output/ (over 100 times larger) to be able to
+# rebuild the store, keep the archive, and rebuild the store from it with ./snapshot_store.py --from-archive.
+
+ARCHIVE_DIR = "data/compact_archive"
+ARCHIVE_VERSION = 1
+MAGIC = b"BBSC"
+COMPRESSIONS = ["zlib", "zstd", "none"]
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+# fields stored as uint8 planes, and the byte that marks a missing value in each
+PLANE_FIELDS = [snapshot_store.BIKES, snapshot_store.DOCKS, snapshot_store.CAPACITY, snapshot_store.POINTS]
+UNSIGNED_MISSING = 255
+# points are stored as int8, so -128 marks a missing value
+SIGNED_MISSING = -128
+
+
+def _field_plane(values, field):
+    """Converts one field of the store values to a (snapshot x station) uint8 plane."""
+    column = values[:, :, field]
+    missing = column == snapshot_store.MISSING
+    if field == snapshot_store.POINTS:
+        low, high, missing_value = SIGNED_MISSING + 1, 127, SIGNED_MISSING
+    else:
+        low, high, missing_value = 0, UNSIGNED_MISSING - 1, UNSIGNED_MISSING
+    if ((column[~missing] < low) | (column[~missing] > high)).any():
+        raise ValueError(f"{snapshot_store.FIELDS[field]} values must be between {low} and {high} to be encoded")
+    return np.where(missing, missing_value, column).astype(np.int8 if field == snapshot_store.POINTS
+                                                           else np.uint8).view(np.uint8)
+
+
+def _compress(data, compression):
+    if compression == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL)
+    if compression == "zstd":
+        if zstandard is None:
+            raise Exception("zstd compression needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def _decompress(data, compression):
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise Exception("zstd compression needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def encode_block(timestamps, station_ids, values, compression="zlib"):
+    """
+    Encodes snapshots in the store format as one compact block.
+
+    :param timestamps: array of the snapshot timestamps (sorted ascending)
+    :param station_ids: list of station IDs, in column order
+    :param values: (snapshot x station x field) int16 array, as in the snapshot store
+    :param compression: one of COMPRESSIONS
+    :return: the encoded block (bytes)
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression}")
+    timestamps = np.asarray(timestamps, dtype=snapshot_store.TIMESTAMPS_DTYPE)
+    values = np.asarray(values)
+    parts = [np.diff(timestamps, prepend=0).astype(np.int64).tobytes(),
+             np.packbits(values[:, :, snapshot_store.IS_ACTIVE] == 1).tobytes()]
+    for field in PLANE_FIELDS:
+        plane = _field_plane(values, field)
+        # deltas along the time axis (wrapping around in uint8), stored one station after another
+        parts.append(np.diff(plane, axis=0, prepend=np.zeros((1, plane.shape[1]), np.uint8)).T.tobytes())
+    header = json.dumps({"version": ARCHIVE_VERSION, "compression": compression, "num_snapshots": len(timestamps),
+                         "station_ids": list(station_ids)}).encode()
+    return MAGIC + struct.pack("<I", len(header)) + header + _compress(b"".join(parts), compression)
+
+
+def decode_block(data):
+    """
+    Decodes a block written by encode_block directly into NumPy arrays.
+
+    :return: the timestamps, station IDs and (snapshot x station x field) values, in the snapshot store format
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise Exception("not a compact snapshot block")
+    header_length, = struct.unpack_from("<I", data, len(MAGIC))
+    header_end = len(MAGIC) + 4 + header_length
+    header = json.loads(data[len(MAGIC) + 4:header_end])
+    if header["version"] != ARCHIVE_VERSION:
+        raise Exception(f"unsupported compact block version {header['version']}")
+    num_snapshots = header["num_snapshots"]
+    station_ids = header["station_ids"]
+    num_values = num_snapshots * len(station_ids)
+    payload = np.frombuffer(_decompress(data[header_end:], header["compression"]), dtype=np.uint8)
+
+    offset = 8 * num_snapshots
+    timestamps = np.cumsum(payload[:offset].view(np.int64)).astype(snapshot_store.TIMESTAMPS_DTYPE)
+    active_length = (num_values + 7) // 8
+    active = np.unpackbits(payload[offset:offset + active_length], count=num_values).reshape(num_snapshots, -1)
+    offset += active_length
+
+    values = np.empty((num_snapshots, len(station_ids), len(snapshot_store.FIELDS)), dtype=snapshot_store.VALUES_DTYPE)
+    for field in PLANE_FIELDS:
+        deltas = payload[offset:offset + num_values].reshape(len(station_ids), num_snapshots).T
+        offset += num_values
+        plane = np.cumsum(deltas, axis=0, dtype=np.uint8)
+        if field == snapshot_store.POINTS:
+            column = plane.view(np.int8).astype(snapshot_store.VALUES_DTYPE)
+            column[column == SIGNED_MISSING] = snapshot_store.MISSING
+        else:
+            column = plane.astype(snapshot_store.VALUES_DTYPE)
+            column[column == UNSIGNED_MISSING] = snapshot_store.MISSING
+        values[:, :, field] = column
+    # a station is absent from a snapshot when it has no bikes value
+    active = active.astype(snapshot_store.VALUES_DTYPE)
+    active[values[:, :, snapshot_store.BIKES] == snapshot_store.MISSING] = snapshot_store.MISSING
+    values[:, :, snapshot_store.IS_ACTIVE] = active
+    return timestamps, station_ids, values
+
+
+def block_path(archive_dir, day_number):
+    return f"{archive_dir}/{day_number}.bin"
+
+
+def write_archive(store, archive_dir=ARCHIVE_DIR, compression="zlib"):
+    """
+    Writes the snapshot store as a compact archive, with one block per local day (only the stations present on
+    that day are included in its block).
+
+    :return: the total size of the blocks in bytes
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    days, _, _ = time_buckets.local_time_fields(store.timestamps)
+    day_numbers, day_starts = np.unique(days, return_index=True)
+    day_ends = np.append(day_starts[1:], len(store))
+    total_bytes = 0
+    for day_number, start, end in zip(day_numbers.tolist(), day_starts.tolist(), day_ends.tolist()):
+        values = np.asarray(store.values[start:end])
+        columns = np.flatnonzero((values[:, :, snapshot_store.BIKES] != snapshot_store.MISSING).any(axis=0))
+        data = encode_block(store.timestamps[start:end], [store.station_ids[column] for column in columns],
+                            values[:, columns], compression)
+        path = block_path(archive_dir, day_number)
+        with open(f"{path}.tmp", "wb") as file_stream:
+            file_stream.write(data)
+        os.replace(f"{path}.tmp", path)
+        total_bytes += len(data)
+    return total_bytes
+
+
+def read_archive(archive_dir=ARCHIVE_DIR):
+    """Decodes a whole compact archive into an (in-memory) SnapshotStore."""
+    day_numbers = sorted(int(filename[:-len(".bin")]) for filename in os.listdir(archive_dir)
+                         if filename.endswith(".bin"))
+    blocks = []
+    station_index = {}
+    for day_number in day_numbers:
+        with open(block_path(archive_dir, day_number), "rb") as file_stream:
+            timestamps, station_ids, values = decode_block(file_stream.read())
+        for station_id in station_ids:
+            if station_id not in station_index:
+                station_index[station_id] = len(station_index)
+        blocks.append((timestamps, station_ids, values))
+
+    num_snapshots = sum(len(timestamps) for timestamps, _, _ in blocks)
+    all_values = np.full((num_snapshots, len(station_index), len(snapshot_store.FIELDS)), snapshot_store.MISSING,
+                         dtype=snapshot_store.VALUES_DTYPE)
+    row = 0
+    for timestamps, station_ids, values in blocks:
+        columns = [station_index[station_id] for station_id in station_ids]
+        all_values[row:row + len(timestamps), columns] = values
+        row += len(timestamps)
+    all_timestamps = (np.concatenate([timestamps for timestamps, _, _ in blocks]) if blocks
+                      else np.empty(0, dtype=snapshot_store.TIMESTAMPS_DTYPE))
+    return snapshot_store.SnapshotStore(all_timestamps, list(station_index), all_values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"write the snapshot store as a compact archive in {ARCHIVE_DIR}/")
+    parser.add_argument("-c", "--compression", choices=COMPRESSIONS, default="zlib",
+                        help="compression of each day's block (default: zlib; zstd needs the zstandard package)")
+    args = parser.parse_args()
+
+    store = snapshot_store.load_store()
+    total_bytes = write_archive(store, compression=args.compression)
+    store_bytes = store.values.nbytes + store.timestamps.nbytes
+    print(f"Wrote {len(store)} snapshots to {ARCHIVE_DIR}/: {total_bytes / 2 ** 20:.1f} MiB "
+          f"({store_bytes / max(total_bytes, 1):.0f}x smaller than the snapshot store)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+# The snapshot store keeps every processed snapshot in one dense
+# (snapshot x station x field) array, so that readers can memory-map it with a
+# single open instead of parsing one JSON file per snapshot.
+#
+# data/snapshot_store/
+#     meta.json        - format version, field names, station ID index and snapshot count
+#     timestamps.bin   - int64 timestamp index (sorted ascending), one entry per snapshot
+#     values.bin       - int16 values, shape (num_snapshots, num_stations, num_fields)
+
+STORE_DIR = "data/snapshot_store"
+STORE_VERSION = 1
+
+FIELDS = ["is_active", "bikes", "docks", "capacity", "points"]
+IS_ACTIVE, BIKES, DOCKS, CAPACITY, POINTS = range(len(FIELDS))
+
+TIMESTAMPS_DTYPE = np.int64
+VALUES_DTYPE = np.int16
+# marks a station that is absent from a snapshot, or a field (e.g. points) that it didn't report
+MISSING = np.iinfo(VALUES_DTYPE).min
+
+
+class StoreNotFoundError(FileNotFoundError):
+    """Raised when there is no snapshot store to open (e.g. before process_data.py has been run)."""
+
+
+class SnapshotStore:
+    def __init__(self, timestamps, station_ids, values):
+        """
+        :param timestamps: array of the snapshot timestamps (sorted ascending)
+        :param station_ids: list of station IDs, in column order
+        :param values: array (usually memory-mapped) of shape (len(timestamps), len(station_ids), len(FIELDS))
+        """
+        self.timestamps = timestamps
+        self.station_ids = station_ids
+        self.values = values
+        self.station_index = {station_id: i for i, station_id in enumerate(station_ids)}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def station_values(self, station_id):
+        """Returns a (snapshot x field) array of all the values for one station."""
+        return np.asarray(self.values[:, self.station_index[station_id], :])
+
+    def row_range(self, start=None, end=None):
+        """
+        Binary searches the timestamp index for the rows of the snapshots taken in [start, end).
+
+        :param start: Unix timestamp or datetime (None for the first snapshot)
+        :param end: Unix timestamp or datetime (None for after the last snapshot)
+        :return: the first row and the row after the last one
+        """
+        first_row = 0 if start is None else int(np.searchsorted(self.timestamps, _to_timestamp(start), "left"))
+        last_row = len(self) if end is None else int(np.searchsorted(self.timestamps, _to_timestamp(end), "left"))
+        return first_row, max(first_row, last_row)
+
+
+def _to_timestamp(time):
+    return time.timestamp() if isinstance(time, datetime) else time
+
+
+def snapshot_row(processed, station_index):
+    """
+    Converts one processed snapshot (station ID -> [is_active, bikes, docks, capacity(, points)])
+    into a (station x field) row of the store, using station_index to find each station's column.
+    """
+    row = np.full((len(station_index), len(FIELDS)), MISSING, dtype=VALUES_DTYPE)
+    for station_id, entry in processed.items():
+        row[station_index[station_id], :len(entry)] = entry
+    return row
+
+
+def records_to_arrays(records):
+    """
+    :param records: an iterable of (timestamp, processed snapshot) pairs, in any order
+    :return: the timestamps, station IDs and values arrays for the store
+    """
+    records = sorted(records, key=lambda record: record[0])
+    station_index = {}
+    for _, processed in records:
+        for station_id in processed:
+            if station_id not in station_index:
+                station_index[station_id] = len(station_index)
+    timestamps = np.array([timestamp for timestamp, _ in records], dtype=TIMESTAMPS_DTYPE)
+    values = np.empty((len(records), len(station_index), len(FIELDS)), dtype=VALUES_DTYPE)
+    for i, (_, processed) in enumerate(records):
+        values[i] = snapshot_row(processed, station_index)
+    return timestamps, list(station_index), values
+
+
+def _write_meta(store_dir, station_ids, num_snapshots):
+    meta = {
+        "version": STORE_VERSION,
+        "fields": FIELDS,
+        "dtype": np.dtype(VALUES_DTYPE).name,
+        "station_ids": station_ids,
+        "num_snapshots": num_snapshots
+    }
+    with open(f"{store_dir}/meta.json.tmp", "w") as file_stream:
+        json.dump(meta, file_stream)
+    os.replace(f"{store_dir}/meta.json.tmp", f"{store_dir}/meta.json")
+
+
+def _read_meta(store_dir):
+    try:
+        with open(f"{store_dir}/meta.json") as file_stream:
+            meta = json.load(file_stream)
+    except FileNotFoundError:
+        raise StoreNotFoundError(f"no snapshot store found in {store_dir}/ (run process_data.py or snapshot_store.py)")
+    if meta["version"] != STORE_VERSION or meta["fields"] != FIELDS:
+        raise Exception(f"unsupported snapshot store format in {store_dir}/")
+    return meta
+
+
+def write_store(timestamps, station_ids, values, store_dir=STORE_DIR):
+    os.makedirs(store_dir, exist_ok=True)
+    # write everything to temporary files first so that readers never see a half-written store
+    np.asarray(timestamps, dtype=TIMESTAMPS_DTYPE).tofile(f"{store_dir}/timestamps.bin.tmp")
+    np.ascontiguousarray(values, dtype=VALUES_DTYPE).tofile(f"{store_dir}/values.bin.tmp")
+    for filename in ["timestamps.bin", "values.bin"]:
+        os.replace(f"{store_dir}/{filename}.tmp", f"{store_dir}/{filename}")
+    _write_meta(store_dir, station_ids, len(timestamps))
+
+
+def _widen_store(store_dir, num_snapshots, old_num_stations, new_num_stations, chunk_size=4096):
+    """Rewrites values.bin with MISSING columns added for new stations, a chunk of snapshots at a time."""
+    old_values = np.memmap(f"{store_dir}/values.bin", dtype=VALUES_DTYPE, mode="r",
+                           shape=(num_snapshots, old_num_stations, len(FIELDS)))
+    with open(f"{store_dir}/values.bin.tmp", "wb") as file_stream:
+        for start in range(0, num_snapshots, chunk_size):
+            chunk = old_values[start:start + chunk_size]
+            widened = np.full((len(chunk), new_num_stations, len(FIELDS)), MISSING, dtype=VALUES_DTYPE)
+            widened[:, :old_num_stations, :] = chunk
+            file_stream.write(widened.tobytes())
+    del old_values
+    os.replace(f"{store_dir}/values.bin.tmp", f"{store_dir}/values.bin")
+
+
+def append_to_store(records, store_dir=STORE_DIR):
+    """
+    Appends snapshots to an existing store without rewriting it (unless new stations need to be added as columns).
+    The snapshot count in meta.json is only updated once the data is written, so readers never see partial rows.
+
+    :param records: an iterable of (timestamp, processed snapshot) pairs; any that are not newer than the last
+                    stored snapshot were already appended (e.g. by an interrupted run) and are skipped
+    """
+    meta = _read_meta(store_dir)
+    num_snapshots = meta["num_snapshots"]
+    station_ids = meta["station_ids"]
+    records = sorted(records, key=lambda record: record[0])
+    if num_snapshots > 0:
+        last_timestamp = np.fromfile(f"{store_dir}/timestamps.bin", dtype=TIMESTAMPS_DTYPE, count=1,
+                                     offset=(num_snapshots - 1) * np.dtype(TIMESTAMPS_DTYPE).itemsize)[0]
+        records = [record for record in records if record[0] > last_timestamp]
+    if not records:
+        return
+
+    station_index = {station_id: i for i, station_id in enumerate(station_ids)}
+    old_num_stations = len(station_ids)
+    for _, processed in records:
+        for station_id in processed:
+            if station_id not in station_index:
+                station_index[station_id] = len(station_index)
+    station_ids = list(station_index)
+    if len(station_ids) != old_num_stations and num_snapshots > 0:
+        _widen_store(store_dir, num_snapshots, old_num_stations, len(station_ids))
+        _write_meta(store_dir, station_ids, num_snapshots)
+
+    # drop anything left over from an interrupted append before adding the new rows
+    row_size = len(station_ids) * len(FIELDS) * np.dtype(VALUES_DTYPE).itemsize
+    with open(f"{store_dir}/values.bin", "r+b") as file_stream:
+        file_stream.truncate(num_snapshots * row_size)
+        file_stream.seek(0, os.SEEK_END)
+        for _, processed in records:
+            file_stream.write(snapshot_row(processed, station_index).tobytes())
+    with open(f"{store_dir}/timestamps.bin", "r+b") as file_stream:
+        file_stream.truncate(num_snapshots * np.dtype(TIMESTAMPS_DTYPE).itemsize)
+        file_stream.seek(0, os.SEEK_END)
+        file_stream.write(np.array([timestamp for timestamp, _ in records], dtype=TIMESTAMPS_DTYPE).tobytes())
+    _write_meta(store_dir, station_ids, num_snapshots + len(records))
+
+
+def load_store(store_dir=STORE_DIR):
+    """Opens the snapshot store, memory-mapping the values array (nothing else is read until it's used)."""
+    meta = _read_meta(store_dir)
+    num_snapshots = meta["num_snapshots"]
+    station_ids = meta["station_ids"]
+    shape = (num_snapshots, len(station_ids), len(FIELDS))
+    timestamps = np.fromfile(f"{store_dir}/timestamps.bin", dtype=TIMESTAMPS_DTYPE, count=num_snapshots)
+    if num_snapshots == 0:
+        values = np.empty(shape, dtype=VALUES_DTYPE)
+    else:
+        values = np.memmap(f"{store_dir}/values.bin", dtype=VALUES_DTYPE, mode="r", shape=shape)
+    return SnapshotStore(timestamps, station_ids, values)
+
+
+def load_snapshots(stations=None, start=None, end=None, fields=None, store=None):
+    """
+    Reads a window of the snapshot store: only the rows of the snapshots taken in [start, end) (found by binary
+    search), and only the requested stations and fields, so the cost is proportional to the size of the window.
+
+    :param stations: list of the station IDs to read (None for all of them); stations that aren't in the store
+                     are all NaN
+    :param start: Unix timestamp or datetime of the start of the window (None for the first snapshot)
+    :param end: Unix timestamp or datetime of the end of the window, exclusive (None for after the last snapshot)
+    :param fields: list of the field numbers to read (e.g. [BIKES, POINTS]), or None for all of them
+    :param store: the snapshot store to read (opened if not given)
+    :return: the array of the timestamps of the snapshots in the window, and a (snapshot x station x field)
+             float array of their values, with NaN where a station is absent or didn't report a field
+    """
+    if store is None:
+        store = load_store()
+    station_ids = store.station_ids if stations is None else stations
+    fields = list(range(len(FIELDS))) if fields is None else list(fields)
+    first_row, last_row = store.row_range(start, end)
+
+    columns = [store.station_index.get(station_id, -1) for station_id in station_ids]
+    present_columns = [i for i, column in enumerate(columns) if column != -1]
+    window = store.values[first_row:last_row]
+    # read the window with the bikes field, which tells whether a station is present
+    read_fields = sorted(set(fields) | {BIKES})
+    raw_values = np.asarray(window[:, [columns[i] for i in present_columns]][:, :, read_fields])
+    present = raw_values[:, :, read_fields.index(BIKES)] != MISSING
+
+    values = np.full((last_row - first_row, len(station_ids), len(fields)), np.nan)
+    for i, field in enumerate(fields):
+        column = raw_values[:, :, read_fields.index(field)].astype(np.float64)
+        column[(column == MISSING) | ~present] = np.nan
+        values[:, present_columns, i] = column
+    return np.asarray(store.timestamps[first_row:last_row]), values
+
+
+def main():
+    # imported here since these modules themselves depend on this one
+    import online_statistics
+    import snapshot_codec
+    import time_buckets
+
+    parser = argparse.ArgumentParser(description=f"rebuild the snapshot store in {STORE_DIR}/")
+    parser.add_argument("--from-archive", nargs="?", const=snapshot_codec.ARCHIVE_DIR, metavar="ARCHIVE_DIR",
+                        help="rebuild it from the compact archive written by snapshot_codec.py (default: "
+                             f"{snapshot_codec.ARCHIVE_DIR}) instead of from data/processed_output/")
+    args = parser.parse_args()
+
+    if args.from_archive is not None:
+        archive = snapshot_codec.read_archive(args.from_archive)
+        timestamps, station_ids, values = archive.timestamps, archive.station_ids, archive.values
+    else:
+        # rebuild the store from the per-snapshot JSON files in data/processed_output/
+        # (for archives whose raw_output/ files are no longer available)
+        filenames = os.listdir("data/processed_output/")
+        if not filenames:
+            raise Exception("no files found in data/processed_output/")
+
+        records = []
+        for filename in filenames:
+            with open(f"data/processed_output/{filename}") as file_stream:
+                records.append((int(filename.split(".")[0]), json.load(file_stream)))
+        timestamps, station_ids, values = records_to_arrays(records)
+    if len(timestamps) == 0:
+        raise Exception("no snapshots found to rebuild the snapshot store from")
+    write_store(timestamps, station_ids, values)
+    store = load_store()
+    for bucket_seconds in time_buckets.INDEXED_BUCKET_SECONDS:
+        index = time_buckets.update_bucket_index(store, bucket_seconds)
+        if bucket_seconds == time_buckets.SECONDS_PER_HOUR:
+            online_statistics.update_saved_streams(store, index)
+    print(f"Wrote {len(timestamps)} snapshots of {len(station_ids)} stations to {STORE_DIR}/")
+
+
+if __name__ == "__main__":
+    main()
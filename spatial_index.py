@@ -0,0 +1,95 @@
+import hashlib
+import json
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.7613
+MILES_PER_DEGREE_LATITUDE = 2 * np.pi * EARTH_RADIUS_MILES / 360
+# the haversine (spherical earth) distance is always within about 0.5% of the geodesic (ellipsoidal earth) distance,
+# so the exact geodesic distance only needs to be calculated for pairs whose haversine distance is this close
+# to the radius
+HAVERSINE_TOLERANCE = 0.01
+
+
+def haversine_miles(latitudes1, longitudes1, latitudes2, longitudes2):
+    """Vectorized great-circle distance (in miles) between arrays of coordinates (in degrees)."""
+    latitudes1, longitudes1, latitudes2, longitudes2 = (np.radians(np.asarray(array, dtype=np.float64)) for array in
+                                                        [latitudes1, longitudes1, latitudes2, longitudes2])
+    a = (np.sin((latitudes2 - latitudes1) / 2) ** 2 +
+         np.cos(latitudes1) * np.cos(latitudes2) * np.sin((longitudes2 - longitudes1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def candidate_pairs(latitudes, longitudes, radius_miles):
+    """
+    Uses a grid hash (with cells at least radius_miles across) to find the pairs of points that could be within
+    radius_miles of each other: for each point, only the points in the same cell or the 8 surrounding cells.
+
+    :return: arrays i, j (with i < j) of the candidate pairs
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if len(latitudes) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    cell_latitude = radius_miles * (1 + HAVERSINE_TOLERANCE) / MILES_PER_DEGREE_LATITUDE
+    # degrees of longitude are shortest at the latitude furthest from the equator
+    cell_longitude = cell_latitude / max(np.cos(np.radians(np.abs(latitudes).max())), 1e-6)
+    rows = np.floor(latitudes / cell_latitude).astype(np.int64)
+    columns = np.floor(longitudes / cell_longitude).astype(np.int64)
+    rows -= rows.min() - 1
+    columns -= columns.min() - 1
+    num_columns = columns.max() + 2
+    cells = rows * num_columns + columns
+
+    order = np.argsort(cells, kind="stable")
+    sorted_cells = cells[order]
+    i_list = []
+    j_list = []
+    for row_offset in [-1, 0, 1]:
+        for column_offset in [-1, 0, 1]:
+            neighbor_cells = cells + row_offset * num_columns + column_offset
+            starts = np.searchsorted(sorted_cells, neighbor_cells, side="left")
+            ends = np.searchsorted(sorted_cells, neighbor_cells, side="right")
+            counts = ends - starts
+            # expand each point's range of neighbors into individual pairs
+            i = np.repeat(np.arange(len(cells)), counts)
+            offsets_in_range = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            positions = np.repeat(starts, counts) + offsets_in_range
+            j = order[positions]
+            keep = i < j
+            i_list.append(i[keep])
+            j_list.append(j[keep])
+    i = np.concatenate(i_list)
+    j = np.concatenate(j_list)
+    pair_order = np.lexsort((j, i))
+    return i[pair_order], j[pair_order]
+
+
+def nearby_pairs(latitudes, longitudes, radius_miles):
+    """
+    Finds all the pairs of points whose geodesic distance is less than radius_miles, in near-linear time.
+
+    :return: arrays i, j (with i < j, sorted by i and then j) of the nearby pairs
+    """
+    i, j = candidate_pairs(latitudes, longitudes, radius_miles)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    haversine_distances = haversine_miles(latitudes[i], longitudes[i], latitudes[j], longitudes[j])
+    is_nearby = haversine_distances < radius_miles * (1 - HAVERSINE_TOLERANCE)
+    undecided = np.flatnonzero((haversine_distances >= radius_miles * (1 - HAVERSINE_TOLERANCE)) &
+                               (haversine_distances < radius_miles * (1 + HAVERSINE_TOLERANCE)))
+    if len(undecided) > 0:
+        # (imported here, since it's slow to import and often not needed)
+        from geopy.distance import distance
+    for pair in undecided:
+        coords1 = (latitudes[i[pair]], longitudes[i[pair]])
+        coords2 = (latitudes[j[pair]], longitudes[j[pair]])
+        is_nearby[pair] = distance(coords1, coords2).miles < radius_miles
+    return i[is_nearby], j[is_nearby]
+
+
+def nearby_pairs_cache_key(station_ids, latitudes, longitudes, radius_miles):
+    """Hash of everything the nearby pairs depend on, so that a cached result is only used if none of it changed."""
+    contents = json.dumps([list(station_ids), [float(latitude) for latitude in latitudes],
+                           [float(longitude) for longitude in longitudes], radius_miles])
+    return hashlib.sha256(contents.encode()).hexdigest()
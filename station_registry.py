@@ -0,0 +1,135 @@
+import bisect
+import json
+import os
+
+import numpy as np
+
+# Name and coordinate histories of the stations, from data/overall_stations.json, where every station has
+# "name" and "coords" lists of [timestamp, value] changes (in timestamp order, as process_data.py appends them).
+# The changes of all the stations are kept in flat arrays sorted by (station, timestamp), so looking up what a
+# station (or every station) was called, or where it was, at some time is a binary search.
+
+OVERALL_STATIONS_PATH = "data/overall_stations.json"
+# times are combined with the station's row into one int64 sort key: (row << TIME_BITS) | timestamp
+TIME_BITS = 34
+
+
+class History:
+    def __init__(self, row_starts, times, values):
+        """
+        Changes of one field (e.g. the name) of every station.
+
+        :param row_starts: array of the first change of each station; the changes of the station in row r are
+                           row_starts[r]:row_starts[r + 1]
+        :param times: array of the timestamp of every change (ascending within each station)
+        :param values: list or array of the value set by every change
+        """
+        self.row_starts = row_starts
+        self.times = times
+        self.values = values
+        self.times_list = times.tolist()
+        self.keys = (np.repeat(np.arange(len(row_starts) - 1, dtype=np.int64), np.diff(row_starts)) << TIME_BITS |
+                     times)
+
+    def position(self, row, time=None):
+        """Position of the change in effect for the station at the time (None for its latest change), or -1."""
+        start, end = int(self.row_starts[row]), int(self.row_starts[row + 1])
+        if time is None:
+            return end - 1
+        position = bisect.bisect_right(self.times_list, time, start, end) - 1
+        return position if position >= start else -1
+
+    def positions(self, rows, time=None):
+        """
+        Vectorized position: array of the change in effect for each station (-1 if it wasn't added yet).
+
+        :param time: Unix timestamp, or array of one timestamp per station
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if time is None:
+            return self.row_starts[rows + 1] - 1
+        time = np.clip(np.asarray(time, dtype=np.int64), 0, (1 << TIME_BITS) - 1)
+        positions = np.searchsorted(self.keys, rows << TIME_BITS | time, side="right") - 1
+        return np.where(positions >= self.row_starts[rows], positions, -1)
+
+
+def _history(entries, field_name):
+    changes = [entry[field_name] for entry in entries]
+    row_starts = np.zeros(len(changes) + 1, dtype=np.int64)
+    row_starts[1:] = np.cumsum([len(station_changes) for station_changes in changes])
+    times = np.array([time for station_changes in changes for time, _ in station_changes], dtype=np.int64)
+    return row_starts, times, [value for station_changes in changes for _, value in station_changes]
+
+
+class StationRegistry:
+    def __init__(self, overall_stations):
+        """
+        :param overall_stations: the contents of overall_stations.json (station ID ->
+                                 {"name": [[timestamp, name], ...], "coords": [[timestamp, coords], ...], ...})
+        """
+        self.station_ids = list(overall_stations)
+        self.station_index = {station_id: i for i, station_id in enumerate(self.station_ids)}
+        entries = list(overall_stations.values())
+        row_starts, times, names = _history(entries, "name")
+        self.names = History(row_starts, times, names)
+        row_starts, times, coords = _history(entries, "coords")
+        self.coords = History(row_starts, times, np.array(coords, dtype=np.float64).reshape(-1, 2))
+        self.timestamps_added = np.array([entry["timestamp_added"] for entry in entries], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def __contains__(self, station_id):
+        return station_id in self.station_index
+
+    def name(self, station_id, time=None):
+        """
+        :param time: Unix timestamp (None for the latest name)
+        :return: the name of the station at the time, or None if it wasn't added yet
+        """
+        position = self.names.position(self.station_index[station_id], time)
+        return self.names.values[position] if position >= 0 else None
+
+    def location(self, station_id, time=None):
+        """
+        :return: the (latitude, longitude) of the station at the time (None for the latest), or None if it wasn't
+                 added yet
+        """
+        position = self.coords.position(self.station_index[station_id], time)
+        return tuple(self.coords.values[position].tolist()) if position >= 0 else None
+
+    def names_as_of(self, station_ids, time=None):
+        """:return: dict of the name of each station at the time (None for the stations that weren't added yet)"""
+        positions = self.names.positions([self.station_index[station_id] for station_id in station_ids], time)
+        return {station_id: self.names.values[position] if position >= 0 else None
+                for station_id, position in zip(station_ids, positions.tolist())}
+
+    def coords_as_of(self, time=None, station_ids=None):
+        """
+        Where the stations were at the time.
+
+        :param time: Unix timestamp, or array of one timestamp per station (None for the latest coordinates)
+        :param station_ids: the stations to look up (all of them by default)
+        :return: arrays of the latitudes and longitudes of the stations, with NaN for the stations that weren't added
+                 yet
+        """
+        rows = (np.arange(len(self)) if station_ids is None
+                else np.array([self.station_index[station_id] for station_id in station_ids], dtype=np.int64))
+        positions = self.coords.positions(rows, time)
+        coords = np.where((positions >= 0)[:, np.newaxis], self.coords.values[np.maximum(positions, 0)], np.nan)
+        return coords[:, 0], coords[:, 1]
+
+
+# path -> (modification time, registry) of the registries loaded by this process
+_loaded = {}
+
+
+def load_registry(path=OVERALL_STATIONS_PATH):
+    """Loads the registry, reusing the one already loaded by this process if the file hasn't changed since."""
+    modification_time = os.stat(path).st_mtime_ns
+    if path in _loaded and _loaded[path][0] == modification_time:
+        return _loaded[path][1]
+    with open(path) as file_stream:
+        registry = StationRegistry(json.load(file_stream))
+    _loaded[path] = (modification_time, registry)
+    return registry
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import aggregate_cache
+import lucrative_pairs
+import online_statistics
+import profiling
+import spatial_index
+import station_registry
+import time_buckets
+
+# The aggregates behind the station trends map (hourly statistics, nearby station pairs and lucrative lines),
+# without any plotting, so that scripts that only need the numbers (query.py, route_planner.py, live_feed.py)
+# don't pay for importing matplotlib. Every function takes the type of data ("points" or "bikes") explicitly.
+
+DATA_TYPES = ["points", "bikes"]
+RADIUS_MILES = 0.5
+MIN_DIFF_HOUR_BIKES_DELTA = 2.5
+MIN_DIFF_HOUR_POINTS = 1
+MIN_DIFFS = {"points": MIN_DIFF_HOUR_POINTS, "bikes": MIN_DIFF_HOUR_BIKES_DELTA}
+
+NEARBY_PAIRS_CACHE_PATH = "data/nearby_station_pairs.json"
+# aggregates of every scenario, written by precompute.py (see load_precomputed)
+PRECOMPUTED_PATH = "data/precomputed.npz"
+# change this whenever the layout of the precomputed artifact changes
+PRECOMPUTED_VERSION = 1
+
+
+def check_data_type(data_type):
+    if data_type not in DATA_TYPES:
+        raise ValueError(f"data_type must be one of {', '.join(DATA_TYPES)}, not {data_type}")
+
+
+def calculate_nearby_stations(station_ids_list, latitudes_list, longitudes_list, radius_miles=RADIUS_MILES):
+    """
+    Returns a list (where each element corresponds to a station) of lists of stations with a
+    strictly higher ID number that are within radius_miles of the station.
+    """
+    nearby_stations = [[] for _ in station_ids_list]
+    with profiling.stage("nearby pairs"):
+        for i, j in zip(*spatial_index.nearby_pairs(latitudes_list, longitudes_list, radius_miles)):
+            nearby_stations[i].append(int(j))
+    return nearby_stations
+
+
+def load_nearby_stations(station_ids_list, latitudes_list, longitudes_list, use_cache=True,
+                         cache_path=NEARBY_PAIRS_CACHE_PATH):
+    """
+    Same as calculate_nearby_stations, but uses the result cached in cache_path if the stations,
+    their coordinates and RADIUS_MILES haven't changed since it was saved.
+    """
+    if not use_cache:
+        return calculate_nearby_stations(station_ids_list, latitudes_list, longitudes_list)
+    key = spatial_index.nearby_pairs_cache_key(station_ids_list, latitudes_list, longitudes_list, RADIUS_MILES)
+    try:
+        with open(cache_path) as file_stream:
+            cached = json.load(file_stream)
+        if isinstance(cached, dict) and cached["key"] == key:
+            return cached["nearby_stations"]
+    except FileNotFoundError:
+        pass
+    nearby_stations = calculate_nearby_stations(station_ids_list, latitudes_list, longitudes_list)
+    with open(cache_path, "w") as file_stream:
+        json.dump({"key": key, "radius_miles": RADIUS_MILES, "station_ids": station_ids_list,
+                   "nearby_stations": nearby_stations}, file_stream)
+    return nearby_stations
+
+
+def station_coords_lists(station_ids_list, time=None):
+    """
+    :param time: Unix timestamp to place the stations where they were at (None for their latest coordinates);
+                 stations added after it are placed where they were first seen
+    :return: lists of the latitudes and longitudes of the stations
+    """
+    registry = station_registry.load_registry()
+    if time is not None:
+        time = np.maximum(time, registry.timestamps_added[[registry.station_index[station_id]
+                                                           for station_id in station_ids_list]])
+    latitudes, longitudes = registry.coords_as_of(time, station_ids_list)
+    return latitudes.tolist(), longitudes.tolist()
+
+
+# path -> (modification time, aggregates) of the precomputed artifacts loaded by this process
+_precomputed = {}
+
+
+def load_precomputed(path=PRECOMPUTED_PATH):
+    """
+    Loads the aggregates written by precompute.py, reusing the ones already loaded by this process if the file hasn't
+    changed since. They are looked up by the same keys as in the aggregate cache, so ones computed from an older
+    version of the snapshot store are never used.
+
+    :return: dict of aggregate cache key -> dict of arrays (empty if there is no artifact, or it has another version)
+    """
+    try:
+        modification_time = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if path in _precomputed and _precomputed[path][0] == modification_time:
+        return _precomputed[path][1]
+    aggregates = {}
+    with np.load(path) as saved:
+        if int(saved["version"]) == PRECOMPUTED_VERSION:
+            for name in saved["scenarios"].tolist():
+                aggregates[str(saved[f"{name}.statistics_key"])] = {
+                    field: saved[f"{name}.{field}"] for field in ["station_ids", "averages", "stdevs", "counts"]}
+                aggregates[str(saved[f"{name}.lines_key"])] = {
+                    field: saved[f"{name}.{field}"] for field in ["segments", "hour_ends"]}
+    _precomputed[path] = (modification_time, aggregates)
+    return aggregates
+
+
+def hourly_statistics_key(store, data_type, is_weekend, policy="first", index=None):
+    """
+    The statistics are keyed by the snapshots they are calculated from (and the stations), so adding snapshots only
+    invalidates the statistics of the weekday class they were taken in (e.g. not the weekend ones, for a weekday).
+
+    :param index: the store's hour index (default: loaded with time_buckets.load_bucket_index)
+    """
+    use_points = data_type == "points"
+    if index is None:
+        index = time_buckets.load_bucket_index(store, time_buckets.SECONDS_PER_HOUR)
+    rows = online_statistics.sample_rows(index, is_weekend, not use_points, policy)
+    return aggregate_cache.cache_key("hourly_statistics", rows=aggregate_cache.rows_fingerprint(store, rows),
+                                     use_points=use_points, rate_of_change=not use_points,
+                                     is_weekend=is_weekend, policy=policy)
+
+
+def statistics_arrays(stream, is_weekend):
+    """
+    :param stream: online_statistics.HourlyStatisticsStream covering the whole snapshot store
+    :return: the arrays returned by hourly_statistics (as a dict), for all the stations in the store (so that they
+             only depend on the samples of the weekday class)
+    """
+    averages, stdevs, counts = stream.statistics(is_weekend)
+    # sorted by ID
+    station_order = sorted((station_id, i) for i, station_id in enumerate(stream.station_ids))
+    columns = [i for _, i in station_order]
+    return {"station_ids": np.array([station_id for station_id, _ in station_order]),
+            "averages": averages[:, columns], "stdevs": stdevs[:, columns], "counts": counts[:, columns]}
+
+
+def hourly_statistics(store, data_type, is_weekend, policy="first", use_cache=True):
+    """
+    Returns the IDs of the stations, and (hour x station) arrays of the averages, standard deviations and sample
+    counts, from the precomputed artifact or the aggregate cache if they were already computed for the current
+    contents of the snapshot store. The statistics come from the streaming accumulators saved at ingest time (or
+    built a chunk of hours at a time), and are NaN for the hours in which a station has too few samples.
+
+    :param data_type: "points" (the average points) or "bikes" (the average change in bikes to the next hour)
+    """
+    check_data_type(data_type)
+    if len(store) == 0:
+        raise Exception("no snapshots found in the snapshot store")
+
+    index = time_buckets.load_bucket_index(store, time_buckets.SECONDS_PER_HOUR)
+
+    def compute():
+        with profiling.stage("hourly statistics (not cached)"):
+            stream = online_statistics.load_stream(store, index, data_type, policy)
+            return statistics_arrays(stream, is_weekend)
+
+    key = hourly_statistics_key(store, data_type, is_weekend, policy, index)
+    arrays = load_precomputed().get(key) if use_cache else None
+    if arrays is None:
+        arrays = aggregate_cache.cached(key, compute) if use_cache else compute()
+    return arrays["station_ids"].tolist(), arrays["averages"], arrays["stdevs"], arrays["counts"]
+
+
+def calculate_lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages_list, min_diff,
+                                      use_cache=True):
+    """
+    :return: for every hour, a (pair x 2 x 2) array of the line segments between the nearby stations whose
+             averages differ by more than min_diff (which can be passed to LineCollection)
+    """
+    nearby_stations = load_nearby_stations(station_ids_list, latitudes_list, longitudes_list, use_cache)
+    nearby_i, nearby_j = lucrative_pairs.nearby_pair_arrays(nearby_stations)
+    is_lucrative = lucrative_pairs.lucrative_pair_mask(averages_list, nearby_i, nearby_j, min_diff)
+    segments = lucrative_pairs.pair_segments(latitudes_list, longitudes_list, nearby_i, nearby_j)
+    return [segments[is_lucrative[hour]] for hour in range(24)]
+
+
+def lucrative_station_pairs_key(station_ids_list, latitudes_list, longitudes_list, averages, min_diff):
+    return aggregate_cache.cache_key(
+        "lucrative_station_pairs",
+        nearby=spatial_index.nearby_pairs_cache_key(station_ids_list, latitudes_list, longitudes_list, RADIUS_MILES),
+        averages=hashlib.sha256(np.ascontiguousarray(averages, dtype=np.float64).tobytes()).hexdigest(),
+        min_diff=min_diff)
+
+
+def lucrative_lines_arrays(lines):
+    """:return: the lines of every hour (from calculate_lucrative_station_pairs) as arrays that can be saved"""
+    return {"segments": np.concatenate(lines).reshape(-1, 2, 2),
+            "hour_ends": np.cumsum([len(hourly_lines) for hourly_lines in lines])}
+
+
+def lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages, data_type, use_cache=True):
+    """
+    Same as calculate_lucrative_station_pairs (with the data type's minimum difference), but from the precomputed
+    artifact or the aggregate cache (unless use_cache is False, in which case the cached nearby pairs aren't used
+    either).
+    """
+    check_data_type(data_type)
+    min_diff = MIN_DIFFS[data_type]
+    if not use_cache:
+        return calculate_lucrative_station_pairs(station_ids_list, latitudes_list, longitudes_list, averages,
+                                                 min_diff, use_cache)
+
+    def compute():
+        return lucrative_lines_arrays(calculate_lucrative_station_pairs(station_ids_list, latitudes_list,
+                                                                        longitudes_list, averages, min_diff))
+
+    key = lucrative_station_pairs_key(station_ids_list, latitudes_list, longitudes_list, averages, min_diff)
+    arrays = load_precomputed().get(key)
+    if arrays is None:
+        arrays = aggregate_cache.cached(key, compute)
+    return np.split(arrays["segments"], arrays["hour_ends"][:-1])
+
@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import aggregate_cache
+
+
+class Tester(unittest.TestCase):
+
+    def test_cached(self):
+        calls = []
+
+        def compute():
+            calls.append(None)
+            return {"values": np.arange(4)}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            key = aggregate_cache.cache_key("test", first_timestamp=10, weekend=False)
+            self.assertEqual(aggregate_cache.cached(key, compute, cache_dir)["values"].tolist(), [0, 1, 2, 3])
+            self.assertEqual(aggregate_cache.cached(key, compute, cache_dir)["values"].tolist(), [0, 1, 2, 3])
+            self.assertEqual(len(calls), 1)
+            self.assertNotEqual(key, aggregate_cache.cache_key("test", first_timestamp=10, weekend=True))
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for i, key in enumerate(["a", "b", "c"]):
+                aggregate_cache.save(key, {"values": np.zeros(1000)}, cache_dir)
+                os.utime(f"{cache_dir}/{key}.npz", (i, i))
+            aggregate_cache.load("a", cache_dir)
+            size = os.stat(f"{cache_dir}/a.npz").st_size
+            aggregate_cache.evict(cache_dir, max_bytes=2 * size)
+            self.assertEqual(sorted(os.listdir(cache_dir)), ["a.npz", "c.npz"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from benchmark import synthetic_feed, compare_results
+from process_data import parse_snapshot
+
+
+class Tester(unittest.TestCase):
+
+    def test_synthetic_feed(self):
+        snapshots = synthetic_feed(5, 1)
+        self.assertEqual(len(snapshots), 288)
+        self.assertEqual(snapshots[1][0] - snapshots[0][0], 300)
+        processed, station_details = parse_snapshot(*snapshots[0])
+        self.assertEqual(list(processed), ["1", "2", "3", "4", "5"])
+        is_active, bikes, docks, capacity, points = processed["1"]
+        self.assertEqual(bikes + docks, capacity)
+        self.assertTrue(-3 <= points <= 3)
+
+    def test_compare_results(self):
+        baseline = {"a": {"median": 1.0}, "b": {"median": 2.0}}
+        results = {"a": {"median": 1.1}, "b": {"median": 3.0}, "c": {"median": 1.0}}
+        self.assertEqual([(stage, is_regression) for stage, *_, is_regression
+                          in compare_results(results, baseline, tolerance=0.2)],
+                         [("a", False), ("b", True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
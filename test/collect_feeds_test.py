@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from collect_feeds import Feed, collect_once, next_tick
+
+
+class MockFeedHandler(BaseHTTPRequestHandler):
+    # keep connections open between requests, like a real feed server
+    protocol_version = "HTTP/1.1"
+    # (status, body) of the responses to send, in order
+    responses = []
+    client_ports = set()
+
+    def do_GET(self):
+        MockFeedHandler.client_ports.add(self.client_address[1])
+        status, body = MockFeedHandler.responses.pop(0)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockFeedHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/station_status.json"
+        MockFeedHandler.client_ports = set()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_next_tick(self):
+        self.assertEqual(next_tick(1603826178, 300), 1603826400)
+        self.assertEqual(next_tick(1603826400, 300), 1603826700)
+
+    def test_collect_once(self):
+        snapshot = json.dumps({"features": []}).encode()
+        # an error, an empty response and a message are retried, and only the good snapshot is written
+        MockFeedHandler.responses = [(500, b"error"), (200, b""), (200, b'{"message": "down for maintenance"}'),
+                                     (200, snapshot)]
+        with tempfile.TemporaryDirectory() as output_dir:
+            feed = Feed("test", self.url, output_dir)
+            path = asyncio.run(collect_once(feed, 1603826400, asyncio.Semaphore(1), retries=3, backoff=0))
+            feed.close()
+            self.assertEqual(os.listdir(output_dir), ["1603826400.json"])
+            with open(path, "rb") as file_stream:
+                self.assertEqual(file_stream.read(), snapshot)
+        # the connection was reused for every attempt
+        self.assertEqual(len(MockFeedHandler.client_ports), 1)
+
+    def test_collect_once_gives_up(self):
+        MockFeedHandler.responses = [(200, b"")] * 2
+        with tempfile.TemporaryDirectory() as output_dir:
+            feed = Feed("test", self.url, output_dir)
+            self.assertIsNone(asyncio.run(collect_once(feed, 1603826400, asyncio.Semaphore(1), retries=1, backoff=0)))
+            feed.close()
+            self.assertEqual(os.listdir(output_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+import forecast
+import snapshot_store
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        # two weeks of 5-minute snapshots of two stations whose bikes follow the hour of the day
+        self.timestamps = 1604275200 + 300 * np.arange(14 * 288)
+        hours = (forecast.profile_groups(self.timestamps) % forecast.SLOTS_PER_DAY) // 4
+        self.values = np.full((len(self.timestamps), 2, len(snapshot_store.FIELDS)), snapshot_store.MISSING,
+                              dtype=snapshot_store.VALUES_DTYPE)
+        self.values[:, :, snapshot_store.IS_ACTIVE] = 1
+        self.values[:, :, snapshot_store.CAPACITY] = 30
+        self.values[:, 0, snapshot_store.BIKES] = hours
+        self.values[:, 1, snapshot_store.BIKES] = 23 - hours
+        self.values[:, :, snapshot_store.DOCKS] = 30 - self.values[:, :, snapshot_store.BIKES]
+        # the second station doesn't report points
+        self.values[:, 0, snapshot_store.POINTS] = 1
+
+    def test_matching_rows(self):
+        # the closest snapshot, if it's within 150 seconds
+        self.assertEqual(forecast.matching_rows(np.array([0, 300, 610]), np.array([-200, 100, 400, 500, 900])).tolist(),
+                         [-1, 0, 1, 2, -1])
+
+    def test_predict(self):
+        forecaster = forecast.fit(self.timestamps, self.values, ["a", "b"], [15, 60])
+        row = len(self.timestamps) - 100
+        timestamp, predictions = forecaster.predict_from_store(
+            snapshot_store.SnapshotStore(self.timestamps, ["a", "b"], self.values), row)
+        self.assertEqual(predictions.shape, (2, 2, 3))
+        for j, horizon_row in enumerate([row + 3, row + 12]):
+            expected = forecast.forecast_values(self.values[horizon_row][np.newaxis], snapshot_store.BIKES)[0]
+            np.testing.assert_allclose(predictions[j, :, 0], expected, atol=1e-6)
+            np.testing.assert_allclose(predictions[j, :, 1], 30 - expected, atol=1e-6)
+        np.testing.assert_allclose(predictions[:, :, 2], [[1, 0], [1, 0]], atol=1e-6)
+
+        # absent stations aren't forecast
+        current = self.values[row].copy()
+        current[1] = snapshot_store.MISSING
+        self.assertTrue(np.isnan(forecaster.predict(timestamp, current)[:, 1]).all())
+
+    def test_training_rows(self):
+        store = snapshot_store.SnapshotStore(self.timestamps, ["a", "b"], self.values)
+        first_row, last_row = forecast.training_rows(store)
+        # up to the start of the last (UTC) day
+        self.assertEqual((first_row, last_row), (0, 13 * 288))
+        # the window is the same before the last snapshot was added (new snapshots only change it once a day)
+        earlier_store = snapshot_store.SnapshotStore(self.timestamps[:-1], ["a", "b"], self.values[:-1])
+        self.assertEqual(forecast.training_rows(earlier_store), (first_row, last_row))
+        self.assertEqual(forecast.training_rows(store, refit=True), (0, len(self.timestamps)))
+        # at most TRAINING_DAYS of snapshots
+        long_timestamps = 1604275200 + 300 * np.arange(40 * 288)
+        long_store = snapshot_store.SnapshotStore(long_timestamps, ["a", "b"], np.zeros((len(long_timestamps), 2, 5)))
+        first_row, last_row = forecast.training_rows(long_store)
+        self.assertEqual(last_row - first_row, forecast.TRAINING_DAYS * 288)
+
+    def test_backtest(self):
+        store = snapshot_store.SnapshotStore(self.timestamps, ["a", "b"], self.values)
+        results = forecast.backtest(store, [30], num_ticks=20)
+        self.assertEqual(results["test_ticks"], 20)
+        self.assertLess(results["errors"]["bikes"]["30 min"]["forecast"]["mae"], 1e-6)
+        self.assertGreater(results["errors"]["bikes"]["30 min"]["persistence"]["mae"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import math
+import statistics
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from hourly_statistics import hourly_statistics
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        # Monday 2020-11-02 and Tuesday 2020-11-03, 08:00 and 09:00, plus Saturday 2020-11-07 08:00
+        self.timestamps = [datetime(2020, 11, day, hour).timestamp()
+                           for day, hour in [(2, 8), (2, 9), (3, 8), (3, 9), (7, 8)]]
+        self.values = np.array([[1, 10], [4, np.nan], [3, 12], [3, 13], [7, 7]])
+
+    def test_values(self):
+        averages, stdevs, counts = hourly_statistics(self.timestamps, self.values, False, False)
+        self.assertEqual(averages[8].tolist(), [2, 11])
+        self.assertAlmostEqual(stdevs[8, 0], statistics.stdev([1, 3]))
+        self.assertEqual(counts[9].tolist(), [2, 1])
+        self.assertTrue(math.isnan(stdevs[9, 1]))
+        self.assertTrue(math.isnan(averages[10, 0]))
+
+    def test_rate_of_change(self):
+        averages, stdevs, counts = hourly_statistics(self.timestamps, self.values, False, True)
+        # Monday 09:00 -> Tuesday 08:00 is not a one hour change, so only 08:00 -> 09:00 is counted
+        self.assertEqual(averages[8, 0], 1.5)
+        self.assertEqual(counts[8].tolist(), [2, 1])
+        self.assertEqual(counts[9].tolist(), [0, 0])
+        averages, stdevs, counts = hourly_statistics(self.timestamps, self.values, True, True)
+        self.assertEqual(counts.sum(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+import snapshot_store
+from live_feed import RingBuffer, LiveFeed
+
+
+def raw_snapshot(stations):
+    """Builds a raw feed snapshot from (station ID, latitude, longitude, bikes, points) tuples."""
+    return {"features": [{"geometry": {"coordinates": [longitude, latitude]},
+                          "properties": {"station": {"id": station_id, "name": f"Station {station_id}",
+                                                     "installed": True, "renting": True, "returning": True,
+                                                     "bikes_available": bikes, "docks_available": 10 - bikes,
+                                                     "capacity": 10},
+                                         "bike_angels": {"score": points}}}
+                         for station_id, latitude, longitude, bikes, points in stations]}
+
+
+class Tester(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        buffer = RingBuffer(3, num_stations=1)
+        for timestamp in range(5):
+            buffer.append(timestamp, np.full((1, len(snapshot_store.FIELDS)), timestamp))
+        buffer.add_stations(2)
+        timestamps, values = buffer.ordered()
+        self.assertEqual(timestamps.tolist(), [2, 3, 4])
+        self.assertEqual(values[:, 0, snapshot_store.BIKES].tolist(), [2, 3, 4])
+        self.assertEqual(values[:, 1, snapshot_store.BIKES].tolist(), [snapshot_store.MISSING] * 3)
+        self.assertEqual(buffer.latest()[0], 4)
+
+    def test_best_moves(self):
+        feed = LiveFeed(10)
+        start = int(datetime(2020, 11, 2, 8).timestamp())
+        self.assertTrue(feed.add_snapshot(start, raw_snapshot([("3", 42.35, -71.06, 5, -1),
+                                                                ("4", 42.351, -71.06, 5, 2),
+                                                                ("5", 42.45, -71.06, 5, 3)])))
+        # snapshots that aren't newer than the last one and messages are skipped
+        self.assertFalse(feed.add_snapshot(start, raw_snapshot([])))
+        self.assertFalse(feed.add_snapshot(start + 300, {"message": "down for maintenance"}))
+        # station 5 is too far from the others to be paired with them
+        moves = feed.best_moves()
+        self.assertEqual([(move["start"], move["end"], move["gain"]) for move in moves["moves"]], [("3", "4", 3)])
+
+        # a new station is picked up by the next snapshot
+        feed.add_snapshot(start + 3600, raw_snapshot([("3", 42.35, -71.06, 4, 0), ("4", 42.351, -71.06, 6, 2),
+                                                      ("6", 42.352, -71.06, 1, -2)]))
+        moves = feed.best_moves(k=1)
+        self.assertEqual([(move["start"], move["end"]) for move in moves["moves"]], [("6", "4")])
+        self.assertEqual(feed.status()["snapshots"], 2)
+        # the hourly statistics got one sample per hour
+        averages, _, _ = feed.streams["points"].statistics(False)
+        self.assertEqual(averages[8].tolist()[:2], [-1, 2])
+        self.assertEqual(averages[9, [0, 1, 3]].tolist(), [0, 2, -2])
+        self.assertTrue(np.isnan(averages[9, 2]))
+
+    def test_warm_start_without_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            overall_stations_path = os.path.join(directory, "overall_stations.json")
+            with open(overall_stations_path, "w") as file_stream:
+                json.dump({"3": {"name": [[0, "Station 3"]], "coords": [[0, [42.35, -71.06]]],
+                                 "timestamp_added": 0}}, file_stream)
+            feed = LiveFeed(10)
+            feed.warm_start(os.path.join(directory, "snapshot_store"), overall_stations_path)
+        self.assertEqual(len(feed.buffer), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
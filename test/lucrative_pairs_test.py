@@ -0,0 +1,32 @@
+import unittest
+
+import numpy as np
+
+from lucrative_pairs import nearby_pair_arrays, lucrative_pair_mask, pair_segments, rank_routes
+
+
+class Tester(unittest.TestCase):
+
+    def test_lucrative_pairs(self):
+        nearby_i, nearby_j = nearby_pair_arrays([[1, 2], [2], []])
+        self.assertEqual(nearby_i.tolist(), [0, 0, 1])
+        self.assertEqual(nearby_j.tolist(), [1, 2, 2])
+        averages = np.array([[0, 2, -1], [1, 1, np.nan]])
+        self.assertEqual(lucrative_pair_mask(averages, nearby_i, nearby_j, 1.5).tolist(),
+                         [[True, False, True], [False, False, False]])
+        segments = pair_segments([10, 11, 12], [20, 21, 22], nearby_i, nearby_j)
+        self.assertEqual(segments[2].tolist(), [[21, 11], [22, 12]])
+
+    def test_rank_routes(self):
+        nearby_i, nearby_j = np.array([0, 0, 1]), np.array([1, 2, 2])
+        starts, ends, gains = rank_routes([0, 2, -1], nearby_i, nearby_j, True, k=2)
+        self.assertEqual(starts.tolist(), [2, 0])
+        self.assertEqual(ends.tolist(), [1, 1])
+        self.assertEqual(gains.tolist(), [3, 2])
+        # for the rate of change of bikes, bikes should be moved from the stations that are filling up
+        starts, ends, gains = rank_routes([0, 2, -1], nearby_i, nearby_j, False, k=1)
+        self.assertEqual((starts.tolist(), ends.tolist()), ([1], [2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+import matplotlib
+import numpy as np
+
+import map_station_trends
+import snapshot_store
+
+# stations 3 and 4 are next to each other, and station 5 is too far from them to be paired with them
+STATIONS = [("3", 42.35, -71.06, -1), ("4", 42.351, -71.06, 2), ("5", 42.3, -71.0, 3)]
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        matplotlib.use("Agg")
+        self.working_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.settings = (map_station_trends.USE_POINTS, map_station_trends.SHOW_RATE_OF_CHANGE,
+                         map_station_trends.USE_AGGREGATE_CACHE)
+
+    def tearDown(self):
+        (map_station_trends.USE_POINTS, map_station_trends.SHOW_RATE_OF_CHANGE,
+         map_station_trends.USE_AGGREGATE_CACHE) = self.settings
+        map_station_trends.plt.close("all")
+        os.chdir(self.working_dir)
+        self.temp_dir.cleanup()
+
+    def test_station_map_update(self):
+        figure, ax = map_station_trends.plt.subplots()
+        station_map = map_station_trends.StationMap(ax, np.zeros((4, 4, 3)), False, [-71.06, -71.0], [42.35, 42.3],
+                                                    ["3", "4"], True)
+        segments = [[[-71.06, 42.35], [-71.0, 42.3]]]
+        artists = station_map.update(8, ["r", "b"], [10, 20], segments, [-1, 2], [0.5, 1])
+        self.assertEqual(len(artists), 4)
+        self.assertEqual(station_map.scatter.get_sizes().tolist(), [10, 20])
+        np.testing.assert_array_equal(station_map.lines.get_segments()[0], segments[0])
+        self.assertIn("8", station_map.title.get_text())
+        # the animated artists are drawn for a still image once they are no longer animated
+        for artist in station_map.artists():
+            artist.set_animated(False)
+        figure.savefig("frame.png")
+        self.assertGreater(os.path.getsize("frame.png"), 0)
+
+    def test_frames_dir(self):
+        # hourly snapshots over three weekdays, with constant points
+        start = int(datetime(2020, 11, 2).timestamp())
+        timestamps = start + 3600 * np.arange(72)
+        values = np.zeros((len(timestamps), len(STATIONS), len(snapshot_store.FIELDS)), dtype=np.int16)
+        values[:, :, snapshot_store.IS_ACTIVE] = 1
+        values[:, :, snapshot_store.CAPACITY] = 10
+        values[:, :, snapshot_store.POINTS] = [points for *_, points in STATIONS]
+        snapshot_store.write_store(timestamps, [station_id for station_id, *_ in STATIONS], values)
+        with open("data/overall_stations.json", "w") as file_stream:
+            json.dump({station_id: {"name": [[start, f"Station {station_id}"]],
+                                    "coords": [[start, [latitude, longitude]]], "timestamp_added": start}
+                       for station_id, latitude, longitude, _ in STATIONS}, file_stream)
+        os.mkdir("images")
+        map_station_trends.plt.imsave("images/map.png", np.zeros((4, 4, 3)))
+
+        argv = sys.argv
+        sys.argv = ["map_station_trends.py", "points", "--frames-dir", "frames", "--no-cache"]
+        try:
+            map_station_trends.main()
+        finally:
+            sys.argv = argv
+        self.assertEqual(sorted(os.listdir("frames")), [f"{hour:02}.png" for hour in range(24)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+import snapshot_store
+from hourly_statistics import hourly_statistics
+from online_statistics import HourlyAccumulator, HourlyStatisticsStream, WEEKDAY, feed_store
+from time_buckets import build_bucket_index
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        # Monday 2020-11-02 and Tuesday 2020-11-03, 08:00 and 09:00, plus Saturday 2020-11-07 08:00
+        self.timestamps = [datetime(2020, 11, day, hour).timestamp()
+                           for day, hour in [(2, 8), (2, 9), (3, 8), (3, 9), (7, 8)]]
+        self.values = np.array([[1, 10], [4, np.nan], [3, 12], [3, 13], [7, 7]])
+
+    def test_merge(self):
+        merged = HourlyAccumulator(2)
+        merged.add([WEEKDAY] * 2, [8, 8], self.values[:2])
+        other = HourlyAccumulator(2)
+        other.add([WEEKDAY] * 3, [8, 8, 8], self.values[2:])
+        merged.merge(other)
+        direct = HourlyAccumulator(2)
+        direct.add([WEEKDAY] * 5, [8] * 5, self.values)
+        for merged_array, direct_array in zip(merged.statistics(WEEKDAY), direct.statistics(WEEKDAY)):
+            np.testing.assert_allclose(merged_array, direct_array)
+
+    def test_stream_matches_batch(self):
+        for rate_of_change in [False, True]:
+            stream = HourlyStatisticsStream(["3", "4"], rate_of_change)
+            # feeding the samples in parts gives the same result as calculating them all at once
+            stream.update(self.timestamps[:1], self.values[:1])
+            stream.update(self.timestamps[1:4], self.values[1:4])
+            stream.update(self.timestamps[4:], self.values[4:])
+            for is_weekend in [False, True]:
+                expected = hourly_statistics(self.timestamps, self.values, is_weekend, rate_of_change)
+                for actual_array, expected_array in zip(stream.statistics(is_weekend), expected):
+                    np.testing.assert_allclose(actual_array, expected_array)
+
+    def test_sparse_station(self):
+        stream = HourlyStatisticsStream(["3", "4"], False)
+        stream.update(self.timestamps, self.values)
+        averages, stdevs, counts = stream.statistics(False)
+        # station 4 only has one sample at 09:00, which has an average but no standard deviation
+        self.assertEqual(averages[9, 1], 13)
+        self.assertTrue(np.isnan(stdevs[9, 1]))
+        self.assertTrue(np.isnan(averages[10, 1]))
+        self.assertEqual(stream.station_sample_counts.tolist(), [5, 4])
+
+    def test_save_and_load(self):
+        stream = HourlyStatisticsStream(["3", "4"], True)
+        stream.update(self.timestamps[:1], self.values[:1])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stream.npz")
+            stream.save(path)
+            loaded = HourlyStatisticsStream.load(path)
+        # the change from the last saved sample to the next one is still counted after loading
+        loaded.update(self.timestamps[1:], self.values[1:])
+        stream.update(self.timestamps[1:], self.values[1:])
+        self.assertEqual(loaded.station_ids, ["3", "4"])
+        for loaded_array, array in zip(loaded.statistics(False), stream.statistics(False)):
+            np.testing.assert_allclose(loaded_array, array)
+
+    def test_feed_store(self):
+        records = [(int(timestamp), {"3": [True, int(bikes), 0, 10, 0]}) for timestamp, bikes
+                   in zip(self.timestamps, self.values[:, 0])]
+        store = snapshot_store.SnapshotStore(*snapshot_store.records_to_arrays(records[:3]))
+        stream = feed_store(HourlyStatisticsStream([], True), store, build_bucket_index(store.timestamps),
+                            snapshot_store.BIKES, chunk_size=2)
+        # snapshots (and a new station) added to the store later are fed to the stream on its next update
+        records[3][1]["4"] = [True, 5, 0, 10, 0]
+        store = snapshot_store.SnapshotStore(*snapshot_store.records_to_arrays(records))
+        stream = feed_store(stream, store, build_bucket_index(store.timestamps), snapshot_store.BIKES, chunk_size=2)
+        self.assertEqual(stream.station_ids, ["3", "4"])
+        averages, _, counts = stream.statistics(False)
+        self.assertEqual(averages[8, 0], 1.5)
+        self.assertEqual(counts[8].tolist(), [2, 0])
+
+    def test_feed_rebuilt_store(self):
+        records = [(int(timestamp), {"3": [True, int(bikes), 0, 10, 0]}) for timestamp, bikes
+                   in zip(self.timestamps, self.values[:, 0])]
+        # a snapshot backfilled into the middle of a rebuilt store isn't skipped
+        store = snapshot_store.SnapshotStore(*snapshot_store.records_to_arrays(records[:1] + records[2:]))
+        stream = feed_store(HourlyStatisticsStream([], True), store, build_bucket_index(store.timestamps),
+                            snapshot_store.BIKES)
+        store = snapshot_store.SnapshotStore(*snapshot_store.records_to_arrays(records))
+        stream = feed_store(stream, store, build_bucket_index(store.timestamps), snapshot_store.BIKES)
+        fresh = feed_store(HourlyStatisticsStream([], True), store, build_bucket_index(store.timestamps),
+                           snapshot_store.BIKES)
+        self.assertEqual(stream.station_sample_counts.tolist(), fresh.station_sample_counts.tolist())
+        for array, fresh_array in zip(stream.statistics(False), fresh.statistics(False)):
+            np.testing.assert_allclose(array, fresh_array)
+
+
+if __name__ == '__main__':
+    unittest.main()
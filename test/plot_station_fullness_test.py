@@ -1,6 +1,15 @@
+import os
+import tempfile
 import unittest
+from datetime import datetime
+from zoneinfo import ZoneInfo
 
-from plot_station_fullness import split_dates_and_modulo_time
+import matplotlib
+import numpy as np
+
+import plot_station_fullness
+import snapshot_store
+from plot_station_fullness import split_dates_and_modulo_time, split_days
 
 
 class Tester(unittest.TestCase):
@@ -10,6 +19,37 @@ class Tester(unittest.TestCase):
                                                      date_lambda=lambda x: x // 2, time_lambda=lambda x: x % 2),
                          [[[0, 1], [1, 1], [3, 3]], [[0, 1], [2, 2], [4, 4]]])
 
+    def test_split_days(self):
+        time_zone = ZoneInfo("America/New_York")
+        timestamps = [datetime(2020, 11, day, hour, minute, tzinfo=time_zone).timestamp()
+                      for day, hour, minute in [(2, 8, 0), (2, 9, 30), (2, 23, 59), (4, 0, 15)]]
+        days, times, matrices = split_days(timestamps, [[1, 2, 3, 4]], time_zone)
+        self.assertEqual(days.tolist(), [18568, 18570])
+        np.testing.assert_array_equal(times, [[8, 9.5, 23 + 59 / 60], [0.25, np.nan, np.nan]])
+        np.testing.assert_array_equal(matrices[0], [[1, 2, 3], [4, np.nan, np.nan]])
+
+    def test_export_station_plots(self):
+        matplotlib.use("Agg")
+        # two days of snapshots of station 3, which station 4 is missing from
+        timestamps = int(datetime(2020, 11, 2).timestamp()) + 300 * np.arange(576)
+        values = np.zeros((len(timestamps), 2, len(snapshot_store.FIELDS)), dtype=snapshot_store.VALUES_DTYPE)
+        values[:, :, snapshot_store.CAPACITY] = 10
+        values[:, :, snapshot_store.BIKES] = (np.arange(len(timestamps)) % 10)[:, np.newaxis]
+        values[:, 1, :] = snapshot_store.MISSING
+        with tempfile.TemporaryDirectory() as directory:
+            plot_station_fullness.batch_store = snapshot_store.SnapshotStore(timestamps, ["3", "4"], values)
+            plot_station_fullness.batch_station_names = {"3": "Station 3", "4": "Station 4"}
+            plot_station_fullness.batch_output_dir = directory
+            plot_station_fullness.batch_file_format = "png"
+            plot_station_fullness.batch_time_zone = None
+            plot_station_fullness.batch_time_range = (None, None)
+            # the station that can't be plotted is reported, and the rest are still saved
+            results = plot_station_fullness.export_station_plots(["4", "3"])
+            self.assertEqual([station_id for station_id, _ in results], ["4", "3"])
+            self.assertIsNotNone(results[0][1])
+            self.assertIsNone(results[1][1])
+            self.assertEqual(os.listdir(directory), ["3.png"])
+
 
 if __name__ == '__main__':
     unittest.main()
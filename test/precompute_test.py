@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+import precompute
+import snapshot_store
+import station_trends
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        # a snapshot every 20 minutes for two weeks, with some stations missing from some snapshots
+        random = np.random.default_rng(0)
+        start = int(datetime(2020, 11, 2).timestamp())
+        timestamps = start + 1200 * np.arange(3 * 24 * 14)
+        station_ids = ["3", "4", "5", "6"]
+        values = random.integers(0, 10, (len(timestamps), len(station_ids), len(snapshot_store.FIELDS)))
+        values = values.astype(snapshot_store.VALUES_DTYPE)
+        values[random.random((len(timestamps), len(station_ids))) < 0.1] = snapshot_store.MISSING
+        snapshot_store.write_store(timestamps, station_ids, values)
+        with open("data/overall_stations.json", "w") as file_stream:
+            json.dump({station_id: {"name": [[start, f"Station {station_id}"]],
+                                    "coords": [[start, [42.35 + 0.001 * i, -71.06]]], "timestamp_added": start}
+                       for i, station_id in enumerate(station_ids)}, file_stream)
+        self.max_chunk_hours = precompute.MAX_CHUNK_HOURS
+
+    def tearDown(self):
+        precompute.MAX_CHUNK_HOURS = self.max_chunk_hours
+        os.chdir(self.working_dir)
+        self.temp_dir.cleanup()
+
+    def test_precompute(self):
+        # small chunks, so that the changes in bikes span chunk boundaries
+        precompute.MAX_CHUNK_HOURS = 50
+        scenarios = precompute.precompute(["first", "mean"], jobs=2)
+        self.assertEqual(len(scenarios), 8)
+        self.assertIn("bikes-weekend-mean", scenarios)
+
+        store = snapshot_store.load_store()
+        precomputed = station_trends.load_precomputed()
+        for data_type in station_trends.DATA_TYPES:
+            for is_weekend in [False, True]:
+                for policy in ["first", "mean"]:
+                    station_ids, averages, stdevs, counts = station_trends.hourly_statistics(
+                        store, data_type, is_weekend, policy, use_cache=False)
+                    saved = precomputed[station_trends.hourly_statistics_key(store, data_type, is_weekend, policy)]
+                    self.assertEqual(saved["station_ids"].tolist(), station_ids)
+                    np.testing.assert_allclose(saved["averages"], averages, atol=1e-12)
+                    np.testing.assert_allclose(saved["stdevs"], stdevs, atol=1e-12)
+                    np.testing.assert_array_equal(saved["counts"], counts)
+
+        # the viewers get the same lucrative lines from the artifact as they would compute
+        station_ids, averages, _, _ = station_trends.hourly_statistics(store, "bikes", False)
+        latitudes, longitudes = station_trends.station_coords_lists(station_ids, int(store.timestamps[-1]))
+        lines = station_trends.lucrative_station_pairs(station_ids, latitudes, longitudes, averages, "bikes")
+        expected = station_trends.lucrative_station_pairs(station_ids, latitudes, longitudes, averages, "bikes",
+                                                          use_cache=False)
+        for hourly_lines, expected_hourly_lines in zip(lines, expected):
+            np.testing.assert_array_equal(hourly_lines, expected_hourly_lines)
+        self.assertFalse(os.path.exists("data/cache"))
+
+    def test_version(self):
+        precompute.precompute(jobs=1)
+        self.assertEqual(len(station_trends.load_precomputed()), 8)
+        with np.load(station_trends.PRECOMPUTED_PATH) as saved:
+            arrays = dict(saved)
+        arrays["version"] = station_trends.PRECOMPUTED_VERSION + 1
+        np.savez(station_trends.PRECOMPUTED_PATH, **arrays)
+        self.assertEqual(station_trends.load_precomputed(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import copy
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import process_data
+import snapshot_store
+
+
+def raw_snapshot(stations):
+    """Builds a raw feed snapshot from (station ID, name, latitude, longitude, bikes) tuples."""
+    return {"features": [{"geometry": {"coordinates": [longitude, latitude]},
+                          "properties": {"station": {"id": station_id, "name": name, "installed": True,
+                                                     "renting": True, "returning": True, "bikes_available": bikes,
+                                                     "docks_available": 10 - bikes, "capacity": 10},
+                                         "bike_angels": {"score": bikes - 5}}}
+                         for station_id, name, latitude, longitude, bikes in stations]}
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        process_data.overall_stations = {}
+        self.working_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.working_dir)
+        self.temp_dir.cleanup()
+
+    def test_merge_station_history(self):
+        process_data.merge_station_history(100, {"3": ["Station 3", [42.35, -71.06]]})
+        process_data.merge_station_history(200, {"3": ["Renamed station 3", [42.35, -71.06]]})
+        process_data.merge_station_history(300, {"3": ["Renamed station 3", [42.36, -71.06]]})
+        # an interrupted run merges the same snapshots again
+        process_data.merge_station_history(200, {"3": ["Renamed station 3", [42.35, -71.06]]})
+        process_data.merge_station_history(300, {"3": ["Renamed station 3", [42.36, -71.06]]})
+        self.assertEqual(process_data.overall_stations, {"3": {
+            "name": [[100, "Station 3"], [200, "Renamed station 3"]],
+            "coords": [[100, [42.35, -71.06]], [300, [42.36, -71.06]]],
+            "timestamp_added": 100
+        }})
+
+    def test_pool_matches_serial(self):
+        os.makedirs(process_data.RAW_OUTPUT_DIR)
+        os.makedirs("data/processed_output")
+        # station 4 is renamed, station 3 moves, station 5 is added, and there is a message and an empty file
+        snapshots = [[("3", "Station 3", 42.35, -71.06, i % 10),
+                      ("4", "Station 4" if i < 5 else "Station four", 42.351, -71.06, 5)] for i in range(12)]
+        snapshots[7][0] = ("3", "Station 3", 42.36, -71.06, 7)
+        snapshots[9].append(("5", "Station 5", 42.45, -71.06, 2))
+        for i, stations in enumerate(snapshots):
+            contents = {"message": "maintenance"} if i == 3 else raw_snapshot(stations)
+            with open(f"{process_data.RAW_OUTPUT_DIR}/{1604318400 + 300 * i}.json", "w") as file_stream:
+                if i != 10:
+                    json.dump(contents, file_stream)
+        raw_snapshots = process_data.list_raw_snapshots()
+
+        records = []
+        for timestamp, filename in raw_snapshots:
+            if os.stat(f"{process_data.RAW_OUTPUT_DIR}/{filename}").st_size == 0:
+                continue
+            with open(f"{process_data.RAW_OUTPUT_DIR}/{filename}") as file_stream:
+                processed = process_data.process_file_contents(timestamp, json.load(file_stream))
+            if processed is not None:
+                records.append((timestamp, processed))
+        serial_stations = copy.deepcopy(process_data.overall_stations)
+        serial_arrays = snapshot_store.records_to_arrays(records)
+
+        # the same as process_data.main does
+        process_data.overall_stations = {}
+        records = []
+        with multiprocessing.Pool(2) as pool:
+            for result in pool.imap(process_data.parse_raw_file, raw_snapshots, chunksize=2):
+                if result is None:
+                    continue
+                timestamp, message, processed, station_details = result
+                if message is not None:
+                    continue
+                process_data.merge_station_history(timestamp, station_details)
+                records.append((timestamp, processed))
+        self.assertEqual(process_data.overall_stations, serial_stations)
+        self.assertEqual(len(serial_stations["4"]["name"]), 2)
+        self.assertEqual(len(serial_stations["3"]["coords"]), 3)
+        for array, serial_array in zip(snapshot_store.records_to_arrays(records), serial_arrays):
+            np.testing.assert_array_equal(array, serial_array)
+        self.assertEqual(len(serial_arrays[0]), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
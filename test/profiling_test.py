@@ -0,0 +1,43 @@
+import tempfile
+import tracemalloc
+import unittest
+
+import profiling
+
+
+class Tester(unittest.TestCase):
+
+    def tearDown(self):
+        profiling.enabled = False
+        profiling.records.clear()
+        profiling.cprofile_stages.clear()
+        tracemalloc.stop()
+
+    def test_disabled(self):
+        with profiling.stage("stage") as stage:
+            stage.count_files(["does not exist"])
+        self.assertEqual(profiling.records, [])
+
+    def test_stages(self):
+        profiling.enable()
+        with tempfile.NamedTemporaryFile() as file_stream:
+            file_stream.write(b"x" * 100)
+            file_stream.flush()
+            with profiling.stage("outer"):
+                with profiling.stage("inner"):
+                    profiling.count_files([file_stream.name])
+                    values = [0] * 100000
+                del values
+        outer, inner = profiling.records
+        self.assertEqual((outer["name"], outer["depth"], inner["name"], inner["depth"]), ("outer", 0, "inner", 1))
+        self.assertEqual((inner["files"], inner["bytes"], outer["files"]), (1, 100, 0))
+        # the list allocated in the inner stage counts towards the peak of both
+        self.assertGreaterEqual(inner["peak_memory_bytes"], 800000)
+        self.assertGreaterEqual(outer["peak_memory_bytes"], inner["peak_memory_bytes"])
+        self.assertGreaterEqual(outer["wall_seconds"], inner["wall_seconds"])
+        self.assertEqual([event["name"] for event in profiling.trace_events()["traceEvents"]], ["outer", "inner"])
+        self.assertIn("  inner", profiling.summary_table())
+
+
+if __name__ == '__main__':
+    unittest.main()
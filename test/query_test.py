@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+
+import query
+import snapshot_store
+
+# stations 3 and 4 are next to each other, and station 5 is too far from them to be paired with them
+STATIONS = [("3", 42.35, -71.06, -1), ("4", 42.351, -71.06, 2), ("5", 42.45, -71.06, 3)]
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        # hourly snapshots over three weekdays, with constant points
+        start = int(datetime(2020, 11, 2).timestamp())
+        timestamps = start + 3600 * np.arange(72)
+        values = np.zeros((len(timestamps), len(STATIONS), len(snapshot_store.FIELDS)), dtype=np.int16)
+        values[:, :, snapshot_store.IS_ACTIVE] = 1
+        values[:, :, snapshot_store.BIKES] = 5
+        values[:, :, snapshot_store.CAPACITY] = 10
+        values[:, :, snapshot_store.POINTS] = [points for *_, points in STATIONS]
+        snapshot_store.write_store(timestamps, [station_id for station_id, *_ in STATIONS], values)
+        with open("data/overall_stations.json", "w") as file_stream:
+            json.dump({station_id: {"name": [[start, f"Station {station_id}"]],
+                                    "coords": [[start, [latitude, longitude]]], "timestamp_added": start}
+                       for station_id, latitude, longitude, _ in STATIONS}, file_stream)
+        self.engine = query.QueryEngine(use_cache=False)
+
+    def tearDown(self):
+        os.chdir(self.working_dir)
+        self.temp_dir.cleanup()
+
+    def test_queries(self):
+        self.assertEqual(query.run_query(self.engine, "ranking", hour=8),
+                         [[-1.0, 0.0, "3"], [2.0, 0.0, "4"], [3.0, 0.0, "5"]])
+        self.assertEqual(query.run_query(self.engine, "nearby"), [["3", "4"]])
+        self.assertEqual(query.run_query(self.engine, "routes", hour=8, k=5), [[3.0, "3", "4"]])
+        self.assertEqual(query.run_query(self.engine, "lucrative", hour=8), [[[-71.06, 42.35], [-71.06, 42.351]]])
+        # there are no weekend snapshots
+        self.assertEqual(query.run_query(self.engine, "ranking", hour=8, weekend="true"), [])
+        with self.assertRaises(ValueError):
+            query.run_query(self.engine, "ranking", data_type="docks", hour=8)
+
+    def test_reload_while_querying(self):
+        errors = []
+
+        def ask():
+            try:
+                for _ in range(20):
+                    self.assertEqual(query.run_query(self.engine, "routes", hour=8, k=5), [[3.0, "3", "4"]])
+            except Exception as exception:
+                errors.append(exception)
+
+        threads = [threading.Thread(target=ask) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        # the store seems to change, so the queries keep reloading it
+        for i in range(20):
+            os.utime(f"{snapshot_store.STORE_DIR}/meta.json", ns=(i, i))
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_server(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), query.make_request_handler(self.engine))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            server_url = f"http://127.0.0.1:{server.server_address[1]}"
+            self.assertEqual(json.loads(query.ask_server(server_url, "routes", {"hour": 8, "weekend": False})),
+                             [[3.0, "3", "4"]])
+            with self.assertRaises(Exception):
+                query.ask_server(server_url, "routes", {"hour": 24})
+
+            # the client only imports the standard library
+            client = ("import sys, query; sys.argv = sys.argv[1:]; query.main(); "
+                      "print('numpy' in sys.modules, 'station_trends' in sys.modules)")
+            output = subprocess.run([sys.executable, "-c", client, "query.py", "routes", "-H", "8", "--server",
+                                     server_url], cwd=self.working_dir, capture_output=True, text=True, check=True)
+            self.assertEqual(output.stdout.splitlines(), ['[[3.0, "3", "4"]]', "False False"])
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
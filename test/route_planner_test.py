@@ -0,0 +1,90 @@
+import unittest
+
+import numpy as np
+
+import spatial_index
+from route_planner import MAX_WALK_MILES, WALK_SPEED_MPH, RouteGraph, plan_itineraries
+
+# degrees of latitude per mile
+MILE = 1 / 69.05
+
+
+def brute_force_itineraries(graph, hour, latitude, longitude, time_budget_minutes, k, max_hops):
+    """:return: the k best itineraries of plan_itineraries, from all the itineraries there are"""
+    walk_miles = spatial_index.haversine_miles(latitude, longitude, graph.latitudes, graph.longitudes)
+    itineraries = []
+
+    def extend(path, elapsed, gain):
+        if len(path) > 1:
+            itineraries.append((gain, elapsed, path))
+        if len(path) > max_hops:
+            return
+        for edge in range(graph.indptr[path[-1]], graph.indptr[path[-1] + 1]):
+            target = int(graph.targets[edge])
+            ride_gain = graph.gains[hour, edge]
+            if ride_gain > 0 and target not in path and elapsed + graph.minutes[edge] <= time_budget_minutes:
+                extend(path + [target], elapsed + graph.minutes[edge], gain + ride_gain)
+
+    for station in np.flatnonzero(walk_miles <= MAX_WALK_MILES):
+        extend([int(station)], float(walk_miles[station]) / WALK_SPEED_MPH * 60, 0.0)
+    itineraries.sort(key=lambda itinerary: (itinerary[0], -itinerary[1]), reverse=True)
+    return [(gain, [graph.station_ids[station] for station in path]) for gain, _, path in itineraries[:k]]
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        # four stations about 0.07 miles apart in a line, where station 3 is only nearby station 2
+        latitudes = [42.35, 42.351, 42.352, 42.353]
+        longitudes = [-71.06] * 4
+        nearby_i = np.array([0, 0, 1, 2])
+        nearby_j = np.array([1, 2, 2, 3])
+        averages = np.zeros((24, 4))
+        averages[8] = [-1, 0, 1, 3]
+        self.graph = RouteGraph(["a", "b", "c", "d"], latitudes, longitudes, nearby_i, nearby_j, averages, True)
+
+    def test_adjacency(self):
+        self.assertEqual(self.graph.indptr.tolist(), [0, 2, 4, 7, 8])
+        self.assertEqual(self.graph.targets.tolist(), [1, 2, 0, 2, 0, 1, 3, 2])
+        self.assertEqual(self.graph.gains[8, :2].tolist(), [1, 2])
+
+    def test_plan_itineraries(self):
+        itineraries = plan_itineraries(self.graph, 8, 42.35, -71.06, 60, k=2)
+        # a -> b -> c -> d gains as much as a -> c -> d, but takes longer
+        self.assertEqual([(round(gain), path) for gain, _, path in itineraries],
+                         [(4, ["a", "c", "d"]), (4, ["a", "b", "c", "d"])])
+        # a -> b -> c gains as much as a -> c but takes longer, so it isn't extended any further for the best one
+        itineraries = plan_itineraries(self.graph, 8, 42.35, -71.06, 60, k=1)
+        self.assertEqual([path for _, _, path in itineraries], [["a", "c", "d"]])
+        # with too little time for more than one ride
+        itineraries = plan_itineraries(self.graph, 8, 42.35, -71.06, 3.2, k=1)
+        self.assertEqual([path for _, _, path in itineraries], [["a", "c"]])
+        # nothing is gained in other hours
+        self.assertEqual(plan_itineraries(self.graph, 9, 42.35, -71.06, 60), [])
+
+    def test_dominated_itinerary(self):
+        # stations in a line (miles north of s): from s, s -> q -> c reaches c sooner and with more gain than
+        # p -> c does (q is too far to walk to), but only p -> c has a ride left to the most lucrative station h
+        miles = {"s": 0, "q": 0.3, "c": 0.5, "p": -0.2, "h": 0.6}
+        averages = np.zeros((24, 5))
+        averages[8] = [-5, 0, 1, 0, 10]
+        graph = RouteGraph(list(miles), [42.35 + position * MILE for position in miles.values()], [-71.06] * 5,
+                           np.array([0, 1, 3, 2]), np.array([1, 2, 2, 4]), averages, True)
+        itineraries = plan_itineraries(graph, 8, 42.35, -71.06, 30, k=1, max_hops=2)
+        self.assertEqual([path for _, _, path in itineraries], [["p", "c", "h"]])
+
+        for graph_name, graph in [("line", self.graph), ("dominated", graph)]:
+            for k in [1, 2, 3, 10]:
+                for time_budget_minutes in [5, 10, 30]:
+                    for max_hops in [1, 2, 4]:
+                        with self.subTest(graph=graph_name, k=k, minutes=time_budget_minutes, max_hops=max_hops):
+                            itineraries = plan_itineraries(graph, 8, 42.35, -71.06, time_budget_minutes, k,
+                                                           max_hops)
+                            expected = brute_force_itineraries(graph, 8, 42.35, -71.06, time_budget_minutes, k,
+                                                               max_hops)
+                            self.assertEqual([(round(gain, 6), path) for gain, _, path in itineraries],
+                                             [(round(gain, 6), path) for gain, path in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+import snapshot_store
+from snapshot_codec import encode_block, decode_block, write_archive, read_archive
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        records = [(100000, {"3": [True, 5, 5, 10, 0], "4": [False, 0, 15, 15]}),
+                   (100300, {"3": [True, 4, 6, 10, -2]}),
+                   (200000, {"3": [False, 3, 7, 10, 127], "5": [True, 254, 0, 254, -127]})]
+        self.store = snapshot_store.SnapshotStore(*snapshot_store.records_to_arrays(records))
+
+    def test_encode_and_decode_block(self):
+        for compression in ["zlib", "none"]:
+            data = encode_block(self.store.timestamps, self.store.station_ids, self.store.values, compression)
+            timestamps, station_ids, values = decode_block(data)
+            self.assertEqual(timestamps.tolist(), self.store.timestamps.tolist())
+            self.assertEqual(station_ids, self.store.station_ids)
+            np.testing.assert_array_equal(values, self.store.values)
+
+    def test_out_of_range(self):
+        values = self.store.values.copy()
+        values[0, 0, snapshot_store.BIKES] = 300
+        with self.assertRaises(ValueError):
+            encode_block(self.store.timestamps, self.store.station_ids, values)
+
+    def test_write_and_read_archive(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            write_archive(self.store, archive_dir)
+            store = read_archive(archive_dir)
+        self.assertEqual(store.timestamps.tolist(), self.store.timestamps.tolist())
+        for station_id in self.store.station_ids:
+            np.testing.assert_array_equal(store.station_values(station_id), self.store.station_values(station_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
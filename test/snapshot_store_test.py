@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from snapshot_store import (records_to_arrays, write_store, append_to_store, load_store, load_snapshots,
+                            SnapshotStore, MISSING, BIKES, POINTS)
+
+
+class Tester(unittest.TestCase):
+
+    def test_write_and_load_store(self):
+        records = [(20, {"3": [True, 4, 5, 10, -1], "4": [False, 0, 0, 15]}),
+                   (10, {"3": [True, 5, 5, 10, 0]})]
+        timestamps, station_ids, values = records_to_arrays(records)
+        with tempfile.TemporaryDirectory() as store_dir:
+            write_store(timestamps, station_ids, values, store_dir=store_dir)
+            store = load_store(store_dir)
+            self.assertEqual(store.timestamps.tolist(), [10, 20])
+            self.assertEqual(store.station_ids, ["3", "4"])
+            self.assertEqual(store.station_values("3")[:, BIKES].tolist(), [5, 4])
+            self.assertEqual(store.station_values("4")[:, BIKES].tolist(), [MISSING, 0])
+            self.assertEqual(store.station_values("4")[:, POINTS].tolist(), [MISSING, MISSING])
+            self.assertTrue(np.array_equal(store.values, values))
+
+    def test_append_to_store(self):
+        records = [(10, {"3": [True, 5, 5, 10, 0]}),
+                   (20, {"3": [True, 4, 6, 10, 1]}),
+                   (30, {"3": [True, 3, 7, 10, 1], "4": [True, 1, 14, 15, 2]})]
+        with tempfile.TemporaryDirectory() as store_dir:
+            write_store(*records_to_arrays(records[:1]), store_dir=store_dir)
+            append_to_store(records[1:2], store_dir=store_dir)
+            # the already-stored snapshot at timestamp 20 is skipped, and station 4 is added as a new column
+            append_to_store(records[1:], store_dir=store_dir)
+            store = load_store(store_dir)
+            timestamps, station_ids, values = records_to_arrays(records)
+            self.assertEqual(store.timestamps.tolist(), timestamps.tolist())
+            self.assertEqual(store.station_ids, station_ids)
+            self.assertTrue(np.array_equal(store.values, values))
+
+    def test_load_snapshots(self):
+        records = [(10, {"3": [True, 5, 5, 10, 0]}),
+                   (20, {"3": [True, 4, 6, 10]}),
+                   (30, {"3": [True, 3, 7, 10, 1], "4": [True, 1, 14, 15, 2]})]
+        store = SnapshotStore(*records_to_arrays(records))
+        timestamps, values = load_snapshots(["4", "3", "5"], start=15, end=31, fields=[POINTS, BIKES], store=store)
+        self.assertEqual(timestamps.tolist(), [20, 30])
+        # station 4 is absent at 20, station 5 isn't in the store, and station 3 didn't report points at 20
+        np.testing.assert_array_equal(values, [[[np.nan, np.nan], [np.nan, 4], [np.nan, np.nan]],
+                                               [[2, 1], [1, 3], [np.nan, np.nan]]])
+        timestamps, values = load_snapshots(start=40, store=store)
+        self.assertEqual(values.shape, (0, 2, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+from geopy.distance import distance
+
+from spatial_index import haversine_miles, nearby_pairs
+
+
+class Tester(unittest.TestCase):
+
+    def test_haversine_miles(self):
+        coords1 = (42.3601, -71.0589)
+        coords2 = (42.3736, -71.1097)
+        self.assertAlmostEqual(haversine_miles(*coords1, *coords2), distance(coords1, coords2).miles, delta=0.01)
+
+    def test_nearby_pairs(self):
+        latitudes = [42.34, 42.345, 42.36, 42.3401, 42.50]
+        longitudes = [-71.10, -71.07, -71.065, -71.0905, -71.10]
+        expected = [(i, j) for i in range(len(latitudes)) for j in range(i + 1, len(latitudes))
+                    if distance((latitudes[i], longitudes[i]), (latitudes[j], longitudes[j])).miles < 1]
+        i, j = nearby_pairs(latitudes, longitudes, 1)
+        self.assertEqual(list(zip(i.tolist(), j.tolist())), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import math
+import os
+import tempfile
+import unittest
+
+import station_registry
+
+OVERALL_STATIONS = {
+    "1": {"name": [[100, "A"], [300, "A2"]], "coords": [[100, [42.0, -71.0]]], "timestamp_added": 100},
+    "2": {"name": [[200, "B"]], "coords": [[200, [42.1, -71.1]], [250, [42.2, -71.2]], [400, [42.3, -71.3]]],
+          "timestamp_added": 200}
+}
+
+
+class Tester(unittest.TestCase):
+
+    def test_lookups(self):
+        registry = station_registry.StationRegistry(OVERALL_STATIONS)
+        self.assertEqual([registry.name("1", time) for time in [99, 100, 299, 300, None]],
+                         [None, "A", "A", "A2", "A2"])
+        self.assertEqual([registry.location("2", time) for time in [199, 200, 260, 400]],
+                         [None, (42.1, -71.1), (42.2, -71.2), (42.3, -71.3)])
+        self.assertEqual(registry.names_as_of(["2", "1"], 150), {"1": "A", "2": None})
+
+        latitudes, longitudes = registry.coords_as_of(150)
+        self.assertEqual(latitudes[0], 42.0)
+        self.assertTrue(math.isnan(latitudes[1]) and math.isnan(longitudes[1]))
+        latitudes, longitudes = registry.coords_as_of(None, ["2"])
+        self.assertEqual((latitudes.tolist(), longitudes.tolist()), ([42.3], [-71.3]))
+        # one time per station
+        latitudes, _ = registry.coords_as_of([100, 250])
+        self.assertEqual(latitudes.tolist(), [42.0, 42.2])
+
+    def test_load_registry(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = f"{temp_dir}/overall_stations.json"
+            with open(path, "w") as file_stream:
+                json.dump(OVERALL_STATIONS, file_stream)
+            registry = station_registry.load_registry(path)
+            self.assertIs(station_registry.load_registry(path), registry)
+            with open(path, "w") as file_stream:
+                json.dump({"3": OVERALL_STATIONS["1"]}, file_stream)
+            os.utime(path, ns=(0, 0))
+            self.assertEqual(station_registry.load_registry(path).station_ids, ["3"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+import aggregate_cache
+import snapshot_store
+import station_trends
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        os.mkdir("data")
+
+    def tearDown(self):
+        os.chdir(self.working_dir)
+        self.temp_dir.cleanup()
+
+    def test_lucrative_station_pairs_without_cache(self):
+        averages = np.zeros((24, 3))
+        averages[8] = [-1, 2, 3]
+        lines = station_trends.lucrative_station_pairs(["3", "4", "5"], [42.35, 42.351, 42.45], [-71.06] * 3,
+                                                       averages, "points", use_cache=False)
+        np.testing.assert_array_equal(lines[8], [[[-71.06, 42.35], [-71.06, 42.351]]])
+        self.assertEqual(sum(len(hourly_lines) for hourly_lines in lines), 1)
+        # neither the nearby pairs nor the lines were cached
+        self.assertEqual(os.listdir("data"), [])
+
+    def test_hourly_statistics_cache(self):
+        # hourly snapshots from Friday 2020-11-06 to Sunday 2020-11-08, then one on Tuesday 2020-11-10 08:00
+        timestamps = int(datetime(2020, 11, 6).timestamp()) + 3600 * np.arange(72)
+        timestamps = np.append(timestamps, int(datetime(2020, 11, 10, 8).timestamp()))
+        values = np.zeros((len(timestamps), 2, len(snapshot_store.FIELDS)), dtype=np.int16)
+        values[:, :, snapshot_store.IS_ACTIVE] = 1
+        values[:, :, snapshot_store.BIKES] = np.arange(len(timestamps))[:, np.newaxis] % 5
+        values[:, :, snapshot_store.CAPACITY] = 10
+        keys = []
+        for num_snapshots in [len(timestamps) - 1, len(timestamps)]:
+            snapshot_store.write_store(timestamps[:num_snapshots], ["3", "4"], values[:num_snapshots])
+            store = snapshot_store.load_store()
+            keys.append({(data_type, is_weekend): station_trends.hourly_statistics_key(store, data_type, is_weekend)
+                         for data_type in station_trends.DATA_TYPES for is_weekend in [False, True]})
+            for data_type, is_weekend in keys[-1]:
+                station_trends.hourly_statistics(store, data_type, is_weekend)
+        # appending the weekday snapshot only invalidated the weekday statistics, so the weekend ones are still cached
+        for data_type in station_trends.DATA_TYPES:
+            self.assertNotEqual(keys[0][data_type, False], keys[1][data_type, False])
+            self.assertEqual(keys[0][data_type, True], keys[1][data_type, True])
+        self.assertEqual(len(os.listdir(aggregate_cache.CACHE_DIR)), 6)
+        # a snapshot in the middle of the last weekend hour only changes the statistics of the policies that read it
+        weekend_keys = [station_trends.hourly_statistics_key(store, "points", True, policy)
+                        for policy in ["first", "mean"]]
+        snapshot_store.write_store(np.insert(timestamps, 72, timestamps[71] + 1800), ["3", "4"],
+                                   np.insert(values, 72, values[71], axis=0))
+        store = snapshot_store.load_store()
+        self.assertEqual(station_trends.hourly_statistics_key(store, "points", True, "first"), weekend_keys[0])
+        self.assertNotEqual(station_trends.hourly_statistics_key(store, "points", True, "mean"), weekend_keys[1])
+
+if __name__ == '__main__':
+    unittest.main()
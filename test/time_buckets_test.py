@@ -0,0 +1,44 @@
+import tempfile
+import unittest
+from datetime import datetime
+
+import snapshot_store
+from time_buckets import build_bucket_index, update_bucket_index, load_bucket_index, downsample
+
+
+class Tester(unittest.TestCase):
+
+    def setUp(self):
+        start = int(datetime(2020, 11, 2, 8).timestamp())
+        # snapshots every 20 minutes, with station 4 missing from the second one
+        self.records = [(start + 1200 * i, {"3": [True, i, 10 - i, 10, 0], "4": [True, 2 * i, 0, 20]})
+                        for i in range(7)]
+        del self.records[1][1]["4"]
+
+    def test_downsample(self):
+        timestamps, station_ids, values = snapshot_store.records_to_arrays(self.records)
+        store = snapshot_store.SnapshotStore(timestamps, station_ids, values)
+        index = build_bucket_index(timestamps)
+        self.assertEqual(index.row_starts.tolist(), [0, 3, 6])
+        self.assertEqual(downsample(store, index, snapshot_store.BIKES, "first").tolist(), [[0, 0], [3, 6], [6, 12]])
+        self.assertEqual(downsample(store, index, snapshot_store.BIKES, "last").tolist(), [[2, 4], [5, 10], [6, 12]])
+        self.assertEqual(downsample(store, index, snapshot_store.BIKES, "mean").tolist(), [[1, 2], [4, 8], [6, 12]])
+        self.assertEqual(downsample(store, index, snapshot_store.BIKES, "max").tolist(), [[2, 4], [5, 10], [6, 12]])
+        points = downsample(store, index, snapshot_store.POINTS, "min", missing_field_value=-1)
+        self.assertEqual(points.tolist(), [[0, -1], [0, -1], [0, -1]])
+
+    def test_update_bucket_index(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            snapshot_store.write_store(*snapshot_store.records_to_arrays(self.records[:2]), store_dir=store_dir)
+            update_bucket_index(snapshot_store.load_store(store_dir), store_dir=store_dir)
+            snapshot_store.append_to_store(self.records[2:], store_dir=store_dir)
+            store = snapshot_store.load_store(store_dir)
+            index = load_bucket_index(store, store_dir=store_dir)
+            expected = build_bucket_index(store.timestamps)
+            self.assertEqual(index.row_starts.tolist(), expected.row_starts.tolist())
+            self.assertEqual(index.bucket_numbers.tolist(), expected.bucket_numbers.tolist())
+            self.assertEqual(index.num_snapshots, len(store))
+
+
+if __name__ == '__main__':
+    unittest.main()
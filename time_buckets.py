@@ -0,0 +1,185 @@
+import os
+from datetime import datetime
+from datetime import timezone
+
+import numpy as np
+
+import snapshot_store
+
+SECONDS_PER_HOUR = 60 * 60
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+# 1970-01-01 was a Thursday
+EPOCH_WEEKDAY = 3
+# UTC offsets only change on (at least) quarter-hour boundaries, so they only need to be looked up once per quarter hour
+OFFSET_RESOLUTION = 15 * 60
+
+DOWNSAMPLING_POLICIES = ["first", "last", "mean", "min", "max"]
+# bucket sizes whose indexes are kept up to date at ingest time (any other size can still be indexed on demand,
+# which only needs the timestamp index of the store)
+INDEXED_BUCKET_SECONDS = [SECONDS_PER_HOUR]
+
+
+def utc_offsets(timestamps, time_zone=None):
+    """
+    :param timestamps: array of Unix timestamps
+    :param time_zone: tzinfo to use, or None for the local time zone (like datetime.fromtimestamp)
+    :return: array of the UTC offset (in seconds) at each timestamp
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    resolution_steps, inverse = np.unique(timestamps // OFFSET_RESOLUTION, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(step) * OFFSET_RESOLUTION, timezone.utc)
+                        .astimezone(time_zone).utcoffset().total_seconds()
+                        for step in resolution_steps], dtype=np.int64)
+    return offsets[inverse.reshape(timestamps.shape)]
+
+
+def local_time_fields(timestamps, time_zone=None):
+    """
+    Vectorized equivalent of calling datetime.fromtimestamp on every timestamp.
+
+    :return: arrays of the local day number (days since 1970-01-01), hour of the day and weekday (Monday is 0)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    local_timestamps = timestamps + utc_offsets(timestamps, time_zone)
+    days = local_timestamps // SECONDS_PER_DAY
+    hours = (local_timestamps % SECONDS_PER_DAY) // SECONDS_PER_HOUR
+    weekdays = (days + EPOCH_WEEKDAY) % 7
+    return days, hours, weekdays
+
+
+class BucketIndex:
+    def __init__(self, bucket_seconds, bucket_numbers, row_starts, num_snapshots):
+        """
+        :param bucket_seconds: length of each bucket (buckets are aligned to local midnight)
+        :param bucket_numbers: array of the bucket number (local time // bucket_seconds) of every non-empty bucket
+        :param row_starts: array of the first snapshot row in each bucket; the rows in bucket i are
+                           row_starts[i]:row_starts[i + 1] (or up to num_snapshots for the last bucket)
+        :param num_snapshots: number of snapshots covered by the index
+        """
+        self.bucket_seconds = bucket_seconds
+        self.bucket_numbers = bucket_numbers
+        self.row_starts = row_starts
+        self.num_snapshots = num_snapshots
+
+    def __len__(self):
+        return len(self.bucket_numbers)
+
+    @property
+    def row_ends(self):
+        return np.append(self.row_starts[1:], self.num_snapshots)
+
+    def local_start_times(self):
+        """Local start time of every bucket, as seconds since 1970-01-01 00:00 local time."""
+        return self.bucket_numbers * self.bucket_seconds
+
+    def subset(self, start, end):
+        """Index of only the buckets start:end."""
+        num_snapshots = int(self.row_starts[end]) if end < len(self) else self.num_snapshots
+        return BucketIndex(self.bucket_seconds, self.bucket_numbers[start:end], self.row_starts[start:end],
+                           num_snapshots)
+
+
+def build_bucket_index(timestamps, bucket_seconds=SECONDS_PER_HOUR, first_row=0, time_zone=None):
+    """
+    :param timestamps: array of snapshot timestamps (sorted ascending)
+    :param first_row: row number of timestamps[0] in the store (for indexing only the end of the store)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    bucket_numbers = (timestamps + utc_offsets(timestamps, time_zone)) // bucket_seconds
+    starts = np.flatnonzero(np.diff(bucket_numbers, prepend=bucket_numbers[:1] - 1) != 0)
+    return BucketIndex(bucket_seconds, bucket_numbers[starts], starts + first_row, first_row + len(timestamps))
+
+
+def bucket_index_path(store_dir, bucket_seconds):
+    return f"{store_dir}/buckets_{bucket_seconds}.npz"
+
+
+def load_bucket_index(store, bucket_seconds=SECONDS_PER_HOUR, store_dir=snapshot_store.STORE_DIR):
+    """
+    Loads the bucket index saved for the store, only indexing the snapshots added since it was saved
+    (or all of them, if it hasn't been saved).
+    """
+    try:
+        with np.load(bucket_index_path(store_dir, bucket_seconds)) as saved:
+            index = BucketIndex(bucket_seconds, saved["bucket_numbers"], saved["row_starts"],
+                                int(saved["num_snapshots"]))
+            last_timestamp = int(saved["last_timestamp"])
+    except FileNotFoundError:
+        index = None
+    # the store may have been rebuilt since the index was saved
+    if (index is None or index.num_snapshots > len(store) or
+            (index.num_snapshots > 0 and store.timestamps[index.num_snapshots - 1] != last_timestamp)):
+        return build_bucket_index(store.timestamps, bucket_seconds)
+    if index.num_snapshots == len(store):
+        return index
+
+    # the last saved bucket might continue into the new snapshots, so it's rebuilt along with them
+    if len(index) > 0:
+        first_row = int(index.row_starts[-1])
+        kept_numbers, kept_starts = index.bucket_numbers[:-1], index.row_starts[:-1]
+    else:
+        first_row = 0
+        kept_numbers, kept_starts = index.bucket_numbers, index.row_starts
+    tail = build_bucket_index(store.timestamps[first_row:], bucket_seconds, first_row=first_row)
+    return BucketIndex(bucket_seconds, np.concatenate([kept_numbers, tail.bucket_numbers]),
+                       np.concatenate([kept_starts, tail.row_starts]), len(store))
+
+
+def update_bucket_index(store, bucket_seconds=SECONDS_PER_HOUR, store_dir=snapshot_store.STORE_DIR):
+    """Brings the saved bucket index up to date with the store (called at ingest time)."""
+    index = load_bucket_index(store, bucket_seconds, store_dir)
+    path = bucket_index_path(store_dir, bucket_seconds)
+    last_timestamp = store.timestamps[-1] if len(store) > 0 else 0
+    np.savez(f"{path}.tmp.npz", bucket_numbers=index.bucket_numbers, row_starts=index.row_starts,
+             num_snapshots=index.num_snapshots, last_timestamp=last_timestamp)
+    os.replace(f"{path}.tmp.npz", path)
+    return index
+
+
+def downsample(store, index, field, policy="first", missing_field_value=np.nan, chunk_size=1024):
+    """
+    Downsamples one field of the store to one value per bucket for every station.
+
+    :param field: the field number (e.g. snapshot_store.BIKES)
+    :param policy: one of DOWNSAMPLING_POLICIES: the first/last snapshot in each bucket
+                   (only those rows are read), or the mean/min/max over all the snapshots in each bucket
+    :param missing_field_value: value to use when a station is present but didn't report the field (e.g. points)
+    :return: (bucket x station) array, with NaN where a station isn't present in the bucket
+    """
+    if policy not in DOWNSAMPLING_POLICIES:
+        raise ValueError(f"unknown downsampling policy {policy}")
+    if policy in ["first", "last"]:
+        rows = index.row_starts if policy == "first" else index.row_ends - 1
+        return field_values(store.values[rows], field, missing_field_value)
+
+    result = np.empty((len(index), len(store.station_ids)))
+    # go through the store a chunk of buckets at a time, so that memory use doesn't grow with the archive
+    for start in range(0, len(index), chunk_size):
+        end = min(start + chunk_size, len(index))
+        first_row = int(index.row_starts[start])
+        last_row = int(index.row_starts[end]) if end < len(index) else index.num_snapshots
+        chunk = field_values(store.values[first_row:last_row], field, missing_field_value)
+        offsets = index.row_starts[start:end] - first_row
+        present = ~np.isnan(chunk)
+        if policy == "mean":
+            with np.errstate(invalid="ignore"):
+                result[start:end] = (np.add.reduceat(np.where(present, chunk, 0), offsets) /
+                                     np.add.reduceat(present.astype(np.int64), offsets))
+        elif policy == "min":
+            result[start:end] = np.minimum.reduceat(np.where(present, chunk, np.inf), offsets)
+        else:
+            result[start:end] = np.maximum.reduceat(np.where(present, chunk, -np.inf), offsets)
+    result[np.isinf(result)] = np.nan
+    return result
+
+
+def field_values(values, field, missing_field_value=np.nan):
+    """
+    :param values: (snapshot x station x field) array of snapshot store values
+    :return: (snapshot x station) float array of one field, with NaN where a station is absent
+    """
+    present = values[:, :, snapshot_store.BIKES] != snapshot_store.MISSING
+    column = values[:, :, field].astype(np.float64)
+    column[column == snapshot_store.MISSING] = missing_field_value
+    column[~present] = np.nan
+    return column